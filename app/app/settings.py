@@ -97,6 +97,22 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# Local memory by default. Point CACHE_BACKEND and CACHE_LOCATION at a
+# shared cache (e.g. memcached) to share entries between workers.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -134,11 +150,18 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
 STATIC_URL = '/static/static/'
-MEDIA_URL = '/static/media/'
+# Media is only served to the owners of the recipes using it, see
+# recipe.views.RecipeMediaView
+MEDIA_URL = '/api/recipe/media/'
 
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# Internal location of the proxy serving MEDIA_ROOT. When set, media
+# requests are answered with an X-Accel-Redirect to it once access is
+# checked, otherwise Django sends the files.
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -148,6 +171,103 @@ AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Use orjson for JSON when it is installed, see core.renderers
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Default number of recipes per page of the recipe list API
+RECIPE_PAGE_SIZE = int(os.environ.get('RECIPE_PAGE_SIZE', 25))
+
+# Token authentication cache. Resolved tokens are kept for
+# TOKEN_AUTH_CACHE_TTL seconds in the entry of CACHES named by
+# TOKEN_AUTH_SHARED_CACHE, or per process when it is unset. Per process
+# copies outlive a deleted token or deactivated user in other processes
+# until they expire, so multi-process deployments should set it. Bulk
+# updates of users bypass signals and must call
+# user.authentication.invalidate_user_tokens.
+TOKEN_AUTH_CACHE_SIZE = int(os.environ.get('TOKEN_AUTH_CACHE_SIZE', 10000))
+TOKEN_AUTH_CACHE_TTL = int(os.environ.get('TOKEN_AUTH_CACHE_TTL', 60))
+TOKEN_AUTH_SHARED_CACHE = os.environ.get('TOKEN_AUTH_SHARED_CACHE') or None
+
+# Tag and ingredient name suggestions. Indexes of the names of this
+# many users are kept per process, valid until the user's data version
+# changes or for NAME_SUGGESTION_CACHE_TTL seconds. 0 queries every time.
+NAME_SUGGESTION_CACHE_SIZE = int(
+    os.environ.get('NAME_SUGGESTION_CACHE_SIZE', 1000)
+)
+NAME_SUGGESTION_CACHE_TTL = int(
+    os.environ.get('NAME_SUGGESTION_CACHE_TTL', 300)
+)
+
+# Pantry matching. Indexes of the recipe ingredients of this many users
+# are kept per process, taking at most PANTRY_INDEX_CACHE_MAX_BYTES,
+# kept up to date by the writes of the process and rebuilt after other
+# writes or PANTRY_INDEX_CACHE_TTL seconds. 0 builds one per request.
+PANTRY_INDEX_CACHE_SIZE = int(os.environ.get('PANTRY_INDEX_CACHE_SIZE', 100))
+PANTRY_INDEX_CACHE_TTL = int(os.environ.get('PANTRY_INDEX_CACHE_TTL', 600))
+PANTRY_INDEX_CACHE_MAX_BYTES = int(
+    os.environ.get('PANTRY_INDEX_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+)
+
+# Cache alias used for recipe list and detail responses, disabled when
+# empty. Entries are invalidated by the user's data version.
+RECIPE_RESPONSE_CACHE = os.environ.get('RECIPE_RESPONSE_CACHE') or None
+RECIPE_RESPONSE_CACHE_TTL = int(
+    os.environ.get('RECIPE_RESPONSE_CACHE_TTL', 300)
+)
+# Each process logs its hits and misses every this many lookups
+RECIPE_RESPONSE_CACHE_STATS_EVERY = int(
+    os.environ.get('RECIPE_RESPONSE_CACHE_STATS_EVERY', 1000)
+)
+
+# Renditions generated for uploaded recipe images, by name and largest
+# side in pixels, and the worker threads generating them after the
+# upload. With no workers they are generated in the request instead.
+RECIPE_IMAGE_RENDITIONS = {
+    'thumb': 160,
+    'small': 480,
+    'large': 1200,
+}
+RECIPE_IMAGE_WORKERS = int(os.environ.get('RECIPE_IMAGE_WORKERS', 2))
+
+# Largest recipe image upload accepted, in bytes (the proxy's
+# client_max_body_size) and in pixels, checked before decoding.
+RECIPE_IMAGE_MAX_BYTES = int(
+    os.environ.get('RECIPE_IMAGE_MAX_BYTES', 10 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_PIXELS = int(
+    os.environ.get('RECIPE_IMAGE_MAX_PIXELS', 40_000_000)
+)
+
+# Recipe images are shared by content and deleted once unused, but not
+# before this many seconds after they were last saved, so an upload of
+# the same image not yet committed keeps it.
+RECIPE_IMAGE_GRACE_SECONDS = int(
+    os.environ.get('RECIPE_IMAGE_GRACE_SECONDS', 600)
+)
+
+# Records of the recipe app, e.g. response cache statistics, go to
+# the console where uWSGI collects them
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'recipe': {
+            'handlers': ['console'],
+            'level': os.environ.get('RECIPE_LOG_LEVEL', 'INFO'),
+        },
+    },
 }
 
 # For enabling upload image API in browsable interface
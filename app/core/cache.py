@@ -0,0 +1,75 @@
+"""
+In process caches.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded least recently used cache with a time to live.
+
+    With max_weight, entries are also evicted while the sum of
+    weigh(value) over the entries exceeds it.
+    """
+
+    def __init__(self, maxsize, ttl, max_weight=None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.weight = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pop(self, key=None):
+        """Remove key, or the oldest entry, with the lock held."""
+        if key is None:
+            _, entry = self._entries.popitem(last=False)
+        else:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def get(self, key):
+        """Return the value stored for key or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires, _ = entry
+            if expires <= time.monotonic():
+                self._pop(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store value for key, evicting the oldest entries when full.
+
+        A value heavier than max_weight on its own is not kept.
+        """
+        weight = self.weigh(value) if self.max_weight is not None else 0
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, weight)
+            self.weight += weight
+            while self._entries and (
+                len(self._entries) > self.maxsize
+                or self.max_weight is not None
+                and self.weight > self.max_weight
+            ):
+                self._pop()
+
+    def delete(self, key):
+        """Remove key from the cache."""
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
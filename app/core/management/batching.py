@@ -0,0 +1,42 @@
+"""
+Helpers for management commands processing rows in batches.
+"""
+import argparse
+
+
+def positive_int(value):
+    """Parse a positive integer."""
+    try:
+        parsed = int(value)
+    except ValueError:
+        parsed = 0
+    if parsed < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return parsed
+
+
+def add_batch_size_argument(parser, default, help):
+    """Add a --batch-size option which must be positive."""
+    parser.add_argument(
+        '--batch-size', type=positive_int, default=default, help=help,
+    )
+
+
+def iter_id_batches(queryset, size, *fields):
+    """Yield lists of (id, *fields) rows of queryset in id order.
+
+    Keyset pagination, so each batch is an index range scan and rows
+    written meanwhile are included or skipped depending on their id
+    only. Each batch is read after the previous one was processed.
+    """
+    queryset = queryset.order_by('id')
+    last_id = 0
+    while True:
+        rows = list(
+            queryset.filter(id__gt=last_id)
+            .values_list('id', *fields)[:size]
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
@@ -0,0 +1,59 @@
+"""
+Django command to compute the search vectors of existing recipes.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.management.batching import (
+    add_batch_size_argument, iter_id_batches,
+)
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    """Compute missing recipe search vectors in batches."""
+
+    help = (
+        'Compute the search vectors of the recipes which have none, such '
+        'as those created before full-text search was added, in batches '
+        'of one statement each. Search matches them by substring until '
+        'then. Only needed on PostgreSQL.'
+    )
+
+    def add_arguments(self, parser):
+        add_batch_size_argument(
+            parser, 1000, help='Recipes updated per statement.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        if connection.vendor != 'postgresql':
+            self.stdout.write(
+                'Search vectors are only maintained on PostgreSQL.'
+            )
+            return
+
+        pending = Recipe.objects.filter(search_vector__isnull=True)
+        start = time.perf_counter()
+        count = 0
+        # Each batch is a range scan of core_recipe_search_pending_idx
+        batches = iter_id_batches(pending, options['batch_size'], 'user_id')
+        for rows in batches:
+            # Writing search_vector has the trigger compute it
+            Recipe.objects.filter(
+                id__in=[id for id, _ in rows],
+            ).update(search_vector=None)
+            # Cached search responses are keyed by the data version
+            for user_id in {user_id for _, user_id in rows}:
+                get_user_model().objects.bump_data_version(user_id)
+            count += len(rows)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{count} recipes updated...')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Computed {count} search vectors in {elapsed:.1f} s.'
+        ))
@@ -0,0 +1,352 @@
+"""
+Django command to import recipes from NDJSON or CSV files.
+"""
+import csv
+import io
+import json
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from rest_framework import serializers
+from rest_framework.fields import SkipField, empty
+
+from core.management.batching import add_batch_size_argument
+from core.models import (
+    Recipe,
+    Tag,
+    Ingredient,
+    recipe_link,
+)
+from core.renderers import orjson
+from recipe.export import CSV_NAME_SEPARATOR
+from recipe.serializers import RecipeDetailSerializer, TagSerializer
+from recipe.similarity import update_signatures
+
+
+# Recipe columns read from each record, validated like the API does
+RECIPE_FIELDS = ['title', 'time_minutes', 'price', 'link', 'description']
+
+# Recipe columns written with their defaults
+DEFAULT_FIELDS = ['renditions']
+
+RELATIONS = {'tags': Tag, 'ingredients': Ingredient}
+
+
+class Command(BaseCommand):
+    """Import recipes for a user in batches."""
+
+    help = (
+        'Import recipes for a user from an NDJSON or CSV file in the '
+        'format written by the recipe export. Tags and ingredients are '
+        'matched by name and created when missing. The import runs in '
+        'one transaction, an invalid record imports nothing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='File to import, - reads standard input.',
+        )
+        parser.add_argument(
+            '--user', required=True,
+            help='Email of the user owning the recipes.',
+        )
+        parser.add_argument(
+            '--format', choices=['ndjson', 'csv'], dest='input_format',
+            help='Input format, by default guessed from the file name.',
+        )
+        add_batch_size_argument(
+            parser, 2000, help='Recipes inserted per batch.',
+        )
+        parser.add_argument(
+            '--no-copy', action='store_false', dest='copy',
+            help='Use INSERT instead of COPY on PostgreSQL.',
+        )
+
+    def _read_ndjson(self, stream):
+        """Yield the records of an NDJSON stream."""
+        loads = orjson.loads if orjson else json.loads
+        for line in stream:
+            if line.strip():
+                yield loads(line)
+
+    def _read_csv(self, stream):
+        """Yield the records of a CSV stream."""
+        for row in csv.DictReader(stream):
+            for relation in RELATIONS:
+                names = row.get(relation) or ''
+                row[relation] = [
+                    name for name in names.split(CSV_NAME_SEPARATOR) if name
+                ]
+            yield row
+
+    def _validate(self, record):
+        """Return the recipe fields and relation names of a record."""
+        if not isinstance(record, dict):
+            raise serializers.ValidationError('Expected an object.')
+
+        errors = {}
+        data = {}
+        for name in RECIPE_FIELDS:
+            try:
+                data[name] = self.fields[name].run_validation(
+                    record.get(name, empty),
+                )
+            except SkipField:
+                # Optional and missing
+                data[name] = Recipe._meta.get_field(name).get_default()
+            except serializers.ValidationError as exc:
+                errors[name] = exc.detail
+        for name in DEFAULT_FIELDS:
+            data[name] = Recipe._meta.get_field(name).get_default()
+
+        names = {}
+        for relation in RELATIONS:
+            items = record.get(relation) or []
+            try:
+                names[relation] = [
+                    self._validate_name(
+                        item.get('name', empty)
+                        if isinstance(item, dict) else item
+                    )
+                    for item in items
+                ]
+            except serializers.ValidationError as exc:
+                errors[relation] = exc.detail
+
+        if errors:
+            raise serializers.ValidationError(errors)
+        return data, names
+
+    def _validate_name(self, name):
+        """Return a validated tag or ingredient name."""
+        # The same few names come up again and again
+        if not isinstance(name, str):
+            return self.name_field.run_validation(name)
+        if name not in self.valid_names:
+            self.valid_names[name] = self.name_field.run_validation(name)
+        return self.valid_names[name]
+
+    def _resolve(self, model, names):
+        """Return the ids of the user's objects named in names.
+
+        Ids found in earlier batches are remembered, so each batch only
+        looks up and creates names it is the first to use.
+        """
+        known = self.known_ids[model]
+        missing = [name for name in dict.fromkeys(names) if name not in known]
+        if missing:
+            model.objects.bulk_create(
+                [model(user=self.user, name=name) for name in missing],
+                ignore_conflicts=True,
+            )
+            known.update(
+                model.objects.filter(
+                    user=self.user, name__in=missing,
+                ).values_list('name', 'id')
+            )
+        return known
+
+    def _copy(self, cursor, model, columns, rows):
+        """Insert rows into the table of model with COPY."""
+        buffer = io.StringIO()
+        # Quoting keeps empty strings from being read as NULL
+        csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+        buffer.seek(0)
+        quote = connection.ops.quote_name
+        cursor.copy_expert(
+            f'COPY {quote(model._meta.db_table)} '
+            f'({", ".join(quote(column) for column in columns)}) '
+            f'FROM STDIN WITH (FORMAT csv)',
+            buffer,
+        )
+
+    def _insert_copy(self, recipes, links):
+        """Insert a batch with COPY, taking ids from the sequence.
+
+        Return the ids of the recipes.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                'FROM generate_series(1, %s)',
+                [Recipe._meta.db_table, 'id', len(recipes)],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            fields = [
+                Recipe._meta.get_field(name)
+                for name in RECIPE_FIELDS + DEFAULT_FIELDS
+            ]
+            self._copy(
+                cursor,
+                Recipe,
+                ['id', 'user_id'] + [field.column for field in fields],
+                [
+                    [recipe_id, self.user.id] + [
+                        field.get_db_prep_save(data[field.name], connection)
+                        for field in fields
+                    ]
+                    for recipe_id, data in zip(ids, recipes)
+                ],
+            )
+            for relation, targets in links.items():
+                through, target = recipe_link(relation)
+                self._copy(
+                    cursor,
+                    through,
+                    ['recipe_id', target],
+                    [
+                        [recipe_id, target_id]
+                        for recipe_id, target_ids in zip(ids, targets)
+                        for target_id in target_ids
+                    ],
+                )
+        return ids
+
+    def _insert_rows(self, recipes, links):
+        """Insert a batch with INSERT statements, return the ids."""
+        if connection.features.can_return_rows_from_bulk_insert:
+            objs = Recipe.objects.bulk_create(
+                [Recipe(user=self.user, **data) for data in recipes],
+            )
+            ids = [recipe.id for recipe in objs]
+        else:
+            # The ids are needed to link the relations, so backends
+            # that cannot return them from a bulk insert insert row by
+            # row with one prepared statement.
+            fields = [
+                Recipe._meta.get_field(name)
+                for name in RECIPE_FIELDS + DEFAULT_FIELDS
+            ]
+            quote = connection.ops.quote_name
+            sql = (
+                f'INSERT INTO {quote(Recipe._meta.db_table)} '
+                f'({", ".join(quote(f.column) for f in fields)}, '
+                f'{quote("user_id")}) '
+                f'VALUES ({", ".join(["%s"] * (len(fields) + 1))})'
+            )
+            ids = []
+            with connection.cursor() as cursor:
+                for data in recipes:
+                    cursor.execute(sql, [
+                        field.get_db_prep_save(data[field.name], connection)
+                        for field in fields
+                    ] + [self.user.id])
+                    ids.append(cursor.lastrowid)
+
+        with connection.cursor() as cursor:
+            for relation, targets in links.items():
+                through, target = recipe_link(relation)
+                quote = connection.ops.quote_name
+                cursor.executemany(
+                    f'INSERT INTO {quote(through._meta.db_table)} '
+                    f'({quote("recipe_id")}, {quote(target)}) '
+                    f'VALUES (%s, %s)',
+                    [
+                        (recipe_id, target_id)
+                        for recipe_id, target_ids in zip(ids, targets)
+                        for target_id in target_ids
+                    ],
+                )
+        return ids
+
+    def _insert(self, batch):
+        """Insert a batch of validated records."""
+        recipes = [data for data, names in batch]
+        links = {}
+        for relation, model in RELATIONS.items():
+            ids = self._resolve(
+                model, [name for data, names in batch
+                        for name in names[relation]],
+            )
+            links[relation] = [
+                list(dict.fromkeys(ids[name] for name in names[relation]))
+                for data, names in batch
+            ]
+
+        if self.use_copy:
+            ids = self._insert_copy(recipes, links)
+        else:
+            ids = self._insert_rows(recipes, links)
+        # Similar recipes are found by the signatures
+        update_signatures(
+            [
+                (recipe_id, self.user.id)
+                for i, recipe_id in enumerate(ids)
+                if any(targets[i] for targets in links.values())
+            ],
+            new=True,
+        )
+
+    def _import(self, records):
+        """Validate and insert records in batches, return the count."""
+        count = 0
+        batch = []
+        for count, record in enumerate(records, 1):
+            try:
+                batch.append(self._validate(record))
+            except serializers.ValidationError as exc:
+                raise CommandError(
+                    f'Record {count}: {json.dumps(exc.detail)}'
+                )
+
+            if len(batch) == self.batch_size:
+                self._insert(batch)
+                batch = []
+                if self.verbosity > 1:
+                    self.stdout.write(f'{count} recipes imported...')
+
+        if batch:
+            self._insert(batch)
+        return count
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        try:
+            self.user = get_user_model().objects.get(email=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'User {options["user"]} does not exist.')
+
+        path = options['path']
+        input_format = options['input_format'] or (
+            'csv' if path.lower().endswith('.csv') else 'ndjson'
+        )
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        self.use_copy = options['copy'] and connection.vendor == 'postgresql'
+        self.fields = RecipeDetailSerializer().fields
+        self.name_field = TagSerializer().fields['name']
+        self.known_ids = {model: {} for model in RELATIONS.values()}
+        self.valid_names = {}
+
+        try:
+            stream = sys.stdin if path == '-' else open(
+                path, encoding='utf-8', newline='',
+            )
+        except OSError as exc:
+            raise CommandError(f'Cannot read {path}: {exc.strerror}')
+        start = time.perf_counter()
+        try:
+            records = (
+                self._read_csv(stream) if input_format == 'csv'
+                else self._read_ndjson(stream)
+            )
+            with transaction.atomic():
+                count = self._import(records)
+                if count:
+                    get_user_model().objects.bump_data_version(self.user.id)
+        except (ValueError, csv.Error) as exc:
+            raise CommandError(f'Invalid {input_format} input: {exc}')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {count} recipes in {elapsed:.1f} s '
+            f'({count / elapsed if elapsed else 0:.0f} recipes/s).'
+        ))
@@ -0,0 +1,53 @@
+"""
+Django command to generate missing renditions of recipe images.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.management.batching import (
+    add_batch_size_argument, iter_id_batches,
+)
+from core.models import Recipe
+from recipe.renditions import generate_renditions
+
+
+class Command(BaseCommand):
+    """Generate the renditions of recipe images again."""
+
+    help = (
+        'Generate the renditions of recipe images which have none, such '
+        'as those whose task was lost when a worker process exited. With '
+        '--all every image is checked, e.g. after Pillow gained a format. '
+        'Renditions already stored are reused.'
+    )
+
+    def add_arguments(self, parser):
+        add_batch_size_argument(
+            parser, 100, help='Recipes looked up per query.',
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Check every recipe with an image.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(renditions={})
+
+        start = time.perf_counter()
+        count = 0
+        batches = iter_id_batches(recipes, options['batch_size'], 'image')
+        for rows in batches:
+            for recipe_id, image_name in rows:
+                generate_renditions(recipe_id, image_name)
+            count += len(rows)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{count} images processed...')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {count} images in {elapsed:.1f} s.'
+        ))
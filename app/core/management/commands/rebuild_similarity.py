@@ -0,0 +1,63 @@
+"""
+Django command to compute the similarity signatures of all recipes.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.management.batching import (
+    add_batch_size_argument, iter_id_batches,
+)
+from core.models import Recipe
+from recipe.similarity import update_signatures
+
+
+class Command(BaseCommand):
+    """Compute the MinHash signatures and buckets of recipes again."""
+
+    help = (
+        'Compute the similarity signatures and buckets of every recipe, '
+        'or of one user\'s recipes, in batches. Needed after recipes or '
+        'their relations were written otherwise than through the API, '
+        'import_recipes or seed_data, e.g. with SQL.'
+    )
+
+    def add_arguments(self, parser):
+        add_batch_size_argument(
+            parser, 500, help='Recipes indexed per transaction.',
+        )
+        parser.add_argument(
+            '--user',
+            help='Email of the user whose recipes to index.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        recipes = Recipe.objects.all()
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f'User {options["user"]} does not exist.')
+            recipes = recipes.filter(user=user)
+
+        start = time.perf_counter()
+        count = 0
+        user_ids = set()
+        batches = iter_id_batches(recipes, options['batch_size'], 'user_id')
+        for rows in batches:
+            update_signatures(rows)
+            user_ids.update(user_id for _, user_id in rows)
+            count += len(rows)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{count} recipes indexed...')
+
+        # Cached similar recipe responses are keyed by the data version
+        for user_id in user_ids:
+            get_user_model().objects.bump_data_version(user_id)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} recipes in {elapsed:.1f} s.'
+        ))
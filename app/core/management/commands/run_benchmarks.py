@@ -0,0 +1,441 @@
+"""
+Django command to benchmark the API end to end.
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.http.response import HttpResponseBase
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe, Tag
+from core.renderers import FastJSONRenderer
+from recipe.listing import RECIPE_LIST_FIELDS, serialize_recipe_rows
+from recipe.serializers import RecipeSerializer
+
+
+# Recipes serialized and rendered by the in process scenarios, each
+# size reported apart
+SERIALIZE_SIZES = [1000, 10000]
+
+
+def recipe_url(fixture):
+    """Return the detail URL of a random recipe of the user."""
+    return reverse(
+        'recipe:recipe-detail',
+        args=[fixture['rng'].choice(fixture['recipe_ids'])],
+    )
+
+
+def related_ids(fixture, key, count):
+    """Return count of the user's most used tag or ingredient ids."""
+    return ','.join(
+        str(id) for id in fixture['rng'].sample(fixture[key], count)
+    )
+
+
+def newest_recipes(fixture):
+    """Return the user's newest recipes for the in process scenarios."""
+    return Recipe.objects.filter(
+        user=fixture['user'],
+    ).order_by('-id')[:fixture['serialize_size']]
+
+
+def serialize_recipes(fixture):
+    """Serialize the newest recipes with RecipeSerializer."""
+    recipes = newest_recipes(fixture).prefetch_related(
+        Prefetch('tags', queryset=Tag.objects.order_by('id')),
+        Prefetch('ingredients', queryset=Ingredient.objects.order_by('id')),
+    )
+    return RecipeSerializer(recipes, many=True).data
+
+
+def serialize_rows(fixture):
+    """Serialize the newest recipes from rows, like the list API."""
+    return serialize_recipe_rows(
+        list(newest_recipes(fixture).values(*RECIPE_LIST_FIELDS)),
+    )
+
+
+def list_payload(fixture):
+    """Return a list response payload of the newest recipes, built once
+    per size.
+    """
+    payloads = fixture.setdefault('payloads', {})
+    if fixture['serialize_size'] not in payloads:
+        payloads[fixture['serialize_size']] = {
+            'next': None,
+            'previous': None,
+            'results': serialize_rows(fixture),
+        }
+    return payloads[fixture['serialize_size']]
+
+
+# Requests made by each scenario, given a client authenticated as a
+# seeded user and that user's fixture. The serialize- and render-
+# scenarios time one step of the list API in process instead.
+SCENARIOS = {
+    'recipe-list': lambda client, fixture: client.get(
+        reverse('recipe:recipe-list'),
+    ),
+    'recipe-list-100': lambda client, fixture: client.get(
+        reverse('recipe:recipe-list'), {'page_size': 100},
+    ),
+    'recipe-search': lambda client, fixture: client.get(
+        reverse('recipe:recipe-list'), {'search': 'ingredient 12'},
+    ),
+    'recipe-tags-any': lambda client, fixture: client.get(
+        reverse('recipe:recipe-list'),
+        {'tags': related_ids(fixture, 'tag_ids', 3)},
+    ),
+    'recipe-tags-all': lambda client, fixture: client.get(
+        reverse('recipe:recipe-list'),
+        {'tags': related_ids(fixture, 'tag_ids', 2), 'tags_match': 'all'},
+    ),
+    'recipe-ingredients-all': lambda client, fixture: client.get(
+        reverse('recipe:recipe-list'),
+        {
+            'ingredients': related_ids(fixture, 'ingredient_ids', 2),
+            'ingredients_match': 'all',
+        },
+    ),
+    'recipe-pantry': lambda client, fixture: client.get(
+        reverse('recipe:recipe-pantry'),
+        {'ingredients': related_ids(fixture, 'ingredient_ids', 8)},
+    ),
+    'recipe-similar': lambda client, fixture: client.get(
+        reverse(
+            'recipe:recipe-similar',
+            args=[fixture['rng'].choice(fixture['recipe_ids'])],
+        ),
+    ),
+    'recipe-detail': lambda client, fixture: client.get(
+        recipe_url(fixture),
+    ),
+    'recipe-create': lambda client, fixture: client.post(
+        reverse('recipe:recipe-list'),
+        {
+            'title': 'Benchmark recipe',
+            'time_minutes': 30,
+            'price': '9.99',
+            'tags': [{'name': 'Tag 1'}, {'name': 'Tag 2'}],
+            'ingredients': [{'name': 'Ingredient 1'}],
+        },
+        format='json',
+    ),
+    'recipe-update': lambda client, fixture: client.patch(
+        recipe_url(fixture),
+        {'title': 'Updated benchmark recipe', 'tags': [{'name': 'Tag 3'}]},
+        format='json',
+    ),
+    'recipe-export': lambda client, fixture: client.get(
+        reverse('recipe:recipe-export'),
+    ),
+    'tag-list': lambda client, fixture: client.get(
+        reverse('recipe:tag-list'),
+    ),
+    'ingredient-list': lambda client, fixture: client.get(
+        reverse('recipe:ingredient-list'),
+    ),
+    'tag-suggest': lambda client, fixture: client.get(
+        reverse('recipe:tag-list'), {'q': 'tag 1'},
+    ),
+    'ingredient-suggest': lambda client, fixture: client.get(
+        reverse('recipe:ingredient-list'), {'q': 'ingredient 4'},
+    ),
+    'serialize-serializer': lambda client, fixture: serialize_recipes(
+        fixture,
+    ),
+    'serialize-rows': lambda client, fixture: serialize_rows(fixture),
+    'render-json': lambda client, fixture: JSONRenderer().render(
+        list_payload(fixture),
+    ),
+    'render-fast-json': lambda client, fixture: FastJSONRenderer().render(
+        list_payload(fixture),
+    ),
+    'user-me': lambda client, fixture: client.get(reverse('user:me')),
+    'user-token': lambda client, fixture: client.post(
+        reverse('user:token'),
+        {'email': fixture['user'].email, 'password': fixture['password']},
+    ),
+}
+
+# Scenarios too slow to run as often as the others, password hashing
+# makes every token request take a large fraction of a second.
+MAX_REQUESTS = {'user-token': 5}
+
+# Scenarios run once per --serialize-sizes size
+SIZED_SCENARIOS = {
+    'serialize-serializer', 'serialize-rows', 'render-json',
+    'render-fast-json',
+}
+
+
+def sizes(value):
+    """Parse a comma separated list of positive sizes."""
+    try:
+        parsed = [int(size) for size in value.split(',')]
+    except ValueError:
+        parsed = []
+    if not parsed or min(parsed) < 1:
+        raise argparse.ArgumentTypeError(
+            'expected comma separated positive integers',
+        )
+    return parsed
+
+
+class QueryCounter:
+    """Database execute wrapper counting queries."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    """Benchmark the API against seeded data."""
+
+    help = (
+        'Send requests to the recipe, tag, ingredient and user APIs as '
+        'users created by seed_data and report latency percentiles, '
+        'queries and peak memory per request. Writes are rolled back. '
+        'Results can be saved and compared with a saved baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--email-prefix', default='seed-user',
+            help='Email prefix the users were seeded with.',
+        )
+        parser.add_argument(
+            '--password', default='password123',
+            help='Password the users were seeded with.',
+        )
+        parser.add_argument(
+            '--users', type=int, default=5,
+            help='Number of seeded users to send requests as.',
+        )
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Measured requests per scenario.',
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=5,
+            help='Unmeasured requests per scenario sent first.',
+        )
+        parser.add_argument(
+            '--scenarios', nargs='+', choices=sorted(SCENARIOS),
+            default=list(SCENARIOS),
+            help='Scenarios to run, by default all.',
+        )
+        parser.add_argument(
+            '--serialize-sizes', type=sizes, default=SERIALIZE_SIZES,
+            help='Comma separated numbers of recipes the serialize- and '
+                 'render- scenarios handle, default '
+                 f'{",".join(map(str, SERIALIZE_SIZES))}.',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the results as JSON to this file.',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='Compare with results saved with --output.',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=20,
+            help='Percent a p90 latency may grow before it counts as a '
+                 'regression.',
+        )
+        parser.add_argument(
+            '--fail-on-regression', action='store_true',
+            help='Exit with an error when a scenario regressed.',
+        )
+
+    def _fixtures(self, options):
+        """Return an authenticated client and fixture per user."""
+        users = list(
+            get_user_model().objects.filter(
+                email__startswith=f'{options["email_prefix"]}-',
+            ).order_by('id')[:options['users']]
+        )
+        if not users:
+            raise CommandError('No seeded users found, run seed_data first.')
+
+        fixtures = []
+        for i, user in enumerate(users):
+            recipe_ids = list(
+                Recipe.objects.filter(user=user)
+                .order_by('-id').values_list('id', flat=True)[:100]
+            )
+            if not recipe_ids:
+                raise CommandError(f'{user.email} has no recipes.')
+
+            # Seeded names are used less the higher their id
+            tag_ids = list(
+                Tag.objects.filter(user=user)
+                .order_by('id').values_list('id', flat=True)[:10]
+            )
+            ingredient_ids = list(
+                Ingredient.objects.filter(user=user)
+                .order_by('id').values_list('id', flat=True)[:10]
+            )
+
+            token, created = Token.objects.get_or_create(user=user)
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+            fixtures.append((client, {
+                'user': user,
+                'password': options['password'],
+                'recipe_ids': recipe_ids,
+                'tag_ids': tag_ids,
+                'ingredient_ids': ingredient_ids,
+                'rng': random.Random(i),
+            }))
+        return fixtures
+
+    def _request(self, scenario, client, fixture):
+        """Send one request, return its duration and query count."""
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = time.perf_counter()
+            response = SCENARIOS[scenario](client, fixture)
+            is_response = isinstance(response, HttpResponseBase)
+            if is_response and response.streaming:
+                for chunk in response.streaming_content:
+                    pass
+            elapsed = time.perf_counter() - start
+
+        if is_response and response.status_code >= 400:
+            raise CommandError(
+                f'{scenario} failed with status {response.status_code}.'
+            )
+        return elapsed * 1000, counter.count
+
+    def _run(self, scenario, fixtures, options):
+        """Run a scenario and return its results."""
+        count = min(
+            options['requests'],
+            MAX_REQUESTS.get(scenario, options['requests']),
+        )
+        for i in range(min(options['warmup'], count)):
+            self._request(scenario, *fixtures[i % len(fixtures)])
+
+        timings = []
+        queries = []
+        for i in range(count):
+            elapsed, query_count = self._request(
+                scenario, *fixtures[i % len(fixtures)],
+            )
+            timings.append(elapsed)
+            queries.append(query_count)
+
+        # Tracing slows everything down, so memory is measured apart
+        tracemalloc.start()
+        self._request(scenario, *fixtures[0])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+        return {
+            'requests': count,
+            'mean_ms': statistics.mean(timings),
+            'p50_ms': percentiles[49],
+            'p90_ms': percentiles[89],
+            'p99_ms': percentiles[98],
+            'max_ms': max(timings),
+            'queries': statistics.mean(queries),
+            'peak_kib': peak / 1024,
+        }
+
+    def _report(self, results, baseline, threshold):
+        """Write the results, compared to baseline, and return regressions.
+        """
+        self.stdout.write(
+            f'{"scenario":<28}{"p50 ms":>9}{"p90 ms":>9}{"p99 ms":>9}'
+            f'{"queries":>9}{"peak KiB":>10}'
+            + (f'{"p90 change":>12}' if baseline else '')
+        )
+        regressions = []
+        for scenario, result in results.items():
+            line = (
+                f'{scenario:<28}{result["p50_ms"]:>9.2f}'
+                f'{result["p90_ms"]:>9.2f}{result["p99_ms"]:>9.2f}'
+                f'{result["queries"]:>9.1f}{result["peak_kib"]:>10.0f}'
+            )
+            base = baseline.get(scenario)
+            if base:
+                change = (result['p90_ms'] / base['p90_ms'] - 1) * 100
+                line += f'{change:>+11.0f}%'
+                if change > threshold:
+                    regressions.append(f'{scenario} p90 {change:+.0f}%')
+                if result['queries'] > base['queries']:
+                    regressions.append(
+                        f'{scenario} queries {base["queries"]:.1f} -> '
+                        f'{result["queries"]:.1f}'
+                    )
+            self.stdout.write(line)
+        return regressions
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        if options['requests'] < 2:
+            raise CommandError('--requests must be at least 2.')
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['scenarios']
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']), \
+                transaction.atomic():
+            fixtures = self._fixtures(options)
+            recipes = Recipe.objects.filter(
+                user__in=[fixture['user'] for client, fixture in fixtures],
+            ).count()
+            for scenario in options['scenarios']:
+                if scenario not in SIZED_SCENARIOS:
+                    results[scenario] = self._run(scenario, fixtures, options)
+                    continue
+                for size in options['serialize_sizes']:
+                    for client, fixture in fixtures:
+                        fixture['serialize_size'] = size
+                    results[f'{scenario}-{size}'] = self._run(
+                        scenario, fixtures, options,
+                    )
+            # Leave the seeded data as it was
+            transaction.set_rollback(True)
+
+        regressions = self._report(results, baseline, options['threshold'])
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'database': connection.vendor,
+                    'python': platform.python_version(),
+                    'users': len(fixtures),
+                    'recipes': recipes,
+                    'scenarios': results,
+                }, f, indent=2)
+
+        if regressions:
+            message = 'Regressions: ' + ', '.join(regressions)
+            if options['fail_on_regression']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
@@ -0,0 +1,221 @@
+"""
+Django command to seed the database with synthetic recipes.
+"""
+import itertools
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import (
+    Recipe,
+    Tag,
+    Ingredient,
+    recipe_link,
+)
+from recipe.similarity import update_signatures_in_batches
+
+
+def zipf_weights(count, exponent):
+    """Return cumulative Zipf weights for ranks 1 to count."""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)
+    ))
+
+
+def sample_skewed(rng, population, cum_weights, count):
+    """Return up to count distinct items drawn with the given weights."""
+    count = min(count, len(population))
+    chosen = {}
+    while len(chosen) < count:
+        for item in rng.choices(population, cum_weights=cum_weights, k=count):
+            chosen[item] = None
+    return list(chosen)[:count]
+
+
+class Command(BaseCommand):
+    """Seed users with recipes, tags and ingredients."""
+
+    help = (
+        'Create users with recipes, tags and ingredients for load tests '
+        'and benchmarks. Tag and ingredient use follows a Zipf '
+        'distribution, so a few names are on most recipes like in real '
+        'data. Users are named <email-prefix>-<n>@example.com.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=10,
+            help='Number of users to create.',
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=1000,
+            help='Recipes per user.',
+        )
+        parser.add_argument(
+            '--tags', type=int, default=50,
+            help='Tags per user.',
+        )
+        parser.add_argument(
+            '--ingredients', type=int, default=500,
+            help='Ingredients per user.',
+        )
+        parser.add_argument(
+            '--tags-per-recipe', type=int, nargs=2, default=[1, 4],
+            metavar=('MIN', 'MAX'),
+            help='Range of the number of tags on a recipe.',
+        )
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, nargs=2, default=[3, 12],
+            metavar=('MIN', 'MAX'),
+            help='Range of the number of ingredients on a recipe.',
+        )
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Exponent of the Zipf distribution of names.',
+        )
+        parser.add_argument(
+            '--email-prefix', default='seed-user',
+            help='Prefix of the email addresses of the users.',
+        )
+        parser.add_argument(
+            '--password', default='password123',
+            help='Password of every user.',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed, the same seed creates the same data.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Rows inserted per query.',
+        )
+
+    def _create_users(self, options):
+        """Create the users, return them in order."""
+        # Hashing is deliberately slow, every user shares one hash
+        password = make_password(options['password'])
+        prefix = options['email_prefix']
+        emails = [
+            f'{prefix}-{i}@example.com' for i in range(options['users'])
+        ]
+        User = get_user_model()
+        existing = User.objects.filter(email__in=emails)
+        if existing.exists():
+            raise CommandError(
+                f'{existing.first().email} already exists, use another '
+                f'--email-prefix.'
+            )
+
+        User.objects.bulk_create(
+            [
+                User(email=email, name=f'Seed user {i}', password=password)
+                for i, email in enumerate(emails)
+            ],
+            batch_size=options['batch_size'],
+        )
+        users = User.objects.in_bulk(emails, field_name='email')
+        return [users[email] for email in emails]
+
+    def _create_names(self, model, users, count, prefix, batch_size):
+        """Create count names per user, return the ids by user id."""
+        model.objects.bulk_create(
+            [
+                model(user=user, name=f'{prefix} {rank}')
+                for user in users
+                for rank in range(1, count + 1)
+            ],
+            batch_size=batch_size,
+        )
+        # Ordered by id, which is also the rank of the name
+        ids = {user.id: [] for user in users}
+        rows = model.objects.filter(user__in=users).order_by('id')
+        for user_id, obj_id in rows.values_list('user_id', 'id'):
+            ids[user_id].append(obj_id)
+        return ids
+
+    def _link(self, relation, recipes, ids, count_range, rng, options):
+        """Link every recipe to a skewed sample of ids."""
+        through, target = recipe_link(relation)
+        weights = {}
+        links = []
+        created = 0
+        for recipe_id, user_id in recipes:
+            user_ids = ids[user_id]
+            if len(user_ids) not in weights:
+                weights[len(user_ids)] = zipf_weights(
+                    len(user_ids), options['zipf'],
+                )
+            for target_id in sample_skewed(
+                rng, user_ids, weights[len(user_ids)],
+                rng.randint(*count_range),
+            ):
+                links.append(
+                    through(recipe_id=recipe_id, **{target: target_id})
+                )
+            # Inserted as they fill up to keep memory flat
+            if len(links) >= options['batch_size']:
+                through.objects.bulk_create(links)
+                created += len(links)
+                links = []
+        through.objects.bulk_create(links)
+        return created + len(links)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        rng = random.Random(options['seed'])
+        start = time.perf_counter()
+        with transaction.atomic():
+            users = self._create_users(options)
+            tag_ids = self._create_names(
+                Tag, users, options['tags'], 'Tag', options['batch_size'],
+            )
+            ingredient_ids = self._create_names(
+                Ingredient, users, options['ingredients'], 'Ingredient',
+                options['batch_size'],
+            )
+
+            recipe_count = links = 0
+            # One user at a time to keep memory flat
+            for user in users:
+                Recipe.objects.bulk_create(
+                    [
+                        Recipe(
+                            user=user,
+                            title=f'Recipe {i}',
+                            description='Seeded recipe',
+                            time_minutes=rng.randint(5, 180),
+                            price=Decimal(rng.randint(100, 99999)) / 100,
+                            link=f'https://example.com/recipes/{i}',
+                        )
+                        for i in range(options['recipes'])
+                    ],
+                    batch_size=options['batch_size'],
+                )
+                # The user is new, so their recipes are the ones above
+                recipes = list(
+                    Recipe.objects.filter(user=user)
+                    .order_by('id').values_list('id', 'user_id')
+                )
+                recipe_count += len(recipes)
+                links += self._link(
+                    'tags', recipes, tag_ids, options['tags_per_recipe'],
+                    rng, options,
+                )
+                links += self._link(
+                    'ingredients', recipes, ingredient_ids,
+                    options['ingredients_per_recipe'], rng, options,
+                )
+                update_signatures_in_batches(
+                    recipes, options['batch_size'], new=True,
+                )
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users, {recipe_count} recipes and '
+            f'{links} tag and ingredient links in {elapsed:.1f} s.'
+        ))
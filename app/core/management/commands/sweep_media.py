@@ -0,0 +1,55 @@
+"""
+Django command to delete recipe image files no recipe uses.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipe.media import get_storage, iter_unreferenced
+
+
+class Command(BaseCommand):
+    """Delete unreferenced recipe images from the media storage."""
+
+    help = (
+        'Delete recipe images, their renditions and interrupted uploads '
+        'that no recipe uses. Images are looked up in batches, files '
+        'written during the grace period are kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Images looked up per query.',
+        )
+        parser.add_argument(
+            '--grace', type=int,
+            default=settings.RECIPE_IMAGE_GRACE_SECONDS,
+            help='Keep files written less than this many seconds ago.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='List the files without deleting them.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        storage = get_storage()
+        count = size = 0
+        for name in iter_unreferenced(
+            storage, options['grace'], options['batch_size'],
+        ):
+            try:
+                size += storage.size(name)
+            except FileNotFoundError:
+                # Deleted since it was listed, e.g. by a release
+                continue
+            count += 1
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                storage.delete(name)
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {count} files, {size} bytes.'
+        ))
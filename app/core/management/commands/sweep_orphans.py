@@ -0,0 +1,141 @@
+"""
+Django command to delete tags and ingredients no recipe uses.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Exists, OuterRef
+
+from core.management.batching import (
+    add_batch_size_argument, iter_id_batches,
+)
+from core.models import Recipe, can_return_rows, recipe_link
+
+
+# Relations of recipes whose targets are swept
+RELATIONS = ['tags', 'ingredients']
+
+
+class Command(BaseCommand):
+    """Delete unreferenced tags and ingredients in batches."""
+
+    help = (
+        'Delete the tags and ingredients that no recipe uses. Orphans '
+        'are found with anti-join queries and deleted in batches, one '
+        'transaction each, so a batch locks at most --batch-size rows. '
+        'With --interval the sweep repeats until interrupted.'
+    )
+
+    def add_arguments(self, parser):
+        add_batch_size_argument(
+            parser, 500, help='Rows deleted per transaction.',
+        )
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Sweep again every this many seconds, 0 to sweep once.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Count the orphans without deleting them.',
+        )
+
+    def _delete(self, model, through, column, rows):
+        """Delete the rows still unreferenced, return their user ids.
+
+        rows are (id, user_id) pairs, one user id is returned per
+        deleted row. The reference check is repeated by the DELETE
+        itself, so rows linked since the batch was read are kept.
+        Writes that looked a row up but had not linked it yet fail
+        their foreign key check and retry, creating it again (see
+        link_with_retry in recipe.serializers).
+        """
+        ids = [id for id, _ in rows]
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        links = quote(through._meta.db_table)
+        sql = (
+            f'DELETE FROM {table} '
+            f'WHERE {quote("id")} IN ({", ".join(["%s"] * len(ids))}) '
+            f'AND NOT EXISTS (SELECT 1 FROM {links} '
+            f'WHERE {links}.{quote(column)} = {table}.{quote("id")})'
+        )
+        with connection.cursor() as cursor:
+            if can_return_rows(connection):
+                user = quote(model._meta.get_field('user').column)
+                cursor.execute(f'{sql} RETURNING {user}', ids)
+                return [user_id for user_id, in cursor.fetchall()]
+            cursor.execute(sql, ids)
+            if cursor.rowcount == 0:
+                return []
+            if cursor.rowcount == len(ids):
+                return [user_id for _, user_id in rows]
+
+        # Rows are only deleted here, so those left are the kept ones
+        kept = set(
+            model.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        return [user_id for id, user_id in rows if id not in kept]
+
+    def _sweep(self, relation, batch_size, dry_run):
+        """Delete the orphans of one relation, return (deleted, kept)."""
+        model = Recipe._meta.get_field(relation).related_model
+        through, column = recipe_link(relation)
+        orphans = model.objects.filter(~Exists(
+            through.objects.filter(**{column: OuterRef('pk')}),
+        ))
+
+        deleted = kept = 0
+        # Each row is checked once per sweep
+        for rows in iter_id_batches(orphans, batch_size, 'user_id'):
+            if dry_run:
+                deleted += len(rows)
+                continue
+
+            try:
+                with transaction.atomic():
+                    user_ids = self._delete(model, through, column, rows)
+                    # Lists and cached name indexes of the owners of
+                    # deleted rows must be rebuilt
+                    for user_id in set(user_ids):
+                        get_user_model().objects.bump_data_version(user_id)
+                count = len(user_ids)
+            except IntegrityError:
+                # A recipe was linked to one of the rows concurrently.
+                # The batch is left for the next sweep.
+                count = 0
+            deleted += count
+            kept += len(rows) - count
+        return deleted, kept
+
+    def _sweep_all(self, options):
+        """Sweep every relation once and report the result."""
+        start = time.perf_counter()
+        results = []
+        for relation in RELATIONS:
+            deleted, kept = self._sweep(
+                relation, options['batch_size'], options['dry_run'],
+            )
+            results.append(f'{deleted} {relation}')
+            if kept:
+                results[-1] += f' ({kept} linked meanwhile, kept)'
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {" and ".join(results)} in {elapsed:.1f} s.'
+        ))
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        if options['interval'] < 0:
+            raise CommandError('--interval cannot be negative.')
+
+        self._sweep_all(options)
+        try:
+            while options['interval']:
+                time.sleep(options['interval'])
+                self._sweep_all(options)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped.')
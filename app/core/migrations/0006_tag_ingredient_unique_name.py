@@ -0,0 +1,80 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:25
+
+from django.db import migrations, models, transaction
+from django.db.models import Count, Min
+
+import core.operations
+
+
+def merge_duplicate_names(apps, field_name):
+    """Merge tags or ingredients sharing a name for the same user.
+
+    The oldest row of each duplicate group is kept and the recipes
+    linked to the other rows are linked to it instead. Each group is
+    merged in its own transaction so locks are held only briefly.
+    """
+    Recipe = apps.get_model('core', 'Recipe')
+    field = Recipe._meta.get_field(field_name)
+    model = field.related_model
+    through = field.remote_field.through
+    target = field.m2m_reverse_field_name()
+
+    groups = (
+        model.objects
+        .values('user_id', 'name')
+        .annotate(rows=Count('id'), keep=Min('id'))
+        .filter(rows__gt=1)
+    )
+    for group in list(groups):
+        with transaction.atomic():
+            duplicate_ids = list(
+                model.objects
+                .filter(user_id=group['user_id'], name=group['name'])
+                .exclude(id=group['keep'])
+                .values_list('id', flat=True)
+            )
+            links = through.objects.filter(**{f'{target}__in': duplicate_ids})
+            recipe_ids = set(links.values_list('recipe_id', flat=True))
+            recipe_ids -= set(
+                through.objects
+                .filter(**{target: group['keep']})
+                .values_list('recipe_id', flat=True)
+            )
+            links.delete()
+            through.objects.bulk_create(
+                through(recipe_id=recipe_id, **{f'{target}_id': group['keep']})
+                for recipe_id in recipe_ids
+            )
+            model.objects.filter(id__in=duplicate_ids).delete()
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Merge ingredients sharing a name, before their index is built."""
+    merge_duplicate_names(apps, 'ingredients')
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """Merge tags sharing a name, before their index is built."""
+    merge_duplicate_names(apps, 'tags')
+
+
+class Migration(migrations.Migration):
+    # The unique indexes are built concurrently on PostgreSQL
+    atomic = False
+
+    dependencies = [
+        ('core', '0005_recipe_image'),
+    ]
+
+    operations = [
+        core.operations.AddUniqueConstraintOnline(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='unique_ingredient_name_per_user'),
+            deduplicate=merge_duplicate_ingredients,
+        ),
+        core.operations.AddUniqueConstraintOnline(
+            model_name='tag',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='unique_tag_name_per_user'),
+            deduplicate=merge_duplicate_tags,
+        ),
+    ]
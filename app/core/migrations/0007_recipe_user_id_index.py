@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+import core.operations
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently on PostgreSQL
+    atomic = False
+
+    dependencies = [
+        ('core', '0006_tag_ingredient_unique_name'),
+    ]
+
+    operations = [
+        core.operations.AddIndexOnline(
+            model_name='recipe',
+            index=models.Index(fields=['user', '-id'], name='core_recipe_user_id_desc_idx'),
+        ),
+    ]
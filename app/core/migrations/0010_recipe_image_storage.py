@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:57
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+import core.operations
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently on PostgreSQL
+    atomic = False
+
+    dependencies = [
+        ('core', '0009_recipe_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(null=True, storage=core.storage.ContentAddressedStorage(), upload_to=core.models.recipe_image_file_path),
+        ),
+        core.operations.AddIndexOnline(
+            model_name='recipe',
+            index=models.Index(fields=['image'], name='core_recipe_image_idx'),
+        ),
+    ]
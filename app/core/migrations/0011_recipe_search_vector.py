@@ -0,0 +1,164 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:04
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+import core.operations
+
+
+# The search vector of a recipe: title (A), tag and ingredient names
+# (B) and description (C). Must use recipe.search.SEARCH_CONFIG.
+# Existing recipes are left without one, rewriting them all in one
+# statement would lock the table, and are computed in batches by the
+# backfill_search_vectors command.
+CREATE_TRIGGERS = """
+CREATE FUNCTION core_recipe_search_vector(bigint, text, text)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+    SELECT
+        setweight(to_tsvector('english', coalesce($2, '')), 'A')
+        || setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(t.name, ' ')
+            FROM core_tag t
+            JOIN core_recipe_tags rt ON rt.tag_id = t.id
+            WHERE rt.recipe_id = $1
+        ), '')), 'B')
+        || setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(i.name, ' ')
+            FROM core_ingredient i
+            JOIN core_recipe_ingredients ri ON ri.ingredient_id = i.id
+            WHERE ri.recipe_id = $1
+        ), '')), 'B')
+        || setweight(to_tsvector('english', coalesce($3, '')), 'C')
+$$;
+
+-- Computes the vector of new and changed recipes. Other triggers
+-- write search_vector to have it computed again.
+CREATE FUNCTION core_recipe_search_vector_trigger()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := core_recipe_search_vector(
+        NEW.id, NEW.title, NEW.description
+    );
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER core_recipe_search_vector
+BEFORE INSERT OR UPDATE OF title, description, search_vector
+ON core_recipe
+FOR EACH ROW EXECUTE FUNCTION core_recipe_search_vector_trigger();
+
+-- Once per statement adding or removing tags or ingredients of
+-- recipes, so bulk writes update each recipe once.
+CREATE FUNCTION core_recipe_search_links_trigger()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE core_recipe SET search_vector = NULL
+        WHERE id IN (SELECT recipe_id FROM old_links);
+    ELSE
+        UPDATE core_recipe SET search_vector = NULL
+        WHERE id IN (SELECT recipe_id FROM new_links);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER core_recipe_tags_search_insert
+AFTER INSERT ON core_recipe_tags
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION core_recipe_search_links_trigger();
+
+CREATE TRIGGER core_recipe_tags_search_delete
+AFTER DELETE ON core_recipe_tags
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION core_recipe_search_links_trigger();
+
+CREATE TRIGGER core_recipe_ingredients_search_insert
+AFTER INSERT ON core_recipe_ingredients
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION core_recipe_search_links_trigger();
+
+CREATE TRIGGER core_recipe_ingredients_search_delete
+AFTER DELETE ON core_recipe_ingredients
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION core_recipe_search_links_trigger();
+
+-- Renaming a tag or ingredient updates the recipes using it. The
+-- arguments are the link table and its column referencing the name.
+CREATE FUNCTION core_recipe_search_names_trigger()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    EXECUTE format(
+        'UPDATE core_recipe SET search_vector = NULL '
+        'WHERE id IN (SELECT recipe_id FROM %I WHERE %I = $1)',
+        TG_ARGV[0], TG_ARGV[1]
+    ) USING NEW.id;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER core_tag_search_rename
+AFTER UPDATE OF name ON core_tag
+FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION core_recipe_search_names_trigger(
+    'core_recipe_tags', 'tag_id'
+);
+
+CREATE TRIGGER core_ingredient_search_rename
+AFTER UPDATE OF name ON core_ingredient
+FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+EXECUTE FUNCTION core_recipe_search_names_trigger(
+    'core_recipe_ingredients', 'ingredient_id'
+);
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER core_ingredient_search_rename ON core_ingredient;
+DROP TRIGGER core_tag_search_rename ON core_tag;
+DROP FUNCTION core_recipe_search_names_trigger();
+DROP TRIGGER core_recipe_ingredients_search_delete
+    ON core_recipe_ingredients;
+DROP TRIGGER core_recipe_ingredients_search_insert
+    ON core_recipe_ingredients;
+DROP TRIGGER core_recipe_tags_search_delete ON core_recipe_tags;
+DROP TRIGGER core_recipe_tags_search_insert ON core_recipe_tags;
+DROP FUNCTION core_recipe_search_links_trigger();
+DROP TRIGGER core_recipe_search_vector ON core_recipe;
+DROP FUNCTION core_recipe_search_vector_trigger();
+DROP FUNCTION core_recipe_search_vector(bigint, text, text);
+"""
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        # No parameters, so % in the SQL is not a placeholder
+        schema_editor.execute(CREATE_TRIGGERS, params=None)
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGGERS, params=None)
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently on PostgreSQL
+    atomic = False
+
+    dependencies = [
+        ('core', '0010_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers, atomic=True),
+        core.operations.AddPostgresIndexOnline(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='core_recipe_search_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:30
+
+from django.db import migrations
+
+
+# Case-insensitive prefix lookups, name__istartswith, compare
+# UPPER(name::text) with LIKE. Django 3.2 cannot declare indexes on
+# expressions with an operator class, so they are created here and
+# only on PostgreSQL.
+TABLES = ['core_tag', 'core_ingredient']
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in TABLES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+            f'{table}_name_prefix_idx ON {table} '
+            f'(user_id, UPPER(name::text) text_pattern_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in TABLES:
+        schema_editor.execute(
+            f'DROP INDEX CONCURRENTLY IF EXISTS {table}_name_prefix_idx'
+        )
+
+
+class Migration(migrations.Migration):
+    # The indexes are built concurrently
+    atomic = False
+
+    dependencies = [
+        ('core', '0011_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
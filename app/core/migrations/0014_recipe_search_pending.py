@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:56
+
+from django.db import migrations, models
+
+import core.operations
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently on PostgreSQL
+    atomic = False
+
+    dependencies = [
+        ('core', '0013_recipe_similarity'),
+    ]
+
+    operations = [
+        core.operations.AddIndexOnline(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('search_vector__isnull', True)), fields=['id'], name='core_recipe_search_pending_idx'),
+        ),
+    ]
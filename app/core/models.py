@@ -2,26 +2,38 @@
 Database models.
 """
 
-import uuid
 import os
 from django.conf import settings
-from django.db import models
+from django.db import connections, models
+from django.utils import timezone
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+
+from core.storage import recipe_image_storage
 
 
 def recipe_image_file_path(instance, filename):
-    """Generate file path for new recipe image."""
+    """Generate file path for new recipe image.
+
+    The storage replaces the file name by the hash of the content, so
+    only the directory and the extension are chosen here.
+    """
     # Extracting the extension
-    ext = os.path.splitext(filename)[1]
+    ext = os.path.splitext(filename)[1].lower()
 
-    # Creating a uuid and appending the ext
-    filename = f'{uuid.uuid4()}{ext}'
+    return os.path.join('uploads', 'recipe', f'image{ext}')
 
-    return os.path.join('uploads', 'recipe', filename)
+
+def can_return_rows(connection):
+    """Return whether UPDATE and DELETE of the backend take RETURNING."""
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return connection.vendor == 'postgresql'
 
 
 # Manager to have functions for User Model creation/deletion etc.
@@ -58,6 +70,49 @@ class UserManager(BaseUserManager):
 
         return user
 
+    def bump_data_version(self, user_id):
+        """Record that the recipes, tags or ingredients of a user changed.
+
+        Return the new data version, or None on backends that cannot
+        return it from the UPDATE.
+        """
+        connection = connections[self.db]
+        if not can_return_rows(connection):
+            self.filter(pk=user_id).update(
+                data_version=models.F('data_version') + 1,
+                data_modified=timezone.now(),
+            )
+            return None
+
+        # One statement, so concurrent bumps each get their own version
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        version = quote(opts.get_field('data_version').column)
+        modified = opts.get_field('data_modified')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {quote(opts.db_table)} '
+                f'SET {version} = {version} + 1, '
+                f'{quote(modified.column)} = %s '
+                f'WHERE {quote(opts.pk.column)} = %s '
+                f'RETURNING {version}',
+                [
+                    modified.get_db_prep_value(
+                        timezone.now(), connection,
+                    ),
+                    user_id,
+                ],
+            )
+            row = cursor.fetchone()
+        return row and row[0]
+
+    def get_data_version(self, user_id):
+        """Return the data version and last modification of a user."""
+        return self.filter(pk=user_id).values_list(
+            'data_version',
+            'data_modified',
+        ).get()
+
 
 # User Model
 class User(AbstractBaseUser, PermissionsMixin):
@@ -67,6 +122,13 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
 
+    # Incremented on every write to the user's recipes, tags and
+    # ingredients so that clients and caches can tell if they changed.
+    # Only UserManager.bump_data_version writes them.
+    data_version = models.PositiveBigIntegerField(default=0)
+    data_modified = models.DateTimeField(null=True, blank=True)
+    DATA_VERSION_FIELDS = ('data_version', 'data_modified')
+
     # Assigning the UserManager to the User model
     objects = UserManager()
 
@@ -74,6 +136,21 @@ class User(AbstractBaseUser, PermissionsMixin):
     # Django provides auth only on the username field
     USERNAME_FIELD = 'email'
 
+    def save(self, *args, **kwargs):
+        """Save the user, leaving the data version alone.
+
+        The copy of the version in memory may be outdated, e.g. for a
+        user cached by token authentication, and writing it back would
+        make stale ETags and cached responses current again.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.DATA_VERSION_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class Recipe(models.Model):
     """Recipe object."""
@@ -93,12 +170,85 @@ class Recipe(models.Model):
     link = models.CharField(max_length=255, blank=True)
     tags = models.ManyToManyField('Tag')
     ingredients = models.ManyToManyField('Ingredient')
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # Identical images share one file, see core.storage
+    image = models.ImageField(
+        null=True,
+        upload_to=recipe_image_file_path,
+        storage=recipe_image_storage,
+    )
+
+    # Paths of the resized copies of image, see recipe.renditions
+    renditions = models.JSONField(default=dict, blank=True)
+
+    # Words of the title, tags, ingredients and description, kept up
+    # to date by triggers on PostgreSQL, see recipe.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Serves the recipe list, which filters by user and pages
+            # through the newest recipes first.
+            models.Index(
+                fields=['user', '-id'],
+                name='core_recipe_user_id_desc_idx',
+            ),
+            # Counts the recipes using an image file before it is
+            # deleted.
+            models.Index(fields=['image'], name='core_recipe_image_idx'),
+            # Full-text search, only created on PostgreSQL
+            GinIndex(
+                fields=['search_vector'],
+                name='core_recipe_search_idx',
+            ),
+            # Recipes whose search vector is not computed yet, empty
+            # once backfill_search_vectors has run.
+            models.Index(
+                fields=['id'],
+                condition=models.Q(search_vector__isnull=True),
+                name='core_recipe_search_pending_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
 
+class RecipeSignature(models.Model):
+    """MinHash signature of the tags and ingredients of a recipe.
+
+    Kept up to date by the recipe serializers, see recipe.similarity.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    signature = models.BinaryField()
+
+
+class RecipeBucket(models.Model):
+    """Locality-sensitive hash bucket of a recipe's signature.
+
+    Recipes sharing a bucket are candidates for being similar, see
+    recipe.similarity.
+    """
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    key = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            # Finds the other recipes of a user in the same buckets
+            models.Index(
+                fields=['user', 'key'],
+                name='core_recipebucket_key_idx',
+            ),
+        ]
+
+
 class Tag(models.Model):
     """Tag for filtering recipes."""
     name = models.CharField(max_length=255)
@@ -107,6 +257,19 @@ class Tag(models.Model):
         on_delete=models.CASCADE,
     )
 
+    class Meta:
+        # Tags are looked up by name when recipes are saved, so two
+        # concurrent requests must not be able to create the same tag.
+        # The index behind the constraint also serves listing a user's
+        # tags by name. Name suggestions use a case-insensitive prefix
+        # index created on PostgreSQL by migration 0012.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='unique_tag_name_per_user',
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -119,5 +282,24 @@ class Ingredient(models.Model):
         on_delete=models.CASCADE,
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='unique_ingredient_name_per_user',
+            ),
+        ]
+
     def __str__(self):
         return self.name
+
+
+def recipe_link(relation):
+    """Return the link model of a recipe relation and its target column.
+
+    relation is 'tags' or 'ingredients'. The column, e.g. 'tag_id',
+    holds the linked id and also works as the start of a lookup, e.g.
+    'tag_id__name'.
+    """
+    field = Recipe._meta.get_field(relation)
+    return field.remote_field.through, f'{field.m2m_reverse_field_name()}_id'
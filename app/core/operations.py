@@ -0,0 +1,140 @@
+"""
+Migration operations for building indexes on large tables.
+
+On PostgreSQL the indexes are built with CREATE INDEX CONCURRENTLY so
+that reads and writes to the table continue while they are built. Other
+databases build them the regular way. Migrations using these operations
+must set atomic = False.
+"""
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import IntegrityError, migrations
+
+
+def _is_postgresql(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+class AddIndexOnline(AddIndexConcurrently):
+    """Add an index, concurrently on PostgreSQL."""
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if _is_postgresql(schema_editor):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state,
+            )
+        return migrations.AddIndex.database_forwards(
+            self, app_label, schema_editor, from_state, to_state,
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if _is_postgresql(schema_editor):
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state,
+            )
+        return migrations.AddIndex.database_backwards(
+            self, app_label, schema_editor, from_state, to_state,
+        )
+
+
+class AddPostgresIndexOnline(AddIndexConcurrently):
+    """Add an index only PostgreSQL supports, such as a GIN index.
+
+    Other databases skip it, queries needing it are only run on
+    PostgreSQL.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if _is_postgresql(schema_editor):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state,
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if _is_postgresql(schema_editor):
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state,
+            )
+
+
+class AddUniqueConstraintOnline(migrations.AddConstraint):
+    """Add a unique constraint, building its index concurrently.
+
+    On PostgreSQL the unique index is created first without blocking
+    writes and then attached to the table as the constraint, which only
+    takes a brief lock.
+
+    Rows violating the constraint may be written until it exists. If
+    deduplicate is given, it is called like a RunPython function right
+    before the index is built, and again before each of up to attempts
+    builds which failed on a duplicate. A failed build leaves an invalid
+    index behind, which is dropped before the next one.
+    """
+
+    def __init__(self, model_name, constraint, deduplicate=None,
+                 attempts=3):
+        super().__init__(model_name, constraint)
+        self.deduplicate = deduplicate
+        self.attempts = attempts
+
+    def deconstruct(self):
+        name, args, kwargs = super().deconstruct()
+        if self.deduplicate is not None:
+            kwargs['deduplicate'] = self.deduplicate
+        if self.attempts != 3:
+            kwargs['attempts'] = self.attempts
+        return name, args, kwargs
+
+    def _drop_invalid_index(self, schema_editor, name):
+        """Drop the index left by an interrupted or failed build."""
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_index JOIN pg_class '
+                'ON pg_class.oid = pg_index.indexrelid '
+                'WHERE pg_class.relname = %s AND NOT pg_index.indisvalid',
+                [self.constraint.name],
+            )
+            invalid = cursor.fetchone() is not None
+        if invalid:
+            schema_editor.execute(f'DROP INDEX CONCURRENTLY {name}')
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if self.deduplicate is not None:
+            self.deduplicate(from_state.apps, schema_editor)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not _is_postgresql(schema_editor) or not self.allow_migrate_model(
+            schema_editor.connection.alias, model,
+        ):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state,
+            )
+
+        table = schema_editor.quote_name(model._meta.db_table)
+        name = schema_editor.quote_name(self.constraint.name)
+        columns = ', '.join(
+            schema_editor.quote_name(model._meta.get_field(field).column)
+            for field in self.constraint.fields
+        )
+        self._drop_invalid_index(schema_editor, name)
+        for attempt in range(1, self.attempts + 1):
+            try:
+                # A valid index left by an interrupted run is reused
+                schema_editor.execute(
+                    f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+                    f'ON {table} ({columns})'
+                )
+                break
+            except IntegrityError:
+                # A duplicate was written since the last deduplication
+                self._drop_invalid_index(schema_editor, name)
+                if self.deduplicate is None or attempt == self.attempts:
+                    raise
+                self.deduplicate(from_state.apps, schema_editor)
+        schema_editor.execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX '
+            f'{name}'
+        )
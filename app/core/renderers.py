@@ -0,0 +1,105 @@
+"""
+Renderers for the APIs.
+"""
+import re
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Floats orjson writes with an exponent end in one, which can be found
+# once digits and minus signs are mapped to 0, and small ones it writes
+# as 0.0000... Float keys are written the same way in quotes. Strings
+# rarely hold either, and a match only means the floats of the data
+# are checked.
+_NUMBER_CHARS = bytes.maketrans(b'-123456789', b'0000000000')
+_EXPONENT = re.compile(rb'e0{1,4}(?:[,\]}]|":|$)')
+_SMALL_FLOAT = b'0.0000'
+
+_encoder = encoders.JSONEncoder()
+
+
+def _mismatched_float(value):
+    """Return whether orjson writes a float unlike json.dumps.
+
+    Both agree from 1e-4 to 1e16. Outside of it json.dumps writes an
+    exponent and orjson often writes a different one or none, so those
+    floats are all treated as mismatches. So are NaN and infinity,
+    which JSONRenderer refuses.
+    """
+    return value and not 1e-4 <= abs(value) < 1e16
+
+
+def _has_mismatched_float(data):
+    """Return whether data holds a float orjson writes differently."""
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            # Keys too, which OPT_NON_STR_KEYS lets be floats
+            stack.extend(value)
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif type(value) is float and _mismatched_float(value):
+            return True
+    return False
+
+
+def _default(obj):
+    """Encode the types orjson leaves to us like JSONRenderer does."""
+    value = _encoder.default(obj)
+    if isinstance(value, float) and _mismatched_float(value):
+        # Such as Decimals below 1e-4 or NaN. Raising lets
+        # FastJSONRenderer fall back to JSONRenderer.
+        raise TypeError('Float not encoded like json.dumps')
+    return value
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer using orjson when it is installed.
+
+    Produces exactly the bytes JSONRenderer would. Datetimes and
+    Decimals go through the same encoder as JSONRenderer and anything
+    orjson cannot reproduce (indented output, non unicode output, very
+    large integers, floats it formats differently) is rendered by
+    JSONRenderer itself. Plain float NaN and infinity values are
+    written as null where JSONRenderer raises; no API returns them.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render data into JSON bytes."""
+        if data is None or orjson is None or not self.compact or (
+            self.ensure_ascii or self.get_indent(
+                accepted_media_type, renderer_context or {},
+            )
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=_default,
+                option=(
+                    orjson.OPT_PASSTHROUGH_DATETIME
+                    | orjson.OPT_NON_STR_KEYS
+                ),
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if (
+            _SMALL_FLOAT in ret
+            or _EXPONENT.search(ret.translate(_NUMBER_CHARS))
+        ) and _has_mismatched_float(data):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Escaped like JSONRenderer for embedding in JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029',
+        )
@@ -0,0 +1,83 @@
+"""
+File storage for recipe images.
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+def file_sha256(content):
+    """Return the hex SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Storage naming files after the SHA-256 of their content.
+
+    Saving a file keeps its directory and extension and replaces its
+    name by the hash, under a subdirectory named after the first two
+    characters of it. Identical files are therefore stored once and
+    may be used by many objects, so they are only deleted once nothing
+    refers to them (see the sweep_media command).
+    """
+
+    def save(self, name, content, max_length=None):
+        """Save content under the name derived from its hash."""
+        digest = file_sha256(content)
+        directory, filename = os.path.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, digest[:2], f'{digest}{ext}')
+        return self.store(name, content, max_length)
+
+    def store(self, name, content, max_length=None):
+        """Save content under name unless a file of that name exists.
+
+        For files whose name is derived from another content addressed
+        name, such as the renditions of an image.
+        """
+        return super().save(name, content, max_length)
+
+    def retire(self, name):
+        """Move a file aside, return its new name.
+
+        Saves of the same content write the file again from then on
+        instead of reusing it. The new name ends in .tmp, so the sweep
+        deletes it if it is left behind.
+        """
+        retired = f'{name}.{uuid.uuid4().hex}.tmp'
+        os.rename(self.path(name), self.path(retired))
+        return retired
+
+    def restore(self, retired, name):
+        """Move a file retired by retire back to its name."""
+        os.replace(self.path(retired), self.path(name))
+
+    def get_available_name(self, name, max_length=None):
+        """Return name, an existing file of that name has this content."""
+        return name
+
+    def _save(self, name, content):
+        try:
+            # Tells the sweep the file is in use again
+            os.utime(self.path(name))
+            return name
+        except FileNotFoundError:
+            pass
+
+        # Written aside and moved in place, so no one sees a partial
+        # file and concurrent saves of the same content do not clash.
+        temp_name = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(temp_name), self.path(name))
+        return name
+
+
+recipe_image_storage = ContentAddressedStorage()
@@ -0,0 +1,52 @@
+"""
+Tests for the in process caches.
+"""
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from core.cache import LRUCache
+
+
+class LRUCacheTests(SimpleTestCase):
+    """Test the LRU cache."""
+
+    def test_evicts_least_recently_used(self):
+        """Test the oldest unused entry is evicted when full."""
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    @patch('core.cache.time.monotonic')
+    def test_entries_expire(self, mock_monotonic):
+        """Test entries are dropped after the time to live."""
+        cache = LRUCache(maxsize=2, ttl=60)
+        mock_monotonic.return_value = 100
+        cache.set('a', 1)
+
+        mock_monotonic.return_value = 159
+        self.assertEqual(cache.get('a'), 1)
+        mock_monotonic.return_value = 160
+        self.assertIsNone(cache.get('a'))
+
+    def test_evicts_over_max_weight(self):
+        """Test the oldest entries are evicted while too heavy."""
+        cache = LRUCache(maxsize=10, ttl=60, max_weight=10, weigh=len)
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'x' * 4)
+        cache.set('a', 'x' * 2)
+        cache.set('c', 'x' * 5)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'xx')
+        self.assertEqual(cache.weight, 7)
+
+        cache.set('d', 'x' * 11)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.weight, 0)
@@ -0,0 +1,581 @@
+"""
+Test custom Django management commands.
+"""
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase
+
+from PIL import Image
+
+from core.management.batching import iter_id_batches
+from core.models import (
+    Recipe,
+    RecipeSignature,
+    Tag,
+    Ingredient,
+)
+from core.tests.utils import TempMediaRootMixin
+from recipe.similarity import similar_recipes
+
+
+class ImportRecipesTests(TestCase):
+    """Test the import_recipes command."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+
+    def _write(self, content, suffix):
+        """Write content to a temporary file and return its path."""
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def _import(self, path, *args):
+        """Run the import and return its output."""
+        out = StringIO()
+        call_command(
+            'import_recipes', path, '--user', self.user.email, *args,
+            stdout=out,
+        )
+        return out.getvalue()
+
+    def test_import_ndjson(self):
+        """Test importing recipes from NDJSON."""
+        Tag.objects.create(user=self.user, name='Vegan')
+        records = [
+            {
+                'title': f'Recipe {i}',
+                'time_minutes': i,
+                'price': '5.25',
+                'tags': [{'name': 'Vegan'}, {'name': f'Tag {i % 2}'}],
+                'ingredients': [{'name': 'Salt'}],
+            }
+            for i in range(5)
+        ]
+        path = self._write(
+            '\n'.join(json.dumps(record) for record in records), '.ndjson',
+        )
+
+        out = self._import(path, '--batch-size', '2')
+
+        self.assertIn('Imported 5 recipes', out)
+        recipes = Recipe.objects.filter(user=self.user).order_by('id')
+        self.assertEqual(recipes.count(), 5)
+        for i, recipe in enumerate(recipes):
+            self.assertEqual(recipe.title, f'Recipe {i}')
+            self.assertEqual(recipe.price, Decimal('5.25'))
+            self.assertEqual(recipe.description, '')
+            self.assertEqual(
+                sorted(recipe.tags.values_list('name', flat=True)),
+                sorted(['Vegan', f'Tag {i % 2}']),
+            )
+            self.assertEqual(
+                list(recipe.ingredients.values_list('name', flat=True)),
+                ['Salt'],
+            )
+        self.assertEqual(Tag.objects.count(), 3)
+        self.assertEqual(Ingredient.objects.count(), 1)
+        self.assertEqual(RecipeSignature.objects.count(), 5)
+        self.assertEqual(len(similar_recipes(recipes[0], 10, 10)), 4)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.data_version, 1)
+
+    def test_import_csv(self):
+        """Test importing recipes from CSV."""
+        path = self._write(
+            'id,title,time_minutes,price,link,description,tags,ingredients\n'
+            '7,"Soup, hot",10,2.50,,Tasty,Vegan|Dinner,\n',
+            '.csv',
+        )
+
+        self._import(path)
+
+        recipe = Recipe.objects.get(user=self.user)
+        self.assertEqual(recipe.title, 'Soup, hot')
+        self.assertEqual(recipe.description, 'Tasty')
+        self.assertEqual(recipe.link, '')
+        self.assertEqual(recipe.tags.count(), 2)
+        self.assertEqual(recipe.ingredients.count(), 0)
+
+    def test_invalid_record_imports_nothing(self):
+        """Test an invalid record aborts the whole import."""
+        path = self._write(
+            '{"title": "Good", "time_minutes": 1, "price": "1.00"}\n'
+            '{"title": "Bad", "time_minutes": "soon", "price": "1.00"}\n',
+            '.ndjson',
+        )
+
+        with self.assertRaisesMessage(CommandError, 'Record 2'):
+            self._import(path, '--batch-size', '1')
+
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_unknown_user(self):
+        """Test importing for a user who does not exist fails."""
+        path = self._write('', '.ndjson')
+
+        with self.assertRaises(CommandError):
+            call_command(
+                'import_recipes', path, '--user', 'nobody@example.com',
+                stdout=StringIO(),
+            )
+
+
+class SeedDataTests(TestCase):
+    """Test the seed_data command."""
+
+    def _seed(self, *args):
+        call_command('seed_data', *args, stdout=StringIO())
+
+    def test_seed_data(self):
+        """Test seeding users with skewed recipes."""
+        self._seed(
+            '--users', '2', '--recipes', '200', '--tags', '10',
+            '--ingredients', '20', '--batch-size', '100',
+        )
+
+        users = get_user_model().objects.filter(
+            email__startswith='seed-user-',
+        )
+        self.assertEqual(users.count(), 2)
+        user = users.first()
+        self.assertTrue(user.check_password('password123'))
+        self.assertEqual(Recipe.objects.filter(user=user).count(), 200)
+        self.assertEqual(Tag.objects.filter(user=user).count(), 10)
+        self.assertEqual(Ingredient.objects.filter(user=user).count(), 20)
+        for recipe in Recipe.objects.filter(user=user):
+            self.assertTrue(1 <= recipe.tags.count() <= 4)
+            self.assertTrue(3 <= recipe.ingredients.count() <= 12)
+        tags = Tag.objects.filter(user=user).annotate(
+            recipes=Count('recipe'),
+        )
+        counts = dict(tags.values_list('name', 'recipes'))
+        self.assertGreater(counts['Tag 1'], counts['Tag 10'])
+        self.assertEqual(RecipeSignature.objects.count(), 400)
+
+    def test_existing_users(self):
+        """Test seeding refuses to reuse existing users."""
+        self._seed('--users', '1', '--recipes', '1')
+
+        with self.assertRaises(CommandError):
+            self._seed('--users', '1', '--recipes', '1')
+
+
+class RunBenchmarksTests(TestCase):
+    """Test the run_benchmarks command."""
+
+    def setUp(self):
+        call_command(
+            'seed_data', '--users', '1', '--recipes', '20',
+            stdout=StringIO(),
+        )
+
+    def _run(self, *args):
+        """Run the benchmarks and return the output."""
+        out = StringIO()
+        call_command(
+            'run_benchmarks', '--requests', '2', '--warmup', '0',
+            '--scenarios', 'recipe-list', 'recipe-create', *args,
+            stdout=out,
+        )
+        return out.getvalue()
+
+    def test_run_benchmarks(self):
+        """Test benchmarks report every scenario and roll back."""
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        out = self._run('--output', path)
+
+        self.assertIn('recipe-list', out)
+        self.assertEqual(Recipe.objects.count(), 20)
+        with open(path) as f:
+            results = json.load(f)
+        self.assertEqual(
+            set(results['scenarios']), {'recipe-list', 'recipe-create'},
+        )
+        self.assertEqual(results['recipes'], 20)
+
+    def test_in_process_scenarios(self):
+        """Test the serialization and rendering scenarios run."""
+        scenarios = [
+            'serialize-serializer', 'serialize-rows',
+            'render-json', 'render-fast-json',
+        ]
+        out = StringIO()
+
+        call_command(
+            'run_benchmarks', '--requests', '2', '--warmup', '0',
+            '--serialize-sizes', '5,10', '--scenarios', *scenarios,
+            stdout=out,
+        )
+
+        for scenario in scenarios:
+            self.assertIn(f'{scenario}-5 ', out.getvalue())
+            self.assertIn(f'{scenario}-10 ', out.getvalue())
+
+    def test_invalid_serialize_sizes(self):
+        """Test serialization sizes must be positive integers."""
+        for value in ('0', '10,x', ''):
+            with self.assertRaises(CommandError):
+                call_command(
+                    'run_benchmarks', '--serialize-sizes', value,
+                    stdout=StringIO(),
+                )
+
+    def test_regression(self):
+        """Test a slower run than the baseline fails when asked to."""
+        baseline = {'scenarios': {'recipe-list': {
+            'p90_ms': 0.001,
+            'queries': 1,
+        }}}
+        path = self._write_baseline(baseline)
+
+        with self.assertRaisesMessage(CommandError, 'recipe-list p90'):
+            self._run('--baseline', path, '--fail-on-regression')
+
+    def _write_baseline(self, baseline):
+        """Write a baseline file and return its path."""
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(baseline, f)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_requires_seeded_users(self):
+        """Test benchmarks fail without seeded users."""
+        with self.assertRaises(CommandError):
+            self._run('--email-prefix', 'missing')
+
+
+class SweepMediaTests(TempMediaRootMixin, TestCase):
+    """Test the sweep_media command."""
+
+    def setUp(self):
+        super().setUp()
+        user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.recipe = Recipe.objects.create(
+            user=user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+        self.recipe.image.save('used.jpg', ContentFile(b'used'))
+        self.storage = self.recipe.image.storage
+        self.unused = self.storage.save(
+            'uploads/recipe/unused.jpg', ContentFile(b'unused'),
+        )
+        for name in (self.recipe.image.name, self.unused):
+            os.utime(self.storage.path(name), (0, 0))
+
+    def _run(self, *args):
+        """Run the command and return its output."""
+        out = StringIO()
+        call_command('sweep_media', *args, stdout=out)
+        return out.getvalue()
+
+    def test_sweep_media(self):
+        """Test unused images are deleted and used ones kept."""
+        output = self._run()
+
+        self.assertIn('Deleted 1 files, 6 bytes.', output)
+        self.assertFalse(self.storage.exists(self.unused))
+        self.assertTrue(self.storage.exists(self.recipe.image.name))
+
+    def test_dry_run(self):
+        """Test a dry run lists the files without deleting them."""
+        output = self._run('--dry-run')
+
+        self.assertIn(self.unused, output)
+        self.assertIn('Would delete 1 files', output)
+        self.assertTrue(self.storage.exists(self.unused))
+
+    def test_deleted_meanwhile(self):
+        """Test files deleted after they were listed are skipped."""
+        with patch.object(
+            self.storage, 'size', side_effect=FileNotFoundError,
+        ):
+            output = self._run()
+
+        self.assertIn('Deleted 0 files, 0 bytes.', output)
+
+    def test_grace(self):
+        """Test files written during the grace period are kept."""
+        os.utime(self.storage.path(self.unused))
+
+        output = self._run('--grace', '3600')
+
+        self.assertIn('Deleted 0 files', output)
+        self.assertTrue(self.storage.exists(self.unused))
+
+
+class RebuildRenditionsTests(TempMediaRootMixin, TestCase):
+    """Test the rebuild_renditions command."""
+
+    def setUp(self):
+        super().setUp()
+        user = get_user_model().objects.create_user('user@example.com')
+        self.recipe = Recipe.objects.create(
+            user=user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+        image = BytesIO()
+        Image.new('RGB', (400, 200)).save(image, format='JPEG')
+        self.recipe.image.save('lost.jpg', ContentFile(image.getvalue()))
+        Recipe.objects.create(
+            user=user,
+            title='No image',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+
+    def test_rebuild_renditions(self):
+        """Test renditions lost with their task are generated."""
+        out = StringIO()
+
+        call_command('rebuild_renditions', stdout=out)
+
+        self.assertIn('Processed 1 images', out.getvalue())
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            set(self.recipe.renditions), {'thumb', 'small', 'large'},
+        )
+        storage = self.recipe.image.storage
+        self.assertTrue(
+            storage.exists(self.recipe.renditions['thumb']['jpeg']),
+        )
+
+    def test_rebuilt_recipes_skipped(self):
+        """Test recipes with renditions are only checked with --all."""
+        call_command('rebuild_renditions', stdout=StringIO())
+        out = StringIO()
+
+        call_command('rebuild_renditions', stdout=out)
+        call_command('rebuild_renditions', '--all', stdout=out)
+
+        self.assertIn('Processed 0 images', out.getvalue())
+        self.assertIn('Processed 1 images', out.getvalue())
+
+
+class BackfillSearchVectorsTests(TestCase):
+    """Test the backfill_search_vectors command."""
+
+    def test_other_databases(self):
+        """Test nothing is done where vectors are not maintained."""
+        out = StringIO()
+
+        call_command('backfill_search_vectors', stdout=out)
+
+        if connection.vendor == 'postgresql':
+            self.assertIn('Computed 0 search vectors', out.getvalue())
+        else:
+            self.assertIn('only maintained on PostgreSQL', out.getvalue())
+
+    def test_invalid_batch_size(self):
+        """Test the batch size must be positive."""
+        with self.assertRaises(CommandError):
+            call_command('backfill_search_vectors', '--batch-size', '0')
+
+
+class RebuildSimilarityTests(TestCase):
+    """Test the rebuild_similarity command."""
+
+    def test_rebuild_similarity(self):
+        """Test recipes written without the API are indexed."""
+        user = get_user_model().objects.create_user('user@example.com')
+        egg = Ingredient.objects.create(user=user, name='Egg')
+        recipes = [
+            Recipe.objects.create(
+                user=user, title='Omelette', time_minutes=5,
+                price=Decimal('1.00'),
+            )
+            for _ in range(3)
+        ]
+        for recipe in recipes[:2]:
+            recipe.ingredients.add(egg)
+
+        call_command(
+            'rebuild_similarity', '--batch-size', '2', stdout=StringIO(),
+        )
+
+        self.assertEqual(
+            set(RecipeSignature.objects.values_list('recipe_id', flat=True)),
+            {recipes[0].id, recipes[1].id},
+        )
+        self.assertEqual(
+            similar_recipes(recipes[0], 10, 100), [(recipes[1].id, 1.0)],
+        )
+        user.refresh_from_db()
+        self.assertEqual(user.data_version, 1)
+
+
+class SweepOrphansTests(TestCase):
+    """Test the sweep_orphans command."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('user@example.com')
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Omelette', time_minutes=5,
+            price=Decimal('1.00'),
+        )
+        self.used_tag = Tag.objects.create(user=self.user, name='Used')
+        self.used_ingredient = Ingredient.objects.create(
+            user=self.user, name='Egg',
+        )
+        self.recipe.tags.add(self.used_tag)
+        self.recipe.ingredients.add(self.used_ingredient)
+        for i in range(5):
+            Tag.objects.create(user=self.user, name=f'Orphan {i}')
+        Ingredient.objects.create(user=self.user, name='Orphan')
+
+    def _sweep(self, *args):
+        out = StringIO()
+        call_command('sweep_orphans', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_sweep_orphans(self):
+        """Test unreferenced tags and ingredients are deleted."""
+        out = self._sweep()
+
+        self.assertIn('Deleted 5 tags and 1 ingredients', out)
+        self.assertEqual(list(Tag.objects.all()), [self.used_tag])
+        self.assertEqual(
+            list(Ingredient.objects.all()), [self.used_ingredient],
+        )
+        self.assertEqual(self.recipe.tags.count(), 1)
+        self.user.refresh_from_db()
+        self.assertGreater(self.user.data_version, 0)
+
+    def test_bump_owners_of_deleted_rows(self):
+        """Test only the users whose rows were deleted are bumped."""
+        other_user = get_user_model().objects.create_user(
+            'other@example.com',
+        )
+        other_recipe = Recipe.objects.create(
+            user=other_user, title='Toast', time_minutes=2,
+            price=Decimal('1.00'),
+        )
+        linked_tag = Tag.objects.create(user=other_user, name='Linked')
+        other_recipe.tags.add(linked_tag)
+
+        for returning in [True, False]:
+            orphan = Tag.objects.create(user=self.user, name=f'{returning}')
+            # The linked tag was an orphan when the batch was read
+            batch = [(orphan.id, self.user.id), (linked_tag.id, other_user.id)]
+            with self.subTest(returning=returning), patch(
+                'core.management.commands.sweep_orphans.can_return_rows',
+                return_value=returning,
+            ), patch(
+                'core.management.commands.sweep_orphans.iter_id_batches',
+                side_effect=lambda queryset, *args: iter(
+                    [batch] if queryset.model is Tag else [],
+                ),
+            ):
+                self.user.refresh_from_db()
+                version = self.user.data_version
+
+                out = self._sweep()
+
+                self.assertIn('Deleted 1 tags (1 linked meanwhile', out)
+                self.assertFalse(Tag.objects.filter(id=orphan.id).exists())
+                self.assertTrue(Tag.objects.filter(id=linked_tag.id).exists())
+                self.user.refresh_from_db()
+                self.assertEqual(self.user.data_version, version + 1)
+                other_user.refresh_from_db()
+                self.assertEqual(other_user.data_version, 0)
+
+    def test_dry_run(self):
+        """Test a dry run only counts the orphans."""
+        out = self._sweep('--dry-run')
+
+        self.assertIn('Would delete 5 tags and 1 ingredients', out)
+        self.assertEqual(Tag.objects.count(), 6)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.data_version, 0)
+
+    def test_interval(self):
+        """Test sweeping repeats until interrupted."""
+        with patch(
+            'core.management.commands.sweep_orphans.time.sleep',
+            side_effect=[None, KeyboardInterrupt],
+        ) as sleep:
+            out = self._sweep('--interval', '60')
+
+        sleep.assert_called_with(60)
+        self.assertEqual(out.count('Deleted'), 2)
+        self.assertIn('Deleted 0 tags and 0 ingredients', out)
+        self.assertIn('Stopped.', out)
+        self.assertEqual(Tag.objects.count(), 1)
+
+
+class BatchingTests(TestCase):
+    """Test the helpers of the batch commands."""
+
+    def test_iter_id_batches(self):
+        """Test rows are yielded in id order batches."""
+        user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        tags = [
+            Tag.objects.create(user=user, name=f'Tag {i}') for i in range(5)
+        ]
+        Tag.objects.filter(id=tags[2].id).update(name='Other')
+
+        batches = list(iter_id_batches(
+            Tag.objects.filter(name__startswith='Tag').order_by('-id'),
+            2, 'name',
+        ))
+
+        self.assertEqual(batches, [
+            [(tags[0].id, 'Tag 0'), (tags[1].id, 'Tag 1')],
+            [(tags[3].id, 'Tag 3'), (tags[4].id, 'Tag 4')],
+        ])
+
+    def test_invalid_batch_size(self):
+        """Test the batch commands reject batch sizes below 1."""
+        commands = [
+            'backfill_search_vectors', 'rebuild_renditions',
+            'rebuild_similarity', 'sweep_orphans',
+        ]
+        for command in commands:
+            for value in ['0', '-1', 'many']:
+                with self.subTest(command=command, value=value):
+                    with self.assertRaises(CommandError):
+                        call_command(command, '--batch-size', value)
+
+
+class SpectacularTests(TestCase):
+    """Test the OpenAPI schema generation."""
+
+    def test_schema_without_warnings(self):
+        """Test every view is described without errors or warnings."""
+        out = StringIO()
+
+        call_command(
+            'spectacular', '--fail-on-warn', stdout=out, stderr=StringIO(),
+        )
+
+        self.assertIn('/api/recipe/media/{name}', out.getvalue())
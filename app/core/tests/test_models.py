@@ -2,7 +2,6 @@
 Tests for models.
 """
 from decimal import Decimal
-from unittest.mock import patch
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from core import models
@@ -47,6 +46,17 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(recipe), recipe.title)
 
+    def test_bump_data_version(self):
+        """Test bumping the data version returns the new one."""
+        user = create_user()
+
+        version = get_user_model().objects.bump_data_version(user.id)
+
+        user.refresh_from_db()
+        self.assertEqual(version, user.data_version)
+        self.assertEqual(version, 1)
+        self.assertIsNotNone(user.data_modified)
+
     def test_create_tag(self):
         """Test creating a tag is successful."""
         user = create_user()
@@ -64,11 +74,19 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(ingredient), ingredient.name)
 
-    @patch('core.models.uuid.uuid4')
-    def test_recipe_file_name_uuid(self, mock_uuid):
+    def test_recipe_file_name(self):
         """Test generating image path."""
-        uuid = 'test-uuid'
-        mock_uuid.return_value = uuid
-        file_path = models.recipe_image_file_path(None, 'example.jpg')
+        file_path = models.recipe_image_file_path(None, 'example.JPG')
 
-        self.assertEqual(file_path, f'uploads/recipe/{uuid}.jpg')
+        self.assertEqual(file_path, 'uploads/recipe/image.jpg')
+
+    def test_recipe_link(self):
+        """Test the link models and columns of recipe relations."""
+        self.assertEqual(
+            models.recipe_link('tags'),
+            (models.Recipe.tags.through, 'tag_id'),
+        )
+        self.assertEqual(
+            models.recipe_link('ingredients'),
+            (models.Recipe.ingredients.through, 'ingredient_id'),
+        )
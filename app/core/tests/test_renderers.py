@@ -0,0 +1,124 @@
+"""
+Tests for the JSON renderer and parser.
+"""
+import datetime
+import io
+import uuid
+from collections import OrderedDict
+from decimal import Decimal
+from unittest import skipIf
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from core import renderers
+from core.parsers import FastJSONParser
+from core.renderers import FastJSONRenderer
+
+
+PAYLOADS = [
+    OrderedDict([
+        ('id', 1),
+        ('price', Decimal('5.50')),
+        ('created', datetime.datetime(2023, 1, 2, 3, 4, 5, 678901)),
+        ('updated', datetime.datetime(2023, 1, 2, tzinfo=timezone.utc)),
+        ('day', datetime.date(2023, 1, 2)),
+        ('time', datetime.time(3, 4, 5, 600)),
+        ('uuid', uuid.UUID('12345678-1234-5678-1234-567812345678')),
+        ('tags', [OrderedDict([('id', 2), ('name', 'Ünïcode "x"')])]),
+    ]),
+    {0: ['This field is required.'], 'detail': _('Not found.')},
+    [Decimal('0.00001'), Decimal('1E+20'), 1e16, 0.1, -0.0, None, True],
+    {'big': 2 ** 70, 'tuple': (1, 2), 'control': '\x00\x1f\x7f\n'},
+]
+
+
+@skipIf(renderers.orjson is None, 'orjson is not installed.')
+class FastJSONRendererTests(SimpleTestCase):
+    """Test the orjson based renderer."""
+
+    def test_output_identical(self):
+        """Test the output matches JSONRenderer byte for byte."""
+        for data in PAYLOADS:
+            self.assertEqual(
+                FastJSONRenderer().render(data),
+                JSONRenderer().render(data),
+            )
+
+    def test_uses_orjson(self):
+        """Test plain payloads are encoded by orjson."""
+        payloads = [
+            PAYLOADS[0],
+            # Strings that look like floats once digits are ignored
+            {'image': 'ab0e3f.jpg', 'name': '3eggs', 'hex': '1E5'},
+            [0.5, 1e15, -0.0001],
+        ]
+        for data in payloads:
+            with patch.object(
+                renderers.orjson, 'dumps', wraps=renderers.orjson.dumps,
+            ) as mock_dumps:
+                res = FastJSONRenderer().render(data)
+
+            mock_dumps.assert_called_once()
+            self.assertEqual(res, JSONRenderer().render(data))
+
+    def test_mismatched_floats_fall_back(self):
+        """Test floats orjson writes differently use JSONRenderer."""
+        for data in [[1e-5], {'a': [1e16]}, {1e20: 1}, Decimal('1E-7')]:
+            self.assertEqual(
+                FastJSONRenderer().render(data),
+                JSONRenderer().render(data),
+            )
+
+    def test_indent_falls_back(self):
+        """Test indented output is rendered by JSONRenderer."""
+        media_type = 'application/json; indent=4'
+
+        res = FastJSONRenderer().render(PAYLOADS[0], media_type)
+
+        self.assertEqual(res, JSONRenderer().render(PAYLOADS[0], media_type))
+
+    def test_invalid_decimal(self):
+        """Test non finite decimals are refused like JSONRenderer does."""
+        with self.assertRaises(ValueError):
+            FastJSONRenderer().render({'price': Decimal('NaN')})
+
+    @patch('core.renderers.orjson', None)
+    def test_without_orjson(self):
+        """Test rendering works when orjson is not installed."""
+        self.assertEqual(
+            FastJSONRenderer().render(PAYLOADS[0]),
+            JSONRenderer().render(PAYLOADS[0]),
+        )
+
+
+class FastJSONParserTests(SimpleTestCase):
+    """Test the orjson based parser."""
+
+    def _parse(self, parser, body):
+        return parser.parse(io.BytesIO(body))
+
+    def test_output_identical(self):
+        """Test bodies parse to the same data as with JSONParser."""
+        bodies = [
+            b'{"a": [1, 2.5, "\\u00fc", null, true]}',
+            b'{"big": 12345678901234567890123}',
+            b'"\\ud800"',
+        ]
+        for body in bodies:
+            self.assertEqual(
+                self._parse(FastJSONParser(), body),
+                self._parse(JSONParser(), body),
+            )
+
+    def test_invalid_json(self):
+        """Test invalid bodies raise a parse error."""
+        for body in [b'{"a": ', b'{"a": NaN}', b'']:
+            with self.assertRaises(ParseError):
+                self._parse(FastJSONParser(), body)
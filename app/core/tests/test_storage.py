@@ -0,0 +1,55 @@
+"""
+Tests for the content addressed storage.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+
+from core.storage import ContentAddressedStorage
+
+
+class ContentAddressedStorageTests(SimpleTestCase):
+    """Test storing files by the hash of their content."""
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = ContentAddressedStorage(location=location)
+
+    def test_named_after_content(self):
+        """Test files are named after the hash of their content."""
+        digest = hashlib.sha256(b'content').hexdigest()
+
+        name = self.storage.save('images/photo.JPG', ContentFile(b'content'))
+
+        self.assertEqual(name, f'images/{digest[:2]}/{digest}.jpg')
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'content')
+
+    def test_identical_files_stored_once(self):
+        """Test saving the same content again reuses the file."""
+        first = self.storage.save('images/a.jpg', ContentFile(b'content'))
+        os.utime(self.storage.path(first), (0, 0))
+
+        second = self.storage.save('images/b.jpg', ContentFile(b'content'))
+        other = self.storage.save('images/c.jpg', ContentFile(b'other'))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(self.storage.listdir('images')[1], [])
+        # Marked as recently used
+        self.assertGreater(os.path.getmtime(self.storage.path(first)), 0)
+
+    def test_store_keeps_name(self):
+        """Test derived files are stored under the name given."""
+        name = self.storage.store('images/a-thumb.jpg', ContentFile(b'x'))
+
+        self.assertEqual(name, 'images/a-thumb.jpg')
+        self.assertFalse(any(
+            filename.endswith('.tmp')
+            for filename in self.storage.listdir('images')[1]
+        ))
@@ -0,0 +1,86 @@
+"""
+Streaming export of recipes.
+
+Recipes are read in chunks by descending id, each chunk with one query
+for its rows and one per relation, so memory use depends on the chunk
+size and not on how many recipes are exported.
+"""
+import csv
+
+from core.renderers import FastJSONRenderer
+from recipe.listing import RECIPE_LIST_FIELDS, serialize_recipe_rows
+
+
+EXPORT_FIELDS = RECIPE_LIST_FIELDS + ['description']
+
+# Renditions are image URLs, which only NDJSON exports include
+CSV_FIELDS = [field for field in EXPORT_FIELDS if field != 'renditions']
+
+CSV_COLUMNS = CSV_FIELDS + ['tags', 'ingredients']
+
+# Separates tag and ingredient names within a CSV cell
+CSV_NAME_SEPARATOR = '|'
+
+
+def iter_recipe_chunks(queryset, chunk_size, request=None):
+    """Yield lists of serialized recipes, newest first.
+
+    Each chunk starts after the last id of the previous one, so
+    recipes created or deleted during the export do not shift the
+    remaining chunks.
+    """
+    queryset = queryset.order_by('-id').values(*EXPORT_FIELDS)
+    last_id = None
+    while True:
+        chunk = queryset if last_id is None else queryset.filter(
+            id__lt=last_id,
+        )
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+
+        data = serialize_recipe_rows(rows, request)
+        for item, row in zip(data, rows):
+            item['description'] = row['description']
+        yield data
+
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1]['id']
+
+
+def iter_ndjson(queryset, chunk_size, request=None):
+    """Yield the recipes as newline delimited JSON, a chunk at a time."""
+    renderer = FastJSONRenderer()
+    for data in iter_recipe_chunks(queryset, chunk_size, request):
+        yield b''.join(renderer.render(item) + b'\n' for item in data)
+
+
+class _Echo:
+    """File-like object returning what is written to it."""
+
+    def write(self, value):
+        """Return value instead of storing it."""
+        return value
+
+
+def iter_csv(queryset, chunk_size, request=None):
+    """Yield the recipes as CSV rows, a chunk at a time.
+
+    Tags and ingredients are written as their names joined by
+    CSV_NAME_SEPARATOR.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for data in iter_recipe_chunks(queryset, chunk_size, request):
+        yield ''.join(
+            writer.writerow(
+                [item[field] for field in CSV_FIELDS] + [
+                    CSV_NAME_SEPARATOR.join(
+                        related['name'] for related in item[relation]
+                    )
+                    for relation in ('tags', 'ingredients')
+                ]
+            )
+            for item in data
+        )
@@ -0,0 +1,115 @@
+"""
+Filtering recipes by their tags and ingredients.
+
+?tags=1,2 lists the recipes with any of the tags, adding
+?tags_match=all only those with all of them; ingredients work the
+same. Each condition is an EXISTS subquery on the link table, answered
+from its (recipe_id, tag_id) index, so recipes are never joined to
+their links and need no DISTINCT.
+"""
+from django.db.models import Exists, OuterRef
+from django.utils.translation import gettext as _
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from core.models import recipe_link
+
+
+# Values of the <relation>_match parameters
+MATCH_ANY = 'any'
+MATCH_ALL = 'all'
+
+# Most ids accepted per relation
+MAX_FILTER_IDS = 20
+
+
+def parse_ids(param, value, max_ids=MAX_FILTER_IDS):
+    """Return the ids of a comma separated list, raising if invalid."""
+    try:
+        ids = sorted({int(id) for id in value.split(',') if id.strip()})
+    except ValueError:
+        ids = None
+    if not ids or len(ids) > max_ids:
+        raise ValidationError({param: [
+            _('Expected up to %d comma separated ids.') % max_ids
+        ]})
+    return ids
+
+
+def parse_limit(request, param, default, maximum):
+    """Return the number of results requested, raising if invalid."""
+    try:
+        limit = int(request.query_params.get(param, default))
+    except (TypeError, ValueError):
+        limit = 0
+    if not 1 <= limit <= maximum:
+        raise ValidationError({param: [
+            _('Expected a number from 1 to %d.') % maximum
+        ]})
+    return limit
+
+
+def _links(relation, ids):
+    """Return whether a recipe is linked to any of ids."""
+    through, target = recipe_link(relation)
+    return Exists(through.objects.filter(
+        recipe_id=OuterRef('pk'),
+        **{f'{target}__in': ids},
+    ))
+
+
+def filter_related(queryset, relation, ids, match=MATCH_ANY):
+    """Return the recipes linked to any or all of the related ids."""
+    if match == MATCH_ALL:
+        for id in ids:
+            queryset = queryset.filter(_links(relation, [id]))
+        return queryset
+    return queryset.filter(_links(relation, ids))
+
+
+class RecipeRelationFilter(BaseFilterBackend):
+    """Filter recipes by ?tags= and ?ingredients= ids."""
+
+    relations = ['tags', 'ingredients']
+
+    def filter_queryset(self, request, queryset, view):
+        """Return the recipes with the requested tags and ingredients."""
+        for relation in self.relations:
+            value = request.query_params.get(relation)
+            if value is None:
+                continue
+            match_param = f'{relation}_match'
+            match = request.query_params.get(match_param, MATCH_ANY)
+            if match not in (MATCH_ANY, MATCH_ALL):
+                raise ValidationError({match_param: [
+                    _('Expected one of: %s.') % f'{MATCH_ANY}, {MATCH_ALL}'
+                ]})
+            queryset = filter_related(
+                queryset, relation, parse_ids(relation, value), match,
+            )
+        return queryset
+
+    def get_schema_operation_parameters(self, view):
+        """Describe the filter parameters in the API schema."""
+        parameters = []
+        for relation in self.relations:
+            parameters += [{
+                'name': relation,
+                'required': False,
+                'in': 'query',
+                'description': (
+                    f'Comma separated {relation} ids to filter by.'
+                ),
+                'schema': {'type': 'string'},
+            }, {
+                'name': f'{relation}_match',
+                'required': False,
+                'in': 'query',
+                'description': (
+                    f'Whether recipes need any (default) or all of the '
+                    f'{relation}.'
+                ),
+                'schema': {'type': 'string', 'enum': [MATCH_ANY, MATCH_ALL]},
+            }]
+        return parameters
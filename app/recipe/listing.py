@@ -0,0 +1,80 @@
+"""
+Read-only serialization of recipe lists from plain rows.
+
+Builds the same representation as RecipeSerializer from .values() rows
+and one grouped query per relation, without creating model instances
+or running serializer fields per object.
+"""
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+
+from core.models import recipe_link
+from recipe.renditions import rendition_urls
+from recipe.serializers import RecipeSerializer
+
+
+# Columns of the recipe rows, in RecipeSerializer field order
+RECIPE_LIST_FIELDS = [
+    'id', 'title', 'time_minutes', 'price', 'link', 'renditions',
+]
+
+# Nested relations of RecipeSerializer, in field order
+RECIPE_LIST_RELATIONS = ['tags', 'ingredients']
+
+
+@lru_cache(maxsize=None)
+def _price_field():
+    """Return the serializer field formatting recipe prices."""
+    return RecipeSerializer().fields['price']
+
+
+def get_related_rows(recipe_ids, relation):
+    """Return the related id/name pairs of each recipe, by recipe id.
+
+    Runs a single query over the through table joined to the related
+    table, ordered by related id.
+    """
+    through, target = recipe_link(relation)
+    rows = (
+        through.objects
+        .filter(recipe_id__in=recipe_ids)
+        .order_by(target)
+        .values_list('recipe_id', target, f'{target}__name')
+    )
+
+    related = defaultdict(list)
+    for recipe_id, related_id, name in rows:
+        related[recipe_id].append(
+            OrderedDict((('id', related_id), ('name', name)))
+        )
+    return related
+
+
+def serialize_recipe_rows(rows, request=None):
+    """Return the RecipeSerializer representation of recipe rows.
+
+    rows are dicts holding RECIPE_LIST_FIELDS, as returned by
+    .values(*RECIPE_LIST_FIELDS). URLs are absolute when given the
+    request, like in serializers with the request in their context.
+    """
+    recipe_ids = [row['id'] for row in rows]
+    related = {
+        relation: get_related_rows(recipe_ids, relation) if rows else {}
+        for relation in RECIPE_LIST_RELATIONS
+    }
+    price = _price_field().to_representation
+
+    data = []
+    for row in rows:
+        item = OrderedDict((
+            ('id', row['id']),
+            ('title', row['title']),
+            ('time_minutes', row['time_minutes']),
+            ('price', price(row['price'])),
+            ('link', row['link']),
+        ))
+        for relation in RECIPE_LIST_RELATIONS:
+            item[relation] = related[relation].get(row['id'], [])
+        item['renditions'] = rendition_urls(row['renditions'], request)
+        data.append(item)
+    return data
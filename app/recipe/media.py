@@ -0,0 +1,167 @@
+"""
+Access to recipe image files and deleting those nothing refers to.
+
+Images are stored once per content (see core.storage), so a file may
+only be deleted once no recipe uses it. An image and its renditions
+share a stem: `<hash>.jpg`, `<hash>-thumb.jpg`, `<hash>-thumb.webp`...
+Renditions are kept as long as their original is used.
+
+Files written less than RECIPE_IMAGE_GRACE_SECONDS ago are never
+deleted: the recipe using them may not be committed yet.
+"""
+import datetime
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Recipe
+
+
+IMAGE_DIRECTORY = os.path.join('uploads', 'recipe')
+
+
+def get_storage():
+    """Return the storage of recipe images."""
+    return Recipe._meta.get_field('image').storage
+
+
+def split_rendition(name):
+    """Return the stem of a file and whether it is a rendition."""
+    stem = os.path.splitext(name)[0]
+    base, sep, size_name = stem.rpartition('-')
+    if sep and size_name in settings.RECIPE_IMAGE_RENDITIONS:
+        return base, True
+    return stem, False
+
+
+def user_has_image(user, name):
+    """Return whether one of the user's recipes uses the file name.
+
+    Renditions belong to the recipes using their original.
+    """
+    stem, is_rendition = split_rendition(name)
+    recipes = Recipe.objects.filter(user=user)
+    if is_rendition:
+        recipes = recipes.filter(image__startswith=f'{stem}.')
+    else:
+        recipes = recipes.filter(image=name)
+    return recipes.exists()
+
+
+def _is_old(storage, name, grace):
+    """Return whether name was last written more than grace ago."""
+    try:
+        modified = storage.get_modified_time(name)
+    except FileNotFoundError:
+        return False
+    return modified < timezone.now() - datetime.timedelta(seconds=grace)
+
+
+def release_image(name, storage=None, grace=None):
+    """Delete an image and its renditions if no recipe uses it.
+
+    Returns the names of the deleted files.
+    """
+    storage = storage or get_storage()
+    if grace is None:
+        grace = settings.RECIPE_IMAGE_GRACE_SECONDS
+    if not name or Recipe.objects.filter(image=name).exists() or \
+            not _is_old(storage, name, grace):
+        return []
+
+    # An upload of the same content would only touch the file, so it is
+    # moved aside before checking again. Uploads which touched it first
+    # show in the checks, later ones write it again.
+    try:
+        retired = storage.retire(name)
+    except FileNotFoundError:
+        # Released concurrently
+        return []
+    if Recipe.objects.filter(image=name).exists() or \
+            not _is_old(storage, retired, grace):
+        storage.restore(retired, name)
+        return []
+    storage.delete(retired)
+    if storage.exists(name):
+        # Written again by an upload, which reuses the renditions
+        return []
+
+    directory, filename = os.path.split(name)
+    stem = split_rendition(filename)[0]
+    renditions = []
+    for other in storage.listdir(directory)[1]:
+        other_stem, is_rendition = split_rendition(other)
+        if other_stem != stem:
+            continue
+        if not is_rendition:
+            # The same content under another extension shares them
+            return [name]
+        renditions.append(os.path.join(directory, other))
+    for path in renditions:
+        storage.delete(path)
+    return [name] + renditions
+
+
+def release_images_on_commit(names):
+    """Release images once the transaction dropping them commits."""
+    names = {name for name in names if name}
+    if names:
+        transaction.on_commit(
+            lambda: [release_image(name) for name in sorted(names)]
+        )
+
+
+def _walk(storage, directory):
+    """Yield the directories under directory, with their files."""
+    try:
+        directories, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    yield directory, files
+    for child in sorted(directories):
+        yield from _walk(storage, os.path.join(directory, child))
+
+
+def _unreferenced_in(storage, directory, files, grace, batch_size):
+    """Yield the files of a directory not used by any recipe."""
+    groups = {}
+    for filename in sorted(files):
+        path = os.path.join(directory, filename)
+        if filename.endswith('.tmp') or filename.startswith('.'):
+            # Left over by an interrupted save
+            if _is_old(storage, path, grace):
+                yield path
+            continue
+        stem, is_rendition = split_rendition(filename)
+        originals, renditions = groups.setdefault(stem, ([], []))
+        (renditions if is_rendition else originals).append(path)
+
+    stems = list(groups)
+    for start in range(0, len(stems), batch_size):
+        batch = [groups[stem] for stem in stems[start:start + batch_size]]
+        used = set(Recipe.objects.filter(
+            image__in=[path for originals, _ in batch for path in originals],
+        ).values_list('image', flat=True))
+        for originals, renditions in batch:
+            if used.intersection(originals):
+                continue
+            for path in originals + renditions:
+                if _is_old(storage, path, grace):
+                    yield path
+
+
+def iter_unreferenced(storage=None, grace=None, batch_size=1000):
+    """Yield the names of recipe image files no recipe uses.
+
+    Files are looked up with one query per batch_size images of a
+    directory.
+    """
+    storage = storage or get_storage()
+    if grace is None:
+        grace = settings.RECIPE_IMAGE_GRACE_SECONDS
+    for directory, files in _walk(storage, IMAGE_DIRECTORY):
+        yield from _unreferenced_in(
+            storage, directory, files, grace, batch_size,
+        )
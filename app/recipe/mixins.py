@@ -0,0 +1,245 @@
+"""
+Mixins for the recipe APIs.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from calendar import timegm
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    """Answer conditional list and detail requests without querying.
+
+    The ETag and Last-Modified headers come from the data version of
+    the authenticated user, which every write to their recipes, tags or
+    ingredients bumps. A request whose If-None-Match or
+    If-Modified-Since still matches gets a 304 after a single lookup of
+    that version. Detail routes then check that the object exists, so
+    a missing or foreign one is a 404 whatever the preconditions.
+    """
+
+    def list(self, request, *args, **kwargs):
+        """List objects unless the client's copy is current."""
+        return self._conditional(super().list, request, *args, **kwargs)
+
+    def check_object_exists(self, **kwargs):
+        """Raise Http404 unless the object of a detail route exists.
+
+        Filtered like get_object, but only its existence is queried,
+        without loading it or prefetching its relations.
+        """
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            exists = queryset.filter(**{self.lookup_field: lookup}).exists()
+        except (TypeError, ValueError, ValidationError):
+            exists = False
+        if not exists:
+            raise Http404
+
+    def get_validators(self, request):
+        """Return the data version, ETag and Last-Modified timestamp.
+
+        Last-Modified has a resolution of a second, so it is None while
+        another write could still happen within the second of the last
+        one and leave it unchanged.
+        """
+        version, modified = get_user_model().objects.get_data_version(
+            request.user.id,
+        )
+        etag = quote_etag(
+            f'{request.user.id}-{version}-{request.accepted_renderer.format}'
+        )
+        last_modified = modified and timegm(modified.utctimetuple())
+        if last_modified and last_modified >= int(time.time()):
+            last_modified = None
+        return version, etag, last_modified
+
+    def get_versioned_response(self, handler, version, request, *args,
+                               **kwargs):
+        """Return the response for the given data version of the user."""
+        return handler(request, *args, **kwargs)
+
+    def _conditional(self, handler, request, *args, **kwargs):
+        # The version is read before the data, so a write in between
+        # leaves the client with an outdated ETag and never with
+        # outdated data behind a current one.
+        version, etag, last_modified = self.get_validators(request)
+        # For handlers whose data depends on the version
+        self.data_version = version
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified,
+        )
+        if response is not None and (
+            (self.lookup_url_kwarg or self.lookup_field) in kwargs
+        ):
+            # The validators cover all of the user's data, not the
+            # object, which handlers look up themselves otherwise
+            self.check_object_exists(**kwargs)
+        if response is None:
+            response = self.get_versioned_response(
+                handler, version, request, *args, **kwargs,
+            )
+
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            # Responses are per user, so shared caches must not reuse
+            # them and clients should revalidate every time.
+            patch_cache_control(response, private=True, no_cache=True)
+
+        return response
+
+
+class ConditionalRetrieveMixin:
+    """Answer conditional detail requests, see ConditionalGetMixin.
+
+    For views with RetrieveModelMixin, next to ConditionalGetMixin.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve an object unless the client's copy is current."""
+        return self._conditional(super().retrieve, request, *args, **kwargs)
+
+
+class RowListMixin:
+    """List objects from .values() rows instead of model instances.
+
+    Views set list_fields to the columns to load. Rows are serialized
+    with get_serializer, which reads dicts like objects, so that suits
+    serializers whose fields are all columns of list_fields. Views with
+    nested or computed fields override serialize_rows.
+    """
+    list_fields = None
+
+    def get_list_fields(self):
+        """Return the columns to load for the list."""
+        return self.list_fields
+
+    def serialize_rows(self, rows):
+        """Return the representation of a list of rows."""
+        return self.get_serializer(rows, many=True).data
+
+    def list(self, request, *args, **kwargs):
+        """List objects from plain rows."""
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.values(*self.get_list_fields())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.serialize_rows(page))
+
+        return Response(self.serialize_rows(list(queryset)))
+
+
+logger = logging.getLogger(__name__)
+
+
+class CacheStats:
+    """Hit and miss counters of a cache in this process.
+
+    The counters are logged every RECIPE_RESPONSE_CACHE_STATS_EVERY
+    lookups, per process as each has its own.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        """Count a cache lookup."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            hits, misses = self.hits, self.misses
+
+        every = settings.RECIPE_RESPONSE_CACHE_STATS_EVERY
+        if every and (hits + misses) % every == 0:
+            logger.info(
+                '%s in process %d: %d hits, %d misses (%.1f%% hits)',
+                self.name, os.getpid(), hits, misses,
+                100 * hits / (hits + misses),
+            )
+
+    def reset(self):
+        """Reset the counters to zero."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+response_cache_stats = CacheStats('Recipe response cache')
+
+
+class CachedResponseMixin(ConditionalGetMixin):
+    """Cache list and detail response data per user.
+
+    Enabled by naming one of CACHES in RECIPE_RESPONSE_CACHE. Entries
+    are keyed by the user's data version, so every write through the
+    API's serializers and views makes the old entries unreachable and
+    they simply expire. Writes that bypass them must bump the version.
+    """
+
+    def get_response_cache_key(self, version, request, **kwargs):
+        """Return the cache key of a response."""
+        # Paginated responses hold absolute links, so the host matters
+        params = '&'.join([
+            request.build_absolute_uri('/'),
+            request.accepted_renderer.format,
+            request.query_params.urlencode(),
+        ] + [
+            f'{key}={value}' for key, value in sorted(kwargs.items())
+        ])
+        digest = hashlib.md5(params.encode()).hexdigest()
+        return (
+            f'recipe-response:{request.user.id}:{version}:'
+            f'{self.basename}-{self.action}:{digest}'
+        )
+
+    def get_versioned_response(self, handler, version, request, *args,
+                               **kwargs):
+        """Return the cached response data or cache the response."""
+        alias = settings.RECIPE_RESPONSE_CACHE
+        if not alias:
+            return super().get_versioned_response(
+                handler, version, request, *args, **kwargs,
+            )
+
+        if (self.lookup_url_kwarg or self.lookup_field) in kwargs:
+            # Entries would outlive objects deleted without a bump of
+            # the version, and the check costs much less than a miss
+            self.check_object_exists(**kwargs)
+        cache = caches[alias]
+        key = self.get_response_cache_key(version, request, **kwargs)
+        data = cache.get(key)
+        response_cache_stats.record(hit=data is not None)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = super().get_versioned_response(
+            handler, version, request, *args, **kwargs,
+        )
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RECIPE_RESPONSE_CACHE_TTL)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,32 @@
+"""
+Pagination for the recipe APIs.
+"""
+from django.conf import settings
+
+from rest_framework.pagination import CursorPagination
+
+from recipe.search import RANK_FIELD, get_search_terms
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Keyset pagination over the recipe list.
+
+    The cursor encodes the last seen id, so every page is a single
+    indexed range scan regardless of how deep the client has paged, and
+    recipes created in the meantime never shift the following pages.
+    """
+    # Must match the ordering of RecipeViewSet.get_queryset. The id is
+    # unique which keeps cursors stable without an offset component.
+    ordering = '-id'
+
+    # Clients can ask for a different size up to max_page_size.
+    page_size = settings.RECIPE_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        """Order search results by rank, then like the list."""
+        if get_search_terms(request):
+            # Ties in rank are paged by offset within the cursor
+            return (f'-{RANK_FIELD}', self.ordering)
+        return super().get_ordering(request, queryset, view)
@@ -0,0 +1,281 @@
+"""
+Matching recipes against the ingredients a user has.
+
+Each process keeps, for recently active users, a bitset per ingredient
+of the recipes using it, bit i standing for the user's i-th oldest
+recipe. Matching a pantry adds up the bitsets of its ingredients into
+per-recipe counts kept as bit planes (plane j holds bit j of every
+recipe's count), subtracts them from the recipes' ingredient counts
+the same way, and reads the recipes missing 0, 1, 2... ingredients off
+the planes. Every step works on whole bitsets in C, so recipes cost a
+bit each rather than a Python object each.
+
+An index is valid for one data version of its user. Writes through the
+API pass the ingredients they changed along with the version they
+bumped to, and once committed these are applied to the cached index
+when it is at the version before. Otherwise, e.g. after a write of
+another process, the next match rebuilds the index with one query.
+"""
+import sys
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import transaction
+
+from core.cache import LRUCache
+from core.models import Recipe
+
+
+def _bitset(positions, size):
+    """Return an int with the bits at positions set."""
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def _bit_planes(counts):
+    """Return the bit planes of a list of non-negative counts."""
+    planes = []
+    bit = 0
+    while any(count >> bit for count in counts):
+        planes.append(_bitset(
+            [i for i, count in enumerate(counts) if count >> bit & 1],
+            len(counts),
+        ))
+        bit += 1
+    return planes
+
+
+def _increment(planes, bitset):
+    """Add one to the counts in planes of the bits set in bitset."""
+    carry = bitset
+    for j, plane in enumerate(planes):
+        planes[j] = plane ^ carry
+        carry &= plane
+        if not carry:
+            return
+    planes.append(carry)
+
+
+def _decrement(planes, bitset):
+    """Subtract one from the counts in planes of the bits set in bitset.
+
+    None of these counts may be 0.
+    """
+    borrow = bitset
+    for j, plane in enumerate(planes):
+        planes[j] = plane ^ borrow
+        borrow &= ~plane
+        if not borrow:
+            return
+
+
+def _set_count(planes, position, count):
+    """Set the count at position in planes."""
+    bit = 1 << position
+    while count >> len(planes):
+        planes.append(0)
+    for j, plane in enumerate(planes):
+        planes[j] = plane | bit if count >> j & 1 else plane & ~bit
+
+
+def _subtract(minuend, subtrahend):
+    """Return the planes of the differences of two sets of planes.
+
+    No count of subtrahend may exceed the matching one of minuend.
+    """
+    difference = []
+    borrow = 0
+    for j, a in enumerate(minuend):
+        b = subtrahend[j] if j < len(subtrahend) else 0
+        difference.append(a ^ b ^ borrow)
+        borrow = (~a & b) | (~(a ^ b) & borrow)
+    return difference
+
+
+def _equal(planes, count, within):
+    """Return the bits of within whose count in planes is count."""
+    if count >> len(planes):
+        return 0
+    bits = within
+    for j, plane in enumerate(planes):
+        bits &= plane if count >> j & 1 else ~plane
+    return bits
+
+
+class PantryIndex:
+    """Recipes of a user by ingredient, with their ingredient counts."""
+
+    def __init__(self, links):
+        ingredients = {}
+        for recipe_id, ingredient_id in links:
+            recipe_ingredients = ingredients.setdefault(recipe_id, [])
+            # Recipes without ingredients come with None
+            if ingredient_id is not None:
+                recipe_ingredients.append(ingredient_id)
+
+        self.recipe_ids = array('q', sorted(ingredients))
+        positions = {}
+        for i, recipe_id in enumerate(self.recipe_ids):
+            for ingredient_id in ingredients[recipe_id]:
+                positions.setdefault(ingredient_id, []).append(i)
+
+        size = len(self.recipe_ids)
+        self.bitsets = {
+            ingredient_id: _bitset(recipe_positions, size)
+            for ingredient_id, recipe_positions in positions.items()
+        }
+        self.size_planes = _bit_planes(
+            [len(ingredients[recipe_id]) for recipe_id in self.recipe_ids]
+        )
+
+    def _position(self, recipe_id):
+        """Return the bit of a recipe, or None if it is not indexed."""
+        i = bisect_left(self.recipe_ids, recipe_id)
+        if i < len(self.recipe_ids) and self.recipe_ids[i] == recipe_id:
+            return i
+        return None
+
+    def set_ingredients(self, recipe_id, ingredient_ids):
+        """Index the ingredients of a recipe, ingredient_ids replacing
+        the ones indexed. Pass None for a deleted recipe.
+
+        Return False if the recipe cannot be placed, i.e. it is new
+        but older than the newest one indexed.
+        """
+        position = self._position(recipe_id)
+        if position is None:
+            if ingredient_ids is None:
+                return True
+            if self.recipe_ids and recipe_id < self.recipe_ids[-1]:
+                # Recipes without ingredients never match anyway
+                return not ingredient_ids
+            position = len(self.recipe_ids)
+            self.recipe_ids.append(recipe_id)
+        else:
+            bit = 1 << position
+            for ingredient_id, bitset in self.bitsets.items():
+                if bitset & bit:
+                    self.bitsets[ingredient_id] = bitset ^ bit
+
+        ingredient_ids = set(ingredient_ids or ())
+        bit = 1 << position
+        for ingredient_id in ingredient_ids:
+            self.bitsets[ingredient_id] = (
+                self.bitsets.get(ingredient_id, 0) | bit
+            )
+        _set_count(self.size_planes, position, len(ingredient_ids))
+        return True
+
+    def remove_ingredient(self, ingredient_id):
+        """Drop a deleted ingredient from the recipes using it."""
+        bitset = self.bitsets.pop(ingredient_id, 0)
+        if bitset:
+            _decrement(self.size_planes, bitset)
+
+    def nbytes(self):
+        """Return the approximate memory used by the index."""
+        return (
+            sys.getsizeof(self.recipe_ids)
+            + sys.getsizeof(self.bitsets)
+            + sum(map(sys.getsizeof, self.bitsets.values()))
+            + sum(map(sys.getsizeof, self.size_planes))
+        )
+
+    def match(self, ingredient_ids, limit):
+        """Return the best covered recipes as (recipe id, missing count).
+
+        Recipes missing the fewest ingredients come first, the ones
+        with none missing being fully makeable, then the newest. Only
+        recipes using at least one of the ingredients are returned.
+        """
+        held = []
+        candidates = 0
+        for ingredient_id in set(ingredient_ids):
+            bitset = self.bitsets.get(ingredient_id)
+            if bitset:
+                _increment(held, bitset)
+                candidates |= bitset
+        missing = _subtract(self.size_planes, held)
+
+        matches = []
+        missing_count = 0
+        while candidates and len(matches) < limit:
+            bits = _equal(missing, missing_count, candidates)
+            candidates &= ~bits
+            # The highest bits are the newest recipes
+            while bits and len(matches) < limit:
+                position = bits.bit_length() - 1
+                bits ^= 1 << position
+                matches.append((self.recipe_ids[position], missing_count))
+            missing_count += 1
+        return matches
+
+
+# Pantry indexes of this process, by user
+pantry_index_cache = LRUCache(
+    settings.PANTRY_INDEX_CACHE_SIZE,
+    settings.PANTRY_INDEX_CACHE_TTL,
+    max_weight=settings.PANTRY_INDEX_CACHE_MAX_BYTES,
+    weigh=lambda entry: entry[1].nbytes(),
+)
+
+
+def build_pantry_index(user_id):
+    """Return the pantry index of the user's recipes."""
+    return PantryIndex(
+        Recipe.objects.filter(user_id=user_id)
+        .values_list('id', 'ingredients')
+        .iterator(chunk_size=10000)
+    )
+
+
+def get_pantry_index(user_id, version):
+    """Return the user's pantry index for the data version."""
+    cached = pantry_index_cache.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    index = build_pantry_index(user_id)
+    if settings.PANTRY_INDEX_CACHE_SIZE:
+        pantry_index_cache.set(user_id, (version, index))
+    return index
+
+
+def _advance_pantry_index(user_id, version, recipes, removed_ingredients):
+    """Apply a committed write to the cached index of the user."""
+    cached = pantry_index_cache.get(user_id)
+    if cached is None:
+        return
+    if version is None or cached[0] != version - 1:
+        # Writes in between are unknown, the next match rebuilds
+        if version is None or cached[0] < version:
+            pantry_index_cache.delete(user_id)
+        return
+
+    index = cached[1]
+    for ingredient_id in removed_ingredients:
+        index.remove_ingredient(ingredient_id)
+    for recipe_id, ingredient_ids in sorted(recipes.items()):
+        if not index.set_ingredients(recipe_id, ingredient_ids):
+            pantry_index_cache.delete(user_id)
+            return
+    # Stored again for the new version and weight
+    pantry_index_cache.set(user_id, (version, index))
+
+
+def advance_pantry_index(user_id, version, recipes=None,
+                         removed_ingredients=()):
+    """Bring the cached index of the user to version once committed.
+
+    version is the data version a write bumped to. recipes maps the
+    recipes whose ingredients it set to their ingredient ids, None for
+    deleted ones, and removed_ingredients lists deleted ingredients.
+    """
+    recipes = dict(recipes or {})
+    removed_ingredients = list(removed_ingredients)
+    transaction.on_commit(lambda: _advance_pantry_index(
+        user_id, version, recipes, removed_ingredients,
+    ))
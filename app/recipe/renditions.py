@@ -0,0 +1,212 @@
+"""
+Resized copies of recipe images.
+
+Uploads only store the original. Once the upload is committed a pool
+of worker threads writes a JPEG and a WebP copy of the image for each
+size in RECIPE_IMAGE_RENDITIONS and records their paths in
+Recipe.renditions, as {size: {format: path}}. Recipes with the same
+image share its renditions. Formats Pillow was built without are
+skipped, and a copy which fails to encode is left out of the paths.
+
+Tasks are kept in memory, so those pending when a worker process exits
+are lost. The rebuild_renditions command generates them again.
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+
+from PIL import Image, ImageOps, features
+
+from core.models import Recipe
+from recipe.media import get_storage
+
+
+logger = logging.getLogger(__name__)
+
+# Pillow format, file extension and save options of each format
+RENDITION_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {
+        'quality': 82,
+        'optimize': True,
+        'progressive': True,
+    }),
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+}
+
+# Pillow feature needed to write each Pillow format
+_FORMAT_FEATURES = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the worker pool, started on first use."""
+    global _executor
+    # Started lazily so that processes forked by the server each get
+    # their own threads.
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-renditions',
+            )
+        return _executor
+
+
+@lru_cache(maxsize=None)
+def rendition_formats():
+    """Return the entries of RENDITION_FORMATS Pillow can write."""
+    formats = {}
+    for name, (pil_format, ext, options) in RENDITION_FORMATS.items():
+        if features.check(_FORMAT_FEATURES[pil_format]):
+            formats[name] = (pil_format, ext, options)
+        else:
+            logger.warning(
+                'Pillow cannot write %s, %s renditions are skipped.',
+                pil_format, name,
+            )
+    return formats
+
+
+def _encode(image, pil_format, options):
+    """Return the bytes of image saved in pil_format."""
+    has_alpha = (
+        image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    )
+    if has_alpha:
+        image = image.convert('RGBA')
+        if pil_format == 'JPEG':
+            # JPEG has no transparency, flatten onto white
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def rendition_name(image_name, size_name, ext):
+    """Return the file name of a rendition of an image."""
+    return f'{os.path.splitext(image_name)[0]}-{size_name}.{ext}'
+
+
+def create_renditions(image_name, storage=None):
+    """Write the renditions of a stored image, return their paths.
+
+    Renditions are named after the image, which is named after its
+    content, so renditions already written for the same image are
+    reused without decoding it. Each one is encoded on its own, and
+    those which fail are logged and left out.
+    """
+    storage = storage or get_storage()
+    formats = rendition_formats()
+    missing = [
+        (size_name, name)
+        for size_name in settings.RECIPE_IMAGE_RENDITIONS
+        for name, (_, ext, _) in formats.items()
+        if not storage.exists(rendition_name(image_name, size_name, ext))
+    ]
+    if missing:
+        with storage.open(image_name) as f:
+            original = ImageOps.exif_transpose(Image.open(f))
+            original.load()
+
+    failed = set()
+    for size_name, size in settings.RECIPE_IMAGE_RENDITIONS.items():
+        names = [name for missing_size, name in missing
+                 if missing_size == size_name]
+        if not names:
+            continue
+        image = original.copy()
+        # Keeps the aspect ratio and never enlarges the image
+        image.thumbnail((size, size), Image.LANCZOS)
+        for name in names:
+            pil_format, ext, options = formats[name]
+            try:
+                storage.store(
+                    rendition_name(image_name, size_name, ext),
+                    ContentFile(_encode(image, pil_format, options)),
+                )
+            except Exception:
+                logger.exception(
+                    'Creating the %s %s rendition of %s failed.',
+                    size_name, name, image_name,
+                )
+                failed.add((size_name, name))
+
+    renditions = {}
+    for size_name in settings.RECIPE_IMAGE_RENDITIONS:
+        paths = {
+            name: rendition_name(image_name, size_name, ext)
+            for name, (_, ext, _) in formats.items()
+            if (size_name, name) not in failed
+        }
+        if paths:
+            renditions[size_name] = paths
+    return renditions
+
+
+def generate_renditions(recipe_id, image_name):
+    """Create the renditions of a recipe image and record them."""
+    try:
+        renditions = create_renditions(image_name)
+    except Exception:
+        logger.exception('Creating renditions of %s failed.', image_name)
+        return
+
+    # Another image may have been uploaded meanwhile. Its renditions
+    # may be used by other recipes with the same image, unused ones
+    # are deleted with the image.
+    recipes = Recipe.objects.filter(id=recipe_id, image=image_name)
+    user_id = recipes.values_list('user_id', flat=True).first()
+    if user_id is None or not recipes.update(renditions=renditions):
+        return
+    get_user_model().objects.bump_data_version(user_id)
+
+
+def _generate_in_worker(recipe_id, image_name):
+    """Generate renditions in a worker thread."""
+    try:
+        generate_renditions(recipe_id, image_name)
+    finally:
+        # Connections are per thread and would otherwise stay open
+        connections.close_all()
+
+
+def schedule_renditions(recipe):
+    """Generate the renditions of the recipe's image after commit."""
+    recipe_id, image_name = recipe.id, recipe.image.name
+
+    def submit():
+        if settings.RECIPE_IMAGE_WORKERS:
+            get_executor().submit(_generate_in_worker, recipe_id, image_name)
+        else:
+            generate_renditions(recipe_id, image_name)
+
+    transaction.on_commit(submit)
+
+
+def rendition_urls(renditions, request=None):
+    """Return the URLs of renditions, absolute when given a request."""
+    storage = get_storage()
+    urls = {}
+    for size_name, paths in renditions.items():
+        urls[size_name] = {}
+        for name, path in paths.items():
+            url = storage.url(path)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[size_name][name] = url
+    return urls
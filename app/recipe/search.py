@@ -0,0 +1,177 @@
+"""
+Full-text search over recipes.
+
+On PostgreSQL recipes are matched against Recipe.search_vector, which
+triggers keep up to date from the title, description, tag names and
+ingredient names (see migration 0011), and ranked with ts_rank. Other
+databases match every word of the query as a substring of the same
+fields and rank by where the words were found. So do recipes whose
+vector is not computed yet, until backfill_search_vectors has run.
+
+Ranks are whole numbers so the cursor pagination can compare them
+exactly.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import (
+    Case,
+    Exists,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    IntegerField,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce
+
+from rest_framework.filters import BaseFilterBackend
+
+from core.models import Recipe, recipe_link
+
+
+# Query parameter holding the search terms
+SEARCH_PARAM = 'search'
+
+# Text search configuration the search vectors are built with
+SEARCH_CONFIG = 'english'
+
+# Annotation holding the rank of each match, highest first
+RANK_FIELD = 'search_rank'
+
+# Scale of the ts_rank of a match before rounding
+RANK_SCALE = 1_000_000
+
+# Weight of a word found in each field of the substring fallback, in
+# the proportions of the default ts_rank weights of A, B and C.
+FALLBACK_WEIGHTS = {
+    'title': 10,
+    'tags': 4,
+    'ingredients': 4,
+    'description': 2,
+}
+
+# Most words of a query used by the substring fallback
+FALLBACK_MAX_TERMS = 8
+
+# Databases where every recipe was seen with a search vector. Triggers
+# compute the vector of new recipes, so this stays true.
+_vectors_complete = set()
+
+
+def get_search_terms(request):
+    """Return the stripped search query of the request, or ''."""
+    return request.query_params.get(SEARCH_PARAM, '').strip()
+
+
+def _related_contains(relation, term):
+    """Return whether a related tag or ingredient name contains term."""
+    through, target = recipe_link(relation)
+    return Exists(through.objects.filter(
+        recipe_id=OuterRef('pk'),
+        **{f'{target}__name__icontains': term},
+    ))
+
+
+def _has_pending_vectors(db):
+    """Return whether recipes of the database lack a search vector."""
+    if db in _vectors_complete:
+        return False
+    # An index lookup, core_recipe_search_pending_idx holds them
+    if Recipe.objects.using(db).filter(search_vector__isnull=True).exists():
+        return True
+    _vectors_complete.add(db)
+    return False
+
+
+def _search_postgresql(queryset, terms):
+    """Match and rank recipes with their search vector."""
+    query = SearchQuery(terms, config=SEARCH_CONFIG, search_type='websearch')
+    rank = Cast(
+        ExpressionWrapper(
+            SearchRank(F('search_vector'), query) * Value(RANK_SCALE),
+            output_field=FloatField(),
+        ),
+        IntegerField(),
+    )
+    matches = Q(search_vector=query)
+    if _has_pending_vectors(queryset.db):
+        pending = _search_fallback(
+            queryset.filter(search_vector__isnull=True), terms,
+        )
+        matches |= Q(pk__in=pending.values('pk'))
+        # ts_rank of a missing vector is NULL
+        rank = Coalesce(rank, Subquery(
+            pending.filter(pk=OuterRef('pk')).values(RANK_FIELD),
+        ))
+    return queryset.filter(matches).annotate(**{RANK_FIELD: rank})
+
+
+def _search_fallback(queryset, terms):
+    """Match and rank recipes containing every word of terms."""
+    words = terms.replace('"', ' ').split()[:FALLBACK_MAX_TERMS]
+    if not words:
+        return queryset.none()
+
+    rank = Value(0)
+    for i, word in enumerate(words):
+        conditions = {
+            'title': Q(title__icontains=word),
+            'tags': _related_contains('tags', word),
+            'ingredients': _related_contains('ingredients', word),
+            'description': Q(description__icontains=word),
+        }
+        word_rank = Value(0)
+        for field, weight in FALLBACK_WEIGHTS.items():
+            word_rank += Case(
+                When(conditions[field], then=Value(weight)),
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        # Every word must be found somewhere
+        alias = f'_search_rank_{i}'
+        queryset = queryset.alias(**{alias: word_rank}).filter(
+            **{f'{alias}__gt': 0},
+        )
+        rank += F(alias)
+    return queryset.annotate(**{
+        RANK_FIELD: ExpressionWrapper(rank, output_field=IntegerField()),
+    })
+
+
+def search_recipes(queryset, terms):
+    """Return the recipes of queryset matching terms, with their rank."""
+    if connections[queryset.db].vendor == 'postgresql':
+        return _search_postgresql(queryset, terms)
+    return _search_fallback(queryset, terms)
+
+
+class RecipeSearchFilter(BaseFilterBackend):
+    """Filter recipes by the ?search= full-text query.
+
+    Matches are annotated with RANK_FIELD, which the recipe pagination
+    orders by while searching.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        """Return the recipes matching the search query, if any."""
+        terms = get_search_terms(request)
+        if not terms:
+            return queryset
+        return search_recipes(queryset, terms)
+
+    def get_schema_operation_parameters(self, view):
+        """Describe the search parameter in the API schema."""
+        return [{
+            'name': SEARCH_PARAM,
+            'required': False,
+            'in': 'query',
+            'description': (
+                'Words to find in the title, description, tag names or '
+                'ingredient names. Results are ordered by relevance.'
+            ),
+            'schema': {'type': 'string'},
+        }]
@@ -1,16 +1,79 @@
 """
 Serializers for recipe APIs
 """
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connections, transaction
+
 from rest_framework import serializers
 
 from core.models import (
     Recipe,
     Tag,
-    Ingredient
+    Ingredient,
+    recipe_link,
 )
+from recipe.media import release_images_on_commit
+from recipe.pantry import advance_pantry_index
+from recipe.renditions import rendition_urls, schedule_renditions
+from recipe.similarity import update_signatures
+from recipe.uploads import UploadedImageField
+
+
+def bump_data_version(user_id, ingredients=None, removed_ingredients=()):
+    """Mark the data of a user as changed.
+
+    ingredients maps the recipes whose ingredients were set to their
+    ingredient ids, None for deleted recipes, and removed_ingredients
+    lists deleted ingredients. Both are applied to the pantry index
+    cached by this process.
+    """
+    version = get_user_model().objects.bump_data_version(user_id)
+    advance_pantry_index(user_id, version, ingredients, removed_ingredients)
+
+
+# Attempts of a linking step that raced with sweep_orphans
+LINK_ATTEMPTS = 3
+
+
+def link_with_retry(link):
+    """Run link, which resolves names and links them, return its result.
+
+    sweep_orphans may delete an unused tag or ingredient between its
+    lookup and the insert of the link, whose foreign key then fails.
+    The step runs in its own transaction or savepoint, checking the
+    foreign keys at its end where PostgreSQL can, and is retried on
+    failure, creating the deleted names again.
+    """
+    connection = connections[Recipe.objects.db]
+    for attempt in range(1, LINK_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                result = link()
+                # Only the rows written are checked, other backends
+                # would scan whole tables
+                if connection.vendor == 'postgresql':
+                    connection.check_constraints()
+            return result
+        except IntegrityError:
+            if attempt == LINK_ATTEMPTS:
+                raise
+
+
+class DataVersionMixin:
+    """Bump the owner's data version when the serializer writes."""
+
+    def create(self, validated_data):
+        instance = super().create(validated_data)
+        bump_data_version(instance.user_id)
+        return instance
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        bump_data_version(instance.user_id)
+        return instance
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(DataVersionMixin, serializers.ModelSerializer):
     """Serializer for ingredients."""
 
     class Meta:
@@ -19,7 +82,7 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(DataVersionMixin, serializers.ModelSerializer):
     """Serializer for tags."""
 
     class Meta:
@@ -28,38 +91,235 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
+class IngredientCountSerializer(IngredientSerializer):
+    """Serializer for listing ingredients with their recipe counts."""
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(IngredientSerializer.Meta):
+        fields = IngredientSerializer.Meta.fields + ['recipe_count']
+
+
+class TagCountSerializer(TagSerializer):
+    """Serializer for listing tags with their recipe counts."""
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ['recipe_count']
+
+
+class RenditionsField(serializers.ReadOnlyField):
+    """URLs of the renditions of a recipe image, by size and format."""
+
+    def to_representation(self, value):
+        return rendition_urls(value, self.context.get('request'))
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Serializer for writing many recipes at once.
+
+    Recipes are inserted or updated together and their tags and
+    ingredients are resolved and linked with one set of queries for the
+    whole batch instead of one per recipe.
+    """
+    relations = {'tags': Tag, 'ingredients': Ingredient}
+
+    def _pop_relations(self, validated_data):
+        """Remove the related names from each item."""
+        return [
+            {
+                name: item.pop(name, None)
+                for name in self.relations
+            }
+            for item in validated_data
+        ]
+
+    def _link_relations(self, recipes, relations, new=False):
+        """Point each recipe at the tags and ingredients named for it.
+
+        Relations left out of an item (None) are not touched. Links
+        that already exist are kept, so only changed rows are written.
+        Pass new=True for recipes that cannot have any links yet.
+
+        Return the ids linked to each recipe by relation, for the
+        relations given.
+        """
+        linked = {name: {} for name in self.relations}
+        for name, model in self.relations.items():
+            wanted = {
+                recipe.id: [item['name'] for item in related[name]]
+                for recipe, related in zip(recipes, relations)
+                if related[name] is not None
+            }
+            if not wanted:
+                continue
+
+            names = [
+                {'name': item_name}
+                for item_names in wanted.values()
+                for item_name in item_names
+            ]
+            objects = {
+                obj.name: obj.id
+                for obj in self.child._get_or_create_objects(model, names)
+            }
+            targets = {
+                recipe_id: dict.fromkeys(objects[n] for n in item_names)
+                for recipe_id, item_names in wanted.items()
+            }
+            linked[name] = {
+                recipe_id: list(target_ids)
+                for recipe_id, target_ids in targets.items()
+            }
+
+            through, target = recipe_link(name)
+            links = []
+            if not new:
+                links = through.objects.filter(
+                    recipe_id__in=targets,
+                ).values_list('id', 'recipe_id', target)
+
+            stale = []
+            for link_id, recipe_id, target_id in links:
+                if target_id in targets[recipe_id]:
+                    del targets[recipe_id][target_id]
+                else:
+                    stale.append(link_id)
+
+            if stale:
+                through.objects.filter(id__in=stale).delete()
+            through.objects.bulk_create([
+                through(recipe_id=recipe_id, **{target: target_id})
+                for recipe_id, target_ids in targets.items()
+                for target_id in target_ids
+            ])
+        return linked
+
+    def create(self, validated_data):
+        """Create recipes in bulk."""
+        relations = self._pop_relations(validated_data)
+        recipes = [Recipe(**item) for item in validated_data]
+
+        # Primary keys are needed to link the relations. Backends that
+        # cannot return them from a bulk insert save row by row.
+        connection = connections[Recipe.objects.db]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes)
+        else:
+            for recipe in recipes:
+                recipe.save()
+
+        ingredients = link_with_retry(
+            lambda: self._link_relations(recipes, relations, new=True),
+        )['ingredients']
+        update_signatures(
+            [
+                (recipe.id, recipe.user_id)
+                for recipe, related in zip(recipes, relations)
+                if any(related.values())
+            ],
+            new=True,
+        )
+        # New recipes are indexed even without ingredients, to keep
+        # the pantry index in id order
+        changes = {}
+        for recipe in recipes:
+            changes.setdefault(recipe.user_id, {})[recipe.id] = (
+                ingredients.get(recipe.id, [])
+            )
+        for user_id, user_changes in changes.items():
+            bump_data_version(user_id, user_changes)
+        return recipes
+
+    def update(self, instances, validated_data):
+        """Update recipes in bulk.
+
+        instances must be in the same order as validated_data.
+        """
+        relations = self._pop_relations(validated_data)
+        fields = set()
+        for recipe, item in zip(instances, validated_data):
+            for attr, value in item.items():
+                setattr(recipe, attr, value)
+                fields.add(attr)
+
+        if fields:
+            Recipe.objects.bulk_update(instances, sorted(fields))
+        ingredients = link_with_retry(
+            lambda: self._link_relations(instances, relations),
+        )['ingredients']
+        update_signatures(
+            (recipe.id, recipe.user_id)
+            for recipe, related in zip(instances, relations)
+            if any(value is not None for value in related.values())
+        )
+        changes = {recipe.user_id: {} for recipe in instances}
+        for recipe in instances:
+            if recipe.id in ingredients:
+                changes[recipe.user_id][recipe.id] = ingredients[recipe.id]
+        for user_id, user_changes in changes.items():
+            bump_data_version(user_id, user_changes)
+        return instances
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializer for recipes."""
     tags = TagSerializer(many=True, required=False)
     ingredients = IngredientSerializer(many=True, required=False)
+    renditions = RenditionsField()
 
     class Meta:
         model = Recipe
         fields = [
             'id', 'title', 'time_minutes', 'price', 'link', 'tags',
-            'ingredients',
+            'ingredients', 'renditions',
         ]
         read_only_fields = ['id']
+        list_serializer_class = RecipeListSerializer
 
-    def _get_or_create_tags(self, tags, recipe):
-        """Handle getting or creating tags as needed."""
+    def _get_or_create_objects(self, model, items):
+        """Return the user's objects named in items, creating missing ones.
+
+        Runs one query for the existing names and, when some are
+        missing, one insert plus one query to read them back however
+        many items are passed.
+        """
         auth_user = self.context['request'].user
-        for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(
-                user=auth_user,
-                **tag,
+        names = list(dict.fromkeys(item['name'] for item in items))
+        if not names:
+            return []
+
+        objects = {
+            obj.name: obj
+            for obj in model.objects.filter(user=auth_user, name__in=names)
+        }
+        missing = [name for name in names if name not in objects]
+        if missing:
+            # Another request may create the same names concurrently.
+            # The per-user unique constraint turns that into a conflict
+            # which is ignored, and the rows are read back either way.
+            model.objects.bulk_create(
+                [model(user=auth_user, name=name) for name in missing],
+                ignore_conflicts=True,
             )
-            recipe.tags.add(tag_obj)
+            objects.update(
+                (obj.name, obj) for obj in
+                model.objects.filter(user=auth_user, name__in=missing)
+            )
+
+        return [objects[name] for name in names]
+
+    def _get_or_create_tags(self, tags, recipe):
+        """Handle getting or creating tags as needed."""
+        recipe.tags.add(*self._get_or_create_objects(Tag, tags))
 
     def _get_or_create_ingredients(self, ingredients, recipe):
-        """Handle getting or creating ingredients as needed."""
-        auth_user = self.context['request'].user
-        for ingredient in ingredients:
-            ingredient_obj, created = Ingredient.objects.get_or_create(
-                user=auth_user,
-                **ingredient,
-            )
-            recipe.ingredients.add(ingredient_obj)
+        """Handle getting or creating ingredients as needed.
+
+        Return the ids of the ingredients added.
+        """
+        objects = self._get_or_create_objects(Ingredient, ingredients)
+        recipe.ingredients.add(*objects)
+        return [obj.id for obj in objects]
 
     # By default the nested serailizer (tag serializer here) is
     # read-only. So we have to override the create method to
@@ -69,8 +329,16 @@ class RecipeSerializer(serializers.ModelSerializer):
         tags = validated_data.pop('tags', [])
         ingredients = validated_data.pop('ingredients', [])
         recipe = Recipe.objects.create(**validated_data)
-        self._get_or_create_tags(tags, recipe)
-        self._get_or_create_ingredients(ingredients, recipe)
+
+        def link():
+            self._get_or_create_tags(tags, recipe)
+            return self._get_or_create_ingredients(ingredients, recipe)
+
+        ingredient_ids = []
+        if tags or ingredients:
+            ingredient_ids = link_with_retry(link)
+            update_signatures([(recipe.id, recipe.user_id)], new=True)
+        bump_data_version(recipe.user_id, {recipe.id: ingredient_ids})
 
         return recipe
 
@@ -78,18 +346,29 @@ class RecipeSerializer(serializers.ModelSerializer):
         """Update recipe."""
         tags = validated_data.pop('tags', None)
         ingredients = validated_data.pop('ingredients', None)
-        if tags is not None:
-            instance.tags.clear()
-            self._get_or_create_tags(tags, instance)
 
-        if ingredients is not None:
-            instance.ingredients.clear()
-            self._get_or_create_ingredients(ingredients, instance)
+        def link():
+            # set() compares against the current relations and only
+            # deletes and inserts the through rows that actually change.
+            if tags is not None:
+                instance.tags.set(self._get_or_create_objects(Tag, tags))
+            if ingredients is None:
+                return {}
+            objects = self._get_or_create_objects(Ingredient, ingredients)
+            instance.ingredients.set(objects)
+            return {instance.id: [obj.id for obj in objects]}
+
+        changes = {}
+        if tags is not None or ingredients is not None:
+            changes = link_with_retry(link)
 
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
 
         instance.save()
+        if tags is not None or ingredients is not None:
+            update_signatures([(instance.id, instance.user_id)])
+        bump_data_version(instance.user_id, changes)
         return instance
 
 
@@ -101,11 +380,31 @@ class RecipeDetailSerializer(RecipeSerializer):
         fields = RecipeSerializer.Meta.fields + ['description']
 
 
-class RecipeImageSerializer(serializers.ModelSerializer):
+class RecipeBulkDeleteSerializer(serializers.Serializer):
+    """Serializer for deleting many recipes at once."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+    )
+
+
+class RecipeImageSerializer(DataVersionMixin, serializers.ModelSerializer):
     """Serializer for uploading images to recipes."""
+    image = UploadedImageField(required=True)
+    renditions = RenditionsField()
 
     class Meta:
         model = Recipe
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'renditions']
         read_only_fields = ['id']
-        extra_kwargs = {'image': {'required': 'True'}}
+
+    def update(self, instance, validated_data):
+        """Store an image and generate its renditions in the background."""
+        previous = instance.image.name
+        # The old renditions show the previous image
+        validated_data['renditions'] = {}
+        instance = super().update(instance, validated_data)
+        schedule_renditions(instance)
+        if previous != instance.image.name:
+            release_images_on_commit([previous])
+        return instance
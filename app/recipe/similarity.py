@@ -0,0 +1,250 @@
+"""
+Similar recipes by the tags and ingredients they share.
+
+Two recipes are as similar as the Jaccard similarity of their sets of
+tags and ingredients. Comparing a recipe with every other one would
+take a pass over all of the user's recipes, so each recipe instead
+keeps a MinHash signature (RecipeSignature): the smallest value of
+each of SIGNATURE_SIZE hash functions over its tags and ingredients.
+Two signatures agree at a position with a probability equal to the
+similarity of their recipes, which estimates it without the sets.
+
+The signature is cut into BANDS bands and each band hashed into a
+bucket (RecipeBucket). Recipes sharing a bucket are the candidates of
+a lookup, found with the (user, key) index; recipes at least about
+SIMILARITY_THRESHOLD similar share one with high probability, much
+less similar ones rarely do.
+
+The serializers, import_recipes and seed_data refresh the signatures
+of the recipes whose relations they write. Recipes written otherwise
+are indexed by the rebuild_similarity command.
+"""
+import hashlib
+import random
+from array import array
+
+from django.db import connection, transaction
+from django.db.models import Count, F
+
+from core.models import Recipe, RecipeBucket, RecipeSignature, recipe_link
+
+
+# Hash functions of a signature and bands it is cut into
+SIGNATURE_SIZE = 128
+BANDS = 32
+ROWS = SIGNATURE_SIZE // BANDS
+
+# Similarity at which recipes share a bucket half of the time
+SIMILARITY_THRESHOLD = (1 / BANDS) ** (1 / ROWS)
+
+# Recipes whose signatures are written per transaction by batched updates
+BATCH_SIZE = 500
+
+# Hash functions are (a * x + b) mod a Mersenne prime, with fixed
+# coefficients so that signatures stay comparable across processes.
+_PRIME = (1 << 61) - 1
+_random = random.Random(2024)
+_COEFFICIENTS = [
+    (_random.randrange(1, _PRIME), _random.randrange(_PRIME))
+    for _ in range(SIGNATURE_SIZE)
+]
+
+
+def _features(recipe_ids):
+    """Return the tag and ingredient features of each recipe."""
+    features = {recipe_id: [] for recipe_id in recipe_ids}
+    # Tags and ingredients are numbered apart, tags even, ingredients
+    # odd, since their ids overlap.
+    links = []
+    for relation, parity in (('tags', 0), ('ingredients', 1)):
+        through, target = recipe_link(relation)
+        links.append(
+            through.objects.filter(recipe_id__in=recipe_ids)
+            .annotate(feature=F(target) * 2 + parity)
+            .values_list('recipe_id', 'feature')
+        )
+    for recipe_id, feature in links[0].union(links[1], all=True):
+        features[recipe_id].append(feature)
+    return features
+
+
+class _FeatureHashes(dict):
+    """Values of every hash function of a feature, computed once."""
+
+    def __missing__(self, feature):
+        values = self[feature] = [
+            (a * feature + b) % _PRIME for a, b in _COEFFICIENTS
+        ]
+        return values
+
+
+def signature(features, hashes=None):
+    """Return the MinHash signature of a non-empty list of features."""
+    hashes = _FeatureHashes() if hashes is None else hashes
+    values = map(min, zip(*[hashes[feature] for feature in features]))
+    # Truncated to 32 bits, which keeps collisions negligible
+    return [value & 0xFFFFFFFF for value in values]
+
+
+def pack(values):
+    """Return the bytes stored for a signature."""
+    return array('I', values).tobytes()
+
+
+def unpack(data):
+    """Return the signature stored as data."""
+    values = array('I')
+    values.frombytes(data)
+    return values
+
+
+def bucket_keys(values):
+    """Return the bucket of each band of a signature."""
+    keys = []
+    for band in range(BANDS):
+        rows = values[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(
+            pack([band, *rows]), digest_size=8,
+        ).digest()
+        keys.append(int.from_bytes(digest, 'little', signed=True))
+    return keys
+
+
+def estimate(first, second):
+    """Return the similarity estimated from two signatures."""
+    return sum(map(int.__eq__, first, second)) / SIGNATURE_SIZE
+
+
+def _insert_buckets(rows):
+    """Insert (recipe id, user id, key) rows into RecipeBucket.
+
+    Buckets outnumber recipes BANDS to one, so they are inserted
+    without building model instances.
+    """
+    quote = connection.ops.quote_name
+    fields = [
+        RecipeBucket._meta.get_field(name)
+        for name in ('recipe', 'user', 'key')
+    ]
+    sql = (
+        f'INSERT INTO {quote(RecipeBucket._meta.db_table)} '
+        f'({", ".join(quote(field.column) for field in fields)}) VALUES '
+    )
+    batch_size = connection.ops.bulk_batch_size(fields, rows)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                sql + ', '.join(['(%s, %s, %s)'] * len(batch)),
+                [value for row in batch for value in row],
+            )
+
+
+def update_signatures(recipes, new=False):
+    """Compute the signatures and buckets of recipes again.
+
+    recipes are (recipe id, user id) pairs. Only the signatures that
+    changed are written. Recipes without tags or ingredients get
+    neither, as they are not similar to anything. Pass new=True for
+    recipes that cannot have a signature yet.
+    """
+    users = dict(recipes)
+    if not users:
+        return
+
+    # No savepoint within the transaction of a bulk write
+    with transaction.atomic(savepoint=False):
+        stored = {}
+        if not new:
+            # Concurrent writes of a recipe take turns, so that one
+            # does not insert the signature the other just inserted.
+            # Rows are locked in id order to avoid deadlocks.
+            locked = (
+                Recipe.objects.select_for_update()
+                .filter(id__in=users).order_by('id')
+                .values_list('id', flat=True)
+            )
+            users = {recipe_id: users[recipe_id] for recipe_id in locked}
+            stored = {
+                recipe_id: bytes(data) for recipe_id, data in
+                RecipeSignature.objects.filter(recipe_id__in=users)
+                .values_list('recipe_id', 'signature')
+            }
+        hashes = _FeatureHashes()
+        stale = []
+        signatures = []
+        buckets = []
+        for recipe_id, features in _features(users).items():
+            values = signature(features, hashes) if features else None
+            data = values and pack(values)
+            if stored.get(recipe_id) == data:
+                continue
+            if recipe_id in stored:
+                stale.append(recipe_id)
+            if values:
+                signatures.append(
+                    RecipeSignature(recipe_id=recipe_id, signature=data),
+                )
+                buckets += [
+                    (recipe_id, users[recipe_id], key)
+                    for key in bucket_keys(values)
+                ]
+
+        if stale:
+            RecipeSignature.objects.filter(recipe_id__in=stale).delete()
+            RecipeBucket.objects.filter(recipe_id__in=stale).delete()
+        if signatures:
+            RecipeSignature.objects.bulk_create(signatures)
+            _insert_buckets(buckets)
+
+
+def update_signatures_in_batches(recipes, batch_size=BATCH_SIZE,
+                                 new=False):
+    """Compute the signatures of many recipes again, batch by batch.
+
+    Each batch is its own transaction when called outside of one, so
+    a write touching the relations of many recipes, like deleting a
+    tag, does not hold them all locked at once.
+    """
+    recipes = list(recipes)
+    for start in range(0, len(recipes), batch_size):
+        update_signatures(recipes[start:start + batch_size], new=new)
+
+
+def similar_recipes(recipe, limit, max_candidates):
+    """Return the recipes most similar to recipe, as (id, similarity).
+
+    The max_candidates recipes sharing the most buckets with recipe
+    are compared by their signatures. The most similar come first,
+    then the newest.
+    """
+    keys = RecipeBucket.objects.filter(recipe=recipe).values('key')
+    candidates = [
+        row['recipe_id'] for row in
+        RecipeBucket.objects.filter(user_id=recipe.user_id, key__in=keys)
+        .exclude(recipe=recipe)
+        .values('recipe_id')
+        .annotate(shared=Count('id'))
+        .order_by('-shared', '-recipe_id')[:max_candidates]
+    ]
+    if not candidates:
+        return []
+
+    signatures = {
+        recipe_id: unpack(data) for recipe_id, data in
+        RecipeSignature.objects.filter(
+            recipe_id__in=[recipe.id, *candidates],
+        ).values_list('recipe_id', 'signature')
+    }
+    target = signatures.pop(recipe.id, None)
+    if target is None:
+        return []
+    ranked = sorted(
+        (
+            (estimate(target, values), recipe_id)
+            for recipe_id, values in signatures.items()
+        ),
+        reverse=True,
+    )
+    return [(recipe_id, similarity)
+            for similarity, recipe_id in ranked[:limit]]
@@ -0,0 +1,128 @@
+"""
+Name suggestions and recipe counts for tags and ingredients.
+
+Suggestions are the names of a user's tags or ingredients starting
+with a prefix, case-insensitively, the ones used by the most recipes
+first. Each process keeps an index of the names and recipe counts of
+recently active users, valid for one data version of the user, and
+answers from it without querying. Without the cache they are queried
+with a prefix index (see migration 0012).
+
+The tag and ingredient lists take their recipe counts from the same
+index, so the counts are aggregated once per data version. Which
+entries are listed is always queried.
+"""
+import bisect
+import heapq
+
+from django.conf import settings
+from django.db.models import Count, Exists, OuterRef
+
+from core.cache import LRUCache
+from core.models import recipe_link
+
+
+class SuggestionIndex:
+    """Names sorted case-insensitively, with their recipe counts."""
+
+    def __init__(self, rows):
+        # (folded name, -recipe count, name, id), sorted by name
+        self._entries = sorted(
+            (name.casefold(), -count, name, id)
+            for id, name, count in rows
+        )
+        self._keys = [entry[0] for entry in self._entries]
+        self.recipe_counts = {
+            id: -count for _, count, _, id in self._entries
+        }
+
+    def suggest(self, prefix, limit):
+        """Return the id and name of the top limit names with prefix."""
+        prefix = prefix.casefold()
+        start = bisect.bisect_left(self._keys, prefix)
+        end = bisect.bisect_left(self._keys, prefix + '\U0010ffff', start)
+        top = heapq.nsmallest(
+            limit,
+            self._entries[start:end],
+            key=lambda entry: entry[1:],
+        )
+        return [{'id': id, 'name': name} for _, _, name, id in top]
+
+
+# Suggestion indexes of this process, by model and user
+suggestion_cache = LRUCache(
+    settings.NAME_SUGGESTION_CACHE_SIZE,
+    settings.NAME_SUGGESTION_CACHE_TTL,
+)
+
+
+def with_recipe_count(queryset):
+    """Annotate tags or ingredients with the number of their recipes.
+
+    Counted by a single aggregate over the link table, grouped by tag
+    or ingredient.
+    """
+    return queryset.annotate(recipe_count=Count('recipe'))
+
+
+def with_recipes(queryset):
+    """Keep the tags or ingredients used by at least one recipe.
+
+    Checked by an indexed lookup on the link table per entry rather
+    than by counting.
+    """
+    through, target = recipe_link(queryset.model.recipe_set.field.name)
+    links = through.objects.filter(**{target: OuterRef('pk')})
+    return queryset.filter(Exists(links))
+
+
+def get_suggestion_index(queryset, user_id, version):
+    """Return the cached index of queryset for the data version."""
+    key = (queryset.model._meta.label, user_id)
+    cached = suggestion_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    index = SuggestionIndex(
+        with_recipe_count(queryset).values_list('id', 'name', 'recipe_count'),
+    )
+    suggestion_cache.set(key, (version, index))
+    return index
+
+
+def query_suggestions(queryset, prefix, limit):
+    """Return the id and name of the top limit names with prefix."""
+    return list(
+        with_recipe_count(queryset.filter(name__istartswith=prefix))
+        .order_by('-recipe_count', 'name', 'id')
+        .values('id', 'name')[:limit]
+    )
+
+
+def suggest(queryset, user_id, version, prefix, limit):
+    """Return suggestions, from the index when the cache is enabled."""
+    if not settings.NAME_SUGGESTION_CACHE_SIZE:
+        return query_suggestions(queryset, prefix, limit)
+    index = get_suggestion_index(queryset, user_id, version)
+    return index.suggest(prefix, limit)
+
+
+def list_with_counts(queryset, user_id, version, assigned_only=False):
+    """Return the id, name and recipe count of the entries of queryset.
+
+    With assigned_only, entries no recipe uses are left out. The
+    entries keep the order of queryset.
+    """
+    if not settings.NAME_SUGGESTION_CACHE_SIZE:
+        rows = with_recipe_count(queryset)
+        if assigned_only:
+            rows = rows.filter(recipe_count__gt=0)
+        return list(rows.values('id', 'name', 'recipe_count'))
+
+    # The cached counts are only displayed, the entries are queried
+    counts = get_suggestion_index(queryset, user_id, version).recipe_counts
+    listed = with_recipes(queryset) if assigned_only else queryset
+    return [
+        dict(row, recipe_count=counts.get(row['id'], 0))
+        for row in listed.values('id', 'name')
+    ]
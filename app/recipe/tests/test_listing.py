@@ -0,0 +1,129 @@
+"""
+Tests for the row based recipe list serialization.
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import viewsets
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.models import (
+    Recipe,
+    Tag,
+    Ingredient,
+)
+
+from recipe.listing import RECIPE_LIST_FIELDS, serialize_recipe_rows
+from recipe.mixins import RowListMixin
+from recipe.serializers import RecipeSerializer, TagSerializer
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class RecipeListingTests(TestCase):
+    """Test serializing recipe rows."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        tags = [
+            Tag.objects.create(user=self.user, name=name)
+            for name in ['Vegan', 'Dinner', 'Ünïcode "quoted"']
+        ]
+        ingredients = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ['Salt', 'Kale']
+        ]
+        prices = [Decimal('5.50'), Decimal('0.1'), Decimal('999.99')]
+        for i, price in enumerate(prices):
+            recipe = Recipe.objects.create(
+                user=self.user,
+                title=f'Recipe {i}',
+                time_minutes=i,
+                price=price,
+                link='' if i else 'http://example.com/recipe.pdf',
+            )
+            recipe.tags.add(*reversed(tags[i:]))
+            recipe.ingredients.add(*ingredients[:i])
+        recipe.renditions = {'thumb': {
+            'jpeg': 'uploads/recipe/image-thumb.jpg',
+            'webp': 'uploads/recipe/image-thumb.webp',
+        }}
+        recipe.save()
+
+    def _expected(self, request=None):
+        """Return the RecipeSerializer representation of the recipes."""
+        recipes = Recipe.objects.order_by('-id').prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            Prefetch(
+                'ingredients',
+                queryset=Ingredient.objects.order_by('id'),
+            ),
+        )
+        return RecipeSerializer(
+            recipes,
+            many=True,
+            context={'request': request},
+        ).data
+
+    def test_matches_serializer(self):
+        """Test the rows render to exactly the serializer's JSON."""
+        rows = Recipe.objects.order_by('-id').values(*RECIPE_LIST_FIELDS)
+
+        data = serialize_recipe_rows(list(rows))
+
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(data),
+            renderer.render(self._expected()),
+        )
+
+    def test_empty(self):
+        """Test serializing no rows runs no queries."""
+        with self.assertNumQueries(0):
+            self.assertEqual(serialize_recipe_rows([]), [])
+
+    def test_list_api_matches_serializer(self):
+        """Test the list API renders the serializer's JSON."""
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        res = client.get(RECIPES_URL, HTTP_ACCEPT='application/json')
+
+        expected = JSONRenderer().render(self._expected(res.wsgi_request))
+        self.assertIn(b'"http://testserver/api/recipe/media/', expected)
+        self.assertIn(b'"results":' + expected, res.content)
+
+
+class TagRowViewSet(RowListMixin, viewsets.ReadOnlyModelViewSet):
+    """Tag list from rows, serialized by the default serialize_rows."""
+    queryset = Tag.objects.order_by('id')
+    serializer_class = TagSerializer
+    list_fields = ['id', 'name']
+
+
+class RowListMixinTests(TestCase):
+    """Test the defaults of RowListMixin."""
+
+    def test_serialize_rows_default(self):
+        """Test rows are serialized with the view's serializer."""
+        user = get_user_model().objects.create_user('user@example.com')
+        tags = [
+            Tag.objects.create(user=user, name=name)
+            for name in ['Vegan', 'Dinner']
+        ]
+        view = TagRowViewSet.as_view({'get': 'list'})
+
+        res = view(APIRequestFactory().get('/'))
+
+        self.assertEqual(
+            res.data, TagSerializer(tags, many=True).data,
+        )
@@ -0,0 +1,255 @@
+"""
+Tests for serving and deleting recipe images.
+"""
+import os
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.tests.utils import TempMediaRootMixin
+from recipe import media
+
+
+def recipe_url(recipe_id):
+    """Create and return a recipe detail URL."""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def media_url(name):
+    """Create and return the URL of a media file."""
+    return reverse('recipe:media', args=[name])
+
+
+@override_settings(RECIPE_IMAGE_GRACE_SECONDS=60)
+class MediaTests(TempMediaRootMixin, TestCase):
+    """Test releasing and sweeping recipe images."""
+
+    def setUp(self):
+        super().setUp()
+        self.storage = media.get_storage()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def _recipe(self, content=b'image'):
+        """Create a recipe with an image and renditions on disk."""
+        recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+        recipe.image.save('photo.jpg', ContentFile(content))
+        stem = os.path.splitext(recipe.image.name)[0]
+        self.storage.store(f'{stem}-thumb.webp', ContentFile(b'thumb'))
+        self._age(recipe.image.name, f'{stem}-thumb.webp')
+        return recipe
+
+    def _age(self, *names):
+        """Make files look written before the grace period."""
+        for name in names:
+            os.utime(self.storage.path(name), (0, 0))
+
+    def _files(self):
+        """Return the stored recipe image files."""
+        return sorted(
+            os.path.join(directory, filename)
+            for directory, files in media._walk(
+                self.storage, media.IMAGE_DIRECTORY,
+            )
+            for filename in files
+        )
+
+    def test_split_rendition(self):
+        """Test renditions are told apart from originals."""
+        self.assertEqual(media.split_rendition('ab-thumb.jpg'), ('ab', True))
+        self.assertEqual(
+            media.split_rendition('6a2f-41b3.jpg'),
+            ('6a2f-41b3', False),
+        )
+
+    def test_delete_releases_image(self):
+        """Test deleting a recipe deletes its image and renditions."""
+        recipe = self._recipe()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(recipe_url(recipe.id))
+
+        self.assertEqual(self._files(), [])
+
+    def test_shared_image_kept(self):
+        """Test images used by another recipe are kept."""
+        recipe = self._recipe()
+        other = self._recipe()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(recipe_url(recipe.id))
+
+        self.assertEqual(len(self._files()), 2)
+        self.assertTrue(self.storage.exists(other.image.name))
+
+    def test_recent_image_kept(self):
+        """Test images saved during the grace period are kept."""
+        recipe = self._recipe()
+        # Saved again by an upload not committed yet
+        self.storage.save('uploads/recipe/x.jpg', ContentFile(b'image'))
+        recipe.delete()
+
+        self.assertEqual(media.release_image(recipe.image.name), [])
+        self.assertEqual(len(self._files()), 2)
+
+    def test_release_racing_upload(self):
+        """Test an upload of the same content during a release wins."""
+        recipe = self._recipe()
+        recipe.delete()
+        retire = self.storage.retire
+
+        def upload_after_retire(name):
+            retired = retire(name)
+            self.storage.save('uploads/recipe/x.jpg', ContentFile(b'image'))
+            return retired
+
+        with patch.object(
+            self.storage, 'retire', side_effect=upload_after_retire,
+        ):
+            self.assertEqual(media.release_image(recipe.image.name), [])
+
+        self.assertEqual(len(self._files()), 2)
+        self.assertTrue(self.storage.exists(recipe.image.name))
+
+    def test_release_racing_touch(self):
+        """Test an upload touching the image before it is retired."""
+        recipe = self._recipe()
+        recipe.delete()
+        retire = self.storage.retire
+
+        def touch_before_retire(name):
+            os.utime(self.storage.path(name))
+            return retire(name)
+
+        with patch.object(
+            self.storage, 'retire', side_effect=touch_before_retire,
+        ):
+            self.assertEqual(media.release_image(recipe.image.name), [])
+
+        self.assertEqual(len(self._files()), 2)
+        with self.storage.open(recipe.image.name) as f:
+            self.assertEqual(f.read(), b'image')
+
+    def test_unreferenced_files(self):
+        """Test the sweep finds unused images and their renditions."""
+        used = self._recipe(b'used')
+        unused = self._recipe(b'unused')
+        unused.delete()
+        self.storage.save('uploads/recipe/x.jpg', ContentFile(b'recent'))
+        legacy = self.storage.store(
+            'uploads/recipe/6a2f-41b3.jpg', ContentFile(b'legacy'),
+        )
+        temp = self.storage.store(
+            'uploads/recipe/ab.jpg.1f2e.tmp', ContentFile(b''),
+        )
+        self._age(legacy, temp)
+        used_stem = os.path.splitext(used.image.name)[0]
+        unused_stem = os.path.splitext(unused.image.name)[0]
+
+        # One query per image, the temporary file is not looked up
+        with self.assertNumQueries(4):
+            found = sorted(media.iter_unreferenced(batch_size=1))
+
+        self.assertEqual(found, sorted([
+            legacy, temp, unused.image.name, f'{unused_stem}-thumb.webp',
+        ]))
+        self.assertNotIn(f'{used_stem}-thumb.webp', found)
+
+
+class MediaApiTests(TempMediaRootMixin, TestCase):
+    """Test serving recipe images to their owners."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+        self.recipe.image.save('photo.jpg', ContentFile(b'image'))
+        self.name = self.recipe.image.name
+
+    def test_media_url(self):
+        """Test image URLs point to the media view."""
+        self.assertEqual(self.recipe.image.url, media_url(self.name))
+
+    def test_owner_gets_file(self):
+        """Test owners get the file with long lived private caching."""
+        res = self.client.get(media_url(self.name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(res.streaming_content), b'image')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertIn('private', res['Cache-Control'])
+        self.assertIn('immutable', res['Cache-Control'])
+
+    def test_rendition_of_owned_image(self):
+        """Test owners get the renditions of their images."""
+        stem = os.path.splitext(self.name)[0]
+        rendition = media.get_storage().store(
+            f'{stem}-thumb.webp', ContentFile(b'thumb'),
+        )
+
+        res = self.client.get(media_url(rendition))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_offloaded_to_proxy(self):
+        """Test the proxy is told to send the file."""
+        res = self.client.get(media_url(self.name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res['X-Accel-Redirect'], f'/protected-media/{self.name}',
+        )
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res.content, b'')
+
+    def test_other_users_image(self):
+        """Test images of other users' recipes are not served."""
+        other = get_user_model().objects.create_user(
+            'other@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(other)
+
+        res = self.client.get(media_url(self.name))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_path_traversal(self):
+        """Test paths leaving the media directory are refused."""
+        res = self.client.get(media_url(f'{self.name}/../../secret.jpg'))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_auth_required(self):
+        """Test media requires authentication."""
+        res = APIClient().get(media_url(self.name))
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
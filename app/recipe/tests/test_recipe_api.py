@@ -1,10 +1,25 @@
 """
 Tests for recipe APIs.
 """
+import csv
+import io
+import json
+import time
 from decimal import Decimal
+from functools import partial
+from unittest import skipUnless
+from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.db import connection
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import (
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
@@ -16,6 +31,15 @@ from core.models import (
     Ingredient
 )
 
+from recipe import search
+from recipe.mixins import response_cache_stats
+from recipe.pagination import RecipeCursorPagination
+from recipe.pantry import pantry_index_cache
+from recipe.similarity import (
+    update_signatures,
+    update_signatures_in_batches,
+)
+from recipe.views import RecipeViewSet
 from recipe.serializers import (
     RecipeSerializer,
     RecipeDetailSerializer,
@@ -23,6 +47,9 @@ from recipe.serializers import (
 
 
 RECIPES_URL = reverse('recipe:recipe-list')
+BULK_URL = reverse('recipe:recipe-bulk')
+EXPORT_URL = reverse('recipe:recipe-export')
+PANTRY_URL = reverse('recipe:recipe-pantry')
 
 
 def detail_url(recipe_id):
@@ -30,6 +57,11 @@ def detail_url(recipe_id):
     return reverse('recipe:recipe-detail', args=[recipe_id])
 
 
+def similar_url(recipe_id):
+    """Create and return a similar recipes URL."""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
 def create_recipe(user, **params):
     """Create and return a sample recipe."""
     defaults = {
@@ -81,7 +113,7 @@ class PrivateRecipeApiTests(TestCase):
         # many=True because we expect multiple recipes in the result
         serializer = RecipeSerializer(recipes, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_recipe_list_limited_to_user(self):
         """Test list of recipes is limited to authenticated user."""
@@ -99,7 +131,47 @@ class PrivateRecipeApiTests(TestCase):
 
         serializer = RecipeSerializer(recipes, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
+
+    def test_list_recipes_paginated(self):
+        """Test the recipe list is split into pages."""
+        for i in range(5):
+            create_recipe(user=self.user, title=f'Recipe {i}')
+
+        res = self.client.get(RECIPES_URL, {'page_size': 2})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [r['title'] for r in res.data['results']],
+            ['Recipe 4', 'Recipe 3'],
+        )
+        self.assertIsNone(res.data['previous'])
+        self.assertIsNotNone(res.data['next'])
+
+    @patch.object(RecipeCursorPagination, 'max_page_size', 2)
+    def test_list_recipes_page_size_limited(self):
+        """Test clients cannot request pages above the maximum size."""
+        for i in range(3):
+            create_recipe(user=self.user)
+
+        res = self.client.get(RECIPES_URL, {'page_size': 100000})
+
+        self.assertEqual(len(res.data['results']), 2)
+
+    def test_list_recipes_cursor_stable_on_insert(self):
+        """Test recipes created between pages do not shift the pages."""
+        for i in range(4):
+            create_recipe(user=self.user, title=f'Recipe {i}')
+
+        res = self.client.get(RECIPES_URL, {'page_size': 2})
+        create_recipe(user=self.user, title='New recipe')
+        res = self.client.get(res.data['next'])
+
+        self.assertEqual(
+            [r['title'] for r in res.data['results']],
+            ['Recipe 1', 'Recipe 0'],
+        )
+        self.assertIsNone(res.data['next'])
 
     def test_get_recipe_detail(self):
         """Test get recipe detail."""
@@ -172,6 +244,21 @@ class PrivateRecipeApiTests(TestCase):
             ).exists()
             self.assertTrue(exists)
 
+    def test_create_recipe_with_duplicate_tags(self):
+        """Test repeated tag names in a payload create a single tag."""
+        payload = {
+            'title': 'Pongal',
+            'time_minutes': 60,
+            'price': Decimal('4.50'),
+            'tags': [{'name': 'Indian'}, {'name': 'Indian'}],
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        tags = Tag.objects.filter(user=self.user)
+        self.assertEqual(tags.count(), 1)
+        self.assertEqual(len(res.data['tags']), 1)
+
     def test_create_tag_on_update(self):
         """Test create tag when updating a recipe."""
         recipe = create_recipe(user=self.user)
@@ -297,3 +384,1254 @@ class PrivateRecipeApiTests(TestCase):
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(recipe.ingredients.count(), 0)
+
+
+class RecipeQueryCountTests(TestCase):
+    """Test the number of queries run by the recipe API is constant."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def _create_recipes(self, count):
+        """Create recipes with a tag and an ingredient each."""
+        start = Recipe.objects.count()
+        for i in range(start, start + count):
+            recipe = create_recipe(user=self.user, title=f'Recipe {i}')
+            recipe.tags.add(
+                Tag.objects.create(user=self.user, name=f'Tag {i}')
+            )
+            recipe.ingredients.add(
+                Ingredient.objects.create(user=self.user, name=f'Ing {i}')
+            )
+        return recipe
+
+    def test_list_query_count(self):
+        """Test listing recipes runs a fixed number of queries."""
+        for count in (1, 10):
+            self._create_recipes(count)
+
+            # Data version, recipes, tags and ingredients.
+            with self.assertNumQueries(4):
+                res = self.client.get(RECIPES_URL)
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_query_count(self):
+        """Test retrieving a recipe runs a fixed number of queries."""
+        recipe = self._create_recipes(10)
+        recipe.tags.add(*Tag.objects.all())
+
+        # Data version, recipe, tags and ingredients.
+        with self.assertNumQueries(4):
+            res = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['tags']), 10)
+
+    def test_create_query_count(self):
+        """Test creating a recipe runs a fixed number of queries."""
+        payload = {
+            'title': 'Sample recipe',
+            'time_minutes': 30,
+            'price': Decimal('5.99'),
+        }
+        for count in (1, 10):
+            self._create_recipes(count)
+
+            # Insert, bump the data version, then tags and ingredients
+            # for the response.
+            with self.assertNumQueries(4):
+                res = self.client.post(RECIPES_URL, payload)
+
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_create_with_tags_query_count(self):
+        """Test tags and ingredients are resolved in a fixed number of
+        queries however many are passed."""
+        Tag.objects.create(user=self.user, name='Existing')
+        for count in (1, 10):
+            names = [{'name': f'Name {count} {i}'} for i in range(count)]
+            payload = {
+                'title': 'Sample recipe',
+                'time_minutes': 30,
+                'price': Decimal('5.99'),
+                'tags': names + [{'name': 'Existing'}],
+                'ingredients': names,
+            }
+
+            # Insert the recipe, then in a savepoint per relation look
+            # up the names, insert the missing ones, read them back and
+            # link them. Read the links back to insert the similarity
+            # signature and its buckets. Finally bump the data version,
+            # then tags and ingredients for the response.
+            with self.assertNumQueries(17):
+                res = self.client.post(RECIPES_URL, payload, format='json')
+
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(res.data['tags']), count + 1)
+            self.assertEqual(len(res.data['ingredients']), count)
+
+    def test_update_query_count(self):
+        """Test updating a recipe runs a fixed number of queries."""
+        recipe = self._create_recipes(10)
+        recipe.tags.add(*Tag.objects.all())
+        payload = {'title': 'New recipe title'}
+
+        # Fetch, update, bump the data version, then tags and
+        # ingredients for the response.
+        with self.assertNumQueries(5):
+            res = self.client.patch(detail_url(recipe.id), payload)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_update_tags_only_changes_diff(self):
+        """Test updating tags keeps the links that did not change."""
+        recipe = create_recipe(user=self.user)
+        tags = [
+            Tag.objects.create(user=self.user, name=f'Tag {i}')
+            for i in range(5)
+        ]
+        recipe.tags.add(*tags)
+        update_signatures([(recipe.id, recipe.user_id)])
+        through = Recipe.tags.through
+        kept = set(
+            through.objects
+            .filter(recipe=recipe, tag__in=tags[1:])
+            .values_list('id', flat=True)
+        )
+        payload = {
+            'tags': [{'name': t.name} for t in tags[1:]] + [{'name': 'New'}],
+        }
+
+        # Fetch the recipe, in a savepoint resolve the names (one
+        # lookup, one insert and one read back for the new tag), read
+        # the current links, delete the removed one and insert the
+        # added one. Update the recipe, lock it, read the similarity
+        # signature and the links, replace the signature and its
+        # buckets (two deletes, two inserts), bump the data version,
+        # then tags and ingredients for the response.
+        with self.assertNumQueries(20):
+            res = self.client.patch(
+                detail_url(recipe.id), payload, format='json'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        links = through.objects.filter(recipe=recipe)
+        self.assertEqual(links.count(), 5)
+        self.assertTrue(kept <= set(links.values_list('id', flat=True)))
+        self.assertNotIn(tags[0], recipe.tags.all())
+
+    def test_update_same_tags_query_count(self):
+        """Test resubmitting the current tags writes no links."""
+        recipe = create_recipe(user=self.user)
+        tags = [
+            Tag.objects.create(user=self.user, name=f'Tag {i}')
+            for i in range(5)
+        ]
+        recipe.tags.add(*tags)
+        update_signatures([(recipe.id, recipe.user_id)])
+        payload = {'tags': [{'name': t.name} for t in tags]}
+
+        # Fetch, in a savepoint resolve names and read current links,
+        # update the recipe, lock it, read the similarity signature and
+        # the links, bump the data version, then tags and ingredients
+        # for the response.
+        with self.assertNumQueries(12):
+            res = self.client.patch(
+                detail_url(recipe.id), payload, format='json'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(recipe.tags.count(), 5)
+
+
+class SweptNameRecipeApiTests(TransactionTestCase):
+    """Test writes racing with sweep_orphans, with real commits."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        get_or_create = RecipeSerializer._get_or_create_objects
+        self.lookups = 0
+
+        def swept_on_first_lookup(serializer, model, items):
+            """Return tags deleted meanwhile the first time."""
+            objects = get_or_create(serializer, model, items)
+            if model is Tag:
+                self.lookups += 1
+                if self.lookups == 1:
+                    # As if sweep_orphans deleted the row and committed
+                    objects = [
+                        Tag(id=obj.id + 1000, user=obj.user, name=obj.name)
+                        for obj in objects
+                    ]
+            return objects
+
+        patcher = patch.object(
+            RecipeSerializer, '_get_or_create_objects', swept_on_first_lookup,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _assert_linked_again(self, recipe_id):
+        """Assert the tag was looked up again and linked."""
+        self.assertEqual(self.lookups, 2)
+        recipe = Recipe.objects.get(id=recipe_id)
+        self.assertEqual(
+            list(recipe.tags.values_list('name', flat=True)), ['Vegan'],
+        )
+
+    def test_create_retried(self):
+        """Test a create linking a swept tag links it again."""
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Salad',
+            'time_minutes': 5,
+            'price': Decimal('3.00'),
+            'tags': [{'name': 'Vegan'}],
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self._assert_linked_again(res.data['id'])
+
+    def test_update_retried(self):
+        """Test an update linking a swept tag links it again."""
+        recipe = create_recipe(self.user)
+
+        res = self.client.patch(
+            detail_url(recipe.id),
+            {'tags': [{'name': 'Vegan'}]},
+            format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self._assert_linked_again(recipe.id)
+
+
+class BulkRecipeApiTests(TestCase):
+    """Test the bulk recipe API."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def _payload(self, count):
+        """Return a payload creating count recipes."""
+        return [
+            {
+                'title': f'Recipe {i}',
+                'time_minutes': 10 + i,
+                'price': '2.50',
+                'description': 'Bulk',
+                'tags': [{'name': 'Shared'}, {'name': f'Tag {i}'}],
+                'ingredients': [{'name': 'Salt'}],
+            }
+            for i in range(count)
+        ]
+
+    def test_bulk_create(self):
+        """Test creating many recipes in one request."""
+        Tag.objects.create(user=self.user, name='Shared')
+
+        res = self.client.post(BULK_URL, self._payload(3), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 3)
+        recipes = Recipe.objects.filter(user=self.user).order_by('id')
+        self.assertEqual(
+            [r['id'] for r in res.data],
+            [r.id for r in recipes],
+        )
+        for i, recipe in enumerate(recipes):
+            self.assertEqual(recipe.title, f'Recipe {i}')
+            self.assertEqual(
+                set(recipe.tags.values_list('name', flat=True)),
+                {'Shared', f'Tag {i}'},
+            )
+            self.assertEqual(res.data[i], RecipeDetailSerializer(recipe).data)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(Ingredient.objects.filter(user=self.user).count(), 1)
+
+    def test_bulk_create_invalid_item(self):
+        """Test one invalid item rejects the whole batch."""
+        payload = self._payload(2)
+        del payload[1]['title']
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('title', res.data[1])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_bulk_create_limit(self):
+        """Test the number of recipes per request is limited."""
+        with patch(
+            'recipe.views.RecipeViewSet.bulk_max_items', 1,
+        ):
+            res = self.client.post(BULK_URL, self._payload(2), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+    @skipUnless(
+        connection.features.can_return_rows_from_bulk_insert,
+        'Recipes are inserted one by one on this database.',
+    )
+    def test_bulk_create_query_count(self):
+        """Test bulk create runs a fixed number of queries."""
+        for count in (1, 10):
+            Tag.objects.all().delete()
+            Ingredient.objects.all().delete()
+            payload = self._payload(count)
+
+            # Savepoints, the recipe insert, resolving and linking per
+            # relation, bumping the data version, then one prefetch per
+            # relation.
+            with self.assertNumQueries(14):
+                res = self.client.post(BULK_URL, payload, format='json')
+
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_update(self):
+        """Test updating many recipes in one request."""
+        tag_keep = Tag.objects.create(user=self.user, name='Keep')
+        tag_drop = Tag.objects.create(user=self.user, name='Drop')
+        recipe1 = create_recipe(user=self.user, title='One')
+        recipe1.tags.add(tag_keep, tag_drop)
+        recipe2 = create_recipe(user=self.user, title='Two')
+        recipe2.tags.add(tag_drop)
+        payload = [
+            {'id': recipe2.id, 'title': 'Second'},
+            {
+                'id': recipe1.id,
+                'tags': [{'name': 'Keep'}, {'name': 'New'}],
+            },
+        ]
+
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data], [recipe2.id, recipe1.id])
+        recipe1.refresh_from_db()
+        recipe2.refresh_from_db()
+        self.assertEqual(recipe1.title, 'One')
+        self.assertEqual(recipe2.title, 'Second')
+        self.assertEqual(
+            set(recipe1.tags.values_list('name', flat=True)),
+            {'Keep', 'New'},
+        )
+        self.assertEqual(list(recipe2.tags.all()), [tag_drop])
+
+    def test_bulk_update_other_users_recipe(self):
+        """Test bulk update rejects recipes of other users."""
+        other_user = get_user_model().objects.create_user(
+            'other@example.com',
+            'password123',
+        )
+        recipe = create_recipe(user=self.user)
+        other_recipe = create_recipe(user=other_user, title='Other')
+        payload = [
+            {'id': recipe.id, 'title': 'Mine'},
+            {'id': other_recipe.id, 'title': 'Changed'},
+        ]
+
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('id', res.data[1])
+        other_recipe.refresh_from_db()
+        self.assertEqual(other_recipe.title, 'Other')
+
+    def test_bulk_update_bool_id(self):
+        """Test bulk update rejects true as the id 1."""
+        recipe = create_recipe(user=self.user, id=1)
+        payload = [{'id': True, 'title': 'Changed'}]
+
+        res = self.client.patch(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('id', res.data[0])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'Sample recipe title')
+
+    def test_bulk_delete(self):
+        """Test deleting many recipes in one request."""
+        other_user = get_user_model().objects.create_user(
+            'other@example.com',
+            'password123',
+        )
+        recipe1 = create_recipe(user=self.user)
+        recipe2 = create_recipe(user=self.user)
+        other_recipe = create_recipe(user=other_user)
+        payload = {'ids': [recipe1.id, other_recipe.id, recipe2.id]}
+
+        res = self.client.delete(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [
+            {'id': recipe1.id, 'deleted': True},
+            {'id': other_recipe.id, 'deleted': False},
+            {'id': recipe2.id, 'deleted': True},
+        ])
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+        self.assertTrue(Recipe.objects.filter(id=other_recipe.id).exists())
+
+
+class ConditionalRecipeApiTests(TestCase):
+    """Test conditional requests to the recipe API."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_list_not_modified(self):
+        """Test an unchanged list is answered with a 304."""
+        create_recipe(user=self.user)
+        res = self.client.get(RECIPES_URL)
+        etag = res['ETag']
+
+        with self.assertNumQueries(1):
+            res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+
+    def test_detail_not_modified_since(self):
+        """Test an unchanged recipe is answered with a 304."""
+        recipe = create_recipe(user=self.user)
+        self.client.patch(detail_url(recipe.id), {'title': 'New title'})
+        # Once the second of the write has passed
+        with patch('recipe.mixins.time.time', return_value=time.time() + 1):
+            res = self.client.get(detail_url(recipe.id))
+
+            # The data version, then whether the recipe exists
+            with self.assertNumQueries(2):
+                res = self.client.get(
+                    detail_url(recipe.id),
+                    HTTP_IF_MODIFIED_SINCE=res['Last-Modified'],
+                )
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_not_modified(self):
+        """Test a recipe with a current ETag is answered with a 304."""
+        recipe = create_recipe(user=self.user)
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+
+        # The data version, then whether the recipe exists
+        with self.assertNumQueries(2):
+            res = self.client.get(
+                detail_url(recipe.id), HTTP_IF_NONE_MATCH=etag,
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_no_last_modified_within_write_second(self):
+        """Test Last-Modified is not sent while it could be ambiguous."""
+        recipe = create_recipe(user=self.user)
+        self.client.patch(detail_url(recipe.id), {'title': 'New title'})
+
+        res = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Last-Modified', res)
+        self.assertIn('ETag', res)
+
+    def test_detail_not_modified_requires_object(self):
+        """Test a current ETag does not hide a missing or foreign recipe."""
+        other_user = get_user_model().objects.create_user(
+            'other@example.com',
+            'password123',
+        )
+        other_recipe = create_recipe(user=other_user)
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        for recipe_id in (other_recipe.id, other_recipe.id + 1):
+            with self.assertNumQueries(2):
+                res = self.client.get(
+                    detail_url(recipe_id), HTTP_IF_NONE_MATCH=etag,
+                )
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_write_changes_etag(self):
+        """Test writes make the previous ETag stale."""
+        res = self.client.get(RECIPES_URL)
+        etag = res['ETag']
+        payload = {
+            'title': 'Sample recipe',
+            'time_minutes': 30,
+            'price': Decimal('5.99'),
+        }
+        res = self.client.post(RECIPES_URL, payload)
+
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_delete_changes_etag(self):
+        """Test deleting a recipe makes the previous ETag stale."""
+        recipe = create_recipe(user=self.user)
+        etag = self.client.get(RECIPES_URL)['ETag']
+        self.client.delete(detail_url(recipe.id))
+
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_user_update_keeps_version(self):
+        """Test saving the user does not bring back an old version."""
+        recipe = create_recipe(user=self.user)
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+        self.client.patch(detail_url(recipe.id), {'title': 'New title'})
+
+        # The authenticated user in memory still holds version 0
+        self.client.patch(reverse('user:me'), {'name': 'New name'})
+        res = self.client.get(detail_url(recipe.id), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['title'], 'New title')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'New name')
+        self.assertEqual(self.user.data_version, 1)
+
+    def test_etag_per_user(self):
+        """Test users do not share ETags."""
+        other_user = get_user_model().objects.create_user(
+            'other@example.com',
+            'password123',
+        )
+        etag = self.client.get(RECIPES_URL)['ETag']
+        self.client.force_authenticate(other_user)
+
+        res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+@override_settings(
+    RECIPE_RESPONSE_CACHE='recipes',
+    CACHES={'recipes': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recipe-response-tests',
+    }},
+)
+class CachedRecipeApiTests(TestCase):
+    """Test caching recipe API responses."""
+
+    def setUp(self):
+        caches['recipes'].clear()
+        response_cache_stats.reset()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_list_cached(self):
+        """Test repeated list requests are served from the cache."""
+        create_recipe(user=self.user)
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+        # Only the data version is read
+        with self.assertNumQueries(1):
+            cached = self.client.get(RECIPES_URL)
+
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(cached.content, res.content)
+        self.assertEqual(response_cache_stats.hits, 1)
+        self.assertEqual(response_cache_stats.misses, 1)
+
+    def test_detail_cached(self):
+        """Test a cached detail is served without loading the recipe."""
+        recipe = create_recipe(user=self.user)
+        res = self.client.get(detail_url(recipe.id))
+        self.assertEqual(res['X-Cache'], 'MISS')
+
+        # The data version, then whether the recipe exists
+        with self.assertNumQueries(2):
+            cached = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(cached.content, res.content)
+
+    def test_detail_deleted_without_bump(self):
+        """Test a cached detail of a recipe deleted meanwhile is a 404."""
+        recipe = create_recipe(user=self.user)
+        self.client.get(detail_url(recipe.id))
+        Recipe.objects.filter(id=recipe.id).delete()
+
+        res = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(RECIPE_RESPONSE_CACHE_STATS_EVERY=2)
+    def test_stats_logged(self):
+        """Test the hits and misses are logged periodically."""
+        self.client.get(RECIPES_URL)
+
+        with self.assertLogs('recipe.mixins', 'INFO') as logs:
+            self.client.get(RECIPES_URL)
+
+        self.assertIn('1 hits, 1 misses (50.0% hits)', logs.output[0])
+
+    def test_cache_keyed_by_query_params(self):
+        """Test different pages are cached separately."""
+        create_recipe(user=self.user)
+        create_recipe(user=self.user)
+        self.client.get(RECIPES_URL, {'page_size': 1})
+
+        res = self.client.get(RECIPES_URL, {'page_size': 2})
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(len(res.data['results']), 2)
+
+    def test_cache_per_user(self):
+        """Test users never see each other's cached responses."""
+        other_user = get_user_model().objects.create_user(
+            'other@example.com',
+            'password123',
+        )
+        create_recipe(user=other_user)
+        self.client.get(RECIPES_URL)
+        self.client.force_authenticate(other_user)
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_update_invalidates_cache(self):
+        """Test updating a recipe invalidates the cached detail."""
+        recipe = create_recipe(user=self.user)
+        url = detail_url(recipe.id)
+        self.client.get(url)
+
+        self.client.patch(url, {'title': 'New title'})
+        res = self.client.get(url)
+
+        self.assertEqual(res['X-Cache'], 'MISS')
+        self.assertEqual(res.data['title'], 'New title')
+
+    def test_delete_invalidates_cache(self):
+        """Test deleting a recipe invalidates the cached list."""
+        recipe = create_recipe(user=self.user)
+        self.client.get(RECIPES_URL)
+
+        self.client.delete(detail_url(recipe.id))
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.data['results'], [])
+
+
+class ExportRecipeApiTests(TestCase):
+    """Test exporting recipes."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def _create_recipes(self, count):
+        """Create count recipes with a tag and an ingredient each."""
+        for i in range(count):
+            recipe = create_recipe(user=self.user, title=f'Recipe {i}')
+            recipe.tags.add(Tag.objects.create(user=self.user, name=f'T{i}'))
+            recipe.ingredients.add(
+                Ingredient.objects.create(user=self.user, name=f'I{i}'),
+            )
+
+    def test_export_ndjson(self):
+        """Test exporting recipes as newline delimited JSON."""
+        self._create_recipes(3)
+        other_user = get_user_model().objects.create_user(
+            'other@example.com',
+            'password123',
+        )
+        create_recipe(user=other_user)
+
+        res = self.client.get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(res.streaming_content).splitlines()
+        recipes = Recipe.objects.filter(user=self.user).order_by('-id')
+        serializer = RecipeDetailSerializer(recipes, many=True)
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            json.loads(json.dumps(serializer.data)),
+        )
+
+    def test_export_csv(self):
+        """Test exporting recipes as CSV."""
+        recipe = create_recipe(user=self.user, title='Soup, "hot"')
+        recipe.tags.add(
+            Tag.objects.create(user=self.user, name='Vegan'),
+            Tag.objects.create(user=self.user, name='Dinner'),
+        )
+
+        res = self.client.get(EXPORT_URL, {'export_format': 'csv'})
+
+        self.assertEqual(res['Content-Type'], 'text/csv; charset=utf-8')
+        content = b''.join(res.streaming_content).decode()
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], [
+            'id', 'title', 'time_minutes', 'price', 'link', 'description',
+            'tags', 'ingredients',
+        ])
+        self.assertEqual(rows[1], [
+            str(recipe.id), 'Soup, "hot"', '22', '5.25',
+            'http://example.com/recipe.pdf', 'Sample description',
+            'Vegan|Dinner', '',
+        ])
+
+    def test_export_invalid_format(self):
+        """Test an unknown export format is rejected."""
+        res = self.client.get(EXPORT_URL, {'export_format': 'xml'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch.object(RecipeViewSet, 'export_chunk_size', 2)
+    def test_export_streams_chunks(self):
+        """Test recipes are loaded a chunk at a time."""
+        self._create_recipes(5)
+        res = self.client.get(EXPORT_URL)
+
+        # Rows, tags and ingredients for each of the 3 chunks
+        with self.assertNumQueries(9):
+            chunks = list(res.streaming_content)
+
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(b''.join(chunks).count(b'\n'), 5)
+
+
+class SearchRecipeApiTests(TestCase):
+    """Test full-text search of recipes."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def _search(self, terms, **params):
+        """Return the ids of the recipes found for terms."""
+        res = self.client.get(RECIPES_URL, {'search': terms, **params})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in res.data['results']]
+
+    def test_search_fields(self):
+        """Test titles, descriptions, tags and ingredients are searched."""
+        in_title = create_recipe(self.user, title='Lemon tart')
+        in_description = create_recipe(
+            self.user, title='Cake', description='With lemon zest',
+        )
+        in_tag = create_recipe(self.user, title='Pie')
+        in_tag.tags.create(user=self.user, name='Lemon')
+        in_ingredient = create_recipe(self.user, title='Curd')
+        in_ingredient.ingredients.create(user=self.user, name='Lemon')
+        create_recipe(self.user, title='Chocolate tart')
+        other_user = get_user_model().objects.create_user(
+            'other@example.com',
+            'testpass123',
+        )
+        create_recipe(other_user, title='Lemon pie')
+
+        ids = self._search('lemon')
+
+        # Ranked by where the word was found, newest first within a rank
+        self.assertEqual(ids, [
+            in_title.id, in_ingredient.id, in_tag.id, in_description.id,
+        ])
+
+    def test_every_word_matched(self):
+        """Test recipes must contain every word of the search."""
+        both = create_recipe(self.user, title='Lemon tart')
+        create_recipe(self.user, title='Lemon curd')
+
+        self.assertEqual(self._search('tart lemon'), [both.id])
+
+    def test_paged_by_rank(self):
+        """Test search results are paged without gaps or repeats."""
+        recipes = [
+            create_recipe(self.user, title='Lemon tart'),
+            create_recipe(self.user, title='Cake', description='Lemon'),
+            create_recipe(self.user, title='Lemon pie'),
+            create_recipe(self.user, title='Cookies', description='Lemon'),
+        ]
+
+        ids = []
+        res = self.client.get(RECIPES_URL, {'search': 'lemon', 'page_size': 1})
+        while True:
+            ids += [item['id'] for item in res.data['results']]
+            if not res.data['next']:
+                break
+            res = self.client.get(res.data['next'])
+
+        self.assertEqual(ids, [
+            recipes[2].id, recipes[0].id, recipes[3].id, recipes[1].id,
+        ])
+
+    def test_no_search(self):
+        """Test an empty search lists every recipe."""
+        recipes = [create_recipe(self.user), create_recipe(self.user)]
+
+        self.assertEqual(
+            self._search(' '),
+            [recipe.id for recipe in reversed(recipes)],
+        )
+
+    def test_search_export(self):
+        """Test exports contain the search results."""
+        found = create_recipe(self.user, title='Lemon tart')
+        create_recipe(self.user, title='Chocolate tart')
+
+        res = self.client.get(EXPORT_URL, {'search': 'lemon'})
+
+        rows = [
+            json.loads(line)
+            for line in b''.join(res.streaming_content).splitlines()
+        ]
+        self.assertEqual([row['id'] for row in rows], [found.id])
+
+    @skipUnless(
+        connection.vendor == 'postgresql',
+        'Search vectors are only maintained on PostgreSQL.',
+    )
+    def test_search_vector_maintained(self):
+        """Test renaming a tag updates the recipes using it."""
+        recipe = create_recipe(self.user, title='Pie')
+        tag = recipe.tags.create(user=self.user, name='Lemon')
+
+        tag.name = 'Orange'
+        tag.save()
+
+        self.assertEqual(self._search('lemon'), [])
+        self.assertEqual(self._search('oranges'), [recipe.id])
+
+    @skipUnless(
+        connection.vendor == 'postgresql',
+        'Search vectors are only maintained on PostgreSQL.',
+    )
+    def test_search_pending_vector(self):
+        """Test recipes without a vector yet are matched by substring."""
+        pending = create_recipe(self.user, title='Lemon pie')
+        indexed = create_recipe(self.user, title='Lemon tart')
+        with connection.cursor() as cursor:
+            # Like recipes created before the search vector existed
+            cursor.execute(
+                'ALTER TABLE core_recipe DISABLE TRIGGER '
+                'core_recipe_search_vector'
+            )
+            Recipe.objects.filter(id=pending.id).update(search_vector=None)
+            cursor.execute(
+                'ALTER TABLE core_recipe ENABLE TRIGGER '
+                'core_recipe_search_vector'
+            )
+        search._vectors_complete.clear()
+        self.addCleanup(search._vectors_complete.clear)
+
+        self.assertEqual(
+            sorted(self._search('lemon')), sorted([pending.id, indexed.id]),
+        )
+
+        call_command('backfill_search_vectors', stdout=io.StringIO())
+        self.assertFalse(
+            Recipe.objects.filter(search_vector__isnull=True).exists(),
+        )
+        self.assertEqual(self._search('pie'), [pending.id])
+
+
+class FilterRecipeApiTests(TestCase):
+    """Test filtering recipes by tags and ingredients."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.quick = Tag.objects.create(user=self.user, name='Quick')
+        self.kale = Ingredient.objects.create(user=self.user, name='Kale')
+        self.both = create_recipe(self.user, title='Kale salad')
+        self.both.tags.add(self.vegan, self.quick)
+        self.both.ingredients.add(self.kale)
+        self.vegan_only = create_recipe(self.user, title='Stew')
+        self.vegan_only.tags.add(self.vegan)
+        self.untagged = create_recipe(self.user, title='Steak')
+
+    def _filter(self, **params):
+        """Return the ids of the recipes listed with params."""
+        res = self.client.get(RECIPES_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in res.data['results']]
+
+    def test_tags_any(self):
+        """Test recipes with any of the tags are listed once."""
+        ids = self._filter(tags=f'{self.vegan.id},{self.quick.id}')
+
+        self.assertEqual(ids, [self.vegan_only.id, self.both.id])
+
+    def test_tags_all(self):
+        """Test recipes with all of the tags."""
+        ids = self._filter(
+            tags=f'{self.vegan.id},{self.quick.id}', tags_match='all',
+        )
+
+        self.assertEqual(ids, [self.both.id])
+
+    def test_tags_and_ingredients(self):
+        """Test tag and ingredient filters are combined."""
+        ids = self._filter(tags=str(self.vegan.id), ingredients=self.kale.id)
+
+        self.assertEqual(ids, [self.both.id])
+
+    def test_semi_join(self):
+        """Test filters are EXISTS subqueries, not joins."""
+        with CaptureQueriesContext(connection) as queries:
+            self._filter(
+                tags=f'{self.vegan.id},{self.quick.id}', tags_match='all',
+            )
+
+        sql = next(
+            query['sql'] for query in queries.captured_queries
+            if 'core_recipe_tags' in query['sql']
+            and 'FROM "core_recipe" ' in query['sql']
+        )
+        self.assertEqual(sql.count('EXISTS'), 2)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn('JOIN', sql)
+
+    def test_invalid_filters(self):
+        """Test malformed ids and match values are refused."""
+        for params in (
+            {'tags': 'vegan'},
+            {'tags': ''},
+            {'tags': ','.join(str(id) for id in range(21))},
+            {'ingredients': '1', 'ingredients_match': 'some'},
+        ):
+            res = self.client.get(RECIPES_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PantryRecipeApiTests(TestCase):
+    """Test matching recipes against a pantry of ingredients."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+        pantry_index_cache.clear()
+        self.addCleanup(pantry_index_cache.clear)
+
+        self.ingredients = {
+            name: Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Egg', 'Flour', 'Milk', 'Salt')
+        }
+
+    def _recipe(self, *names):
+        """Create a recipe with the named ingredients."""
+        recipe = create_recipe(self.user, title=' '.join(names))
+        recipe.ingredients.add(*(self.ingredients[name] for name in names))
+        return recipe
+
+    def _match(self, *names, **params):
+        """Return the pantry response for the named ingredients."""
+        ids = ','.join(str(self.ingredients[name].id) for name in names)
+        return self.client.get(PANTRY_URL, {'ingredients': ids, **params})
+
+    def test_ranked_by_missing(self):
+        """Test makeable recipes come first, then the fewest missing."""
+        pancakes = self._recipe('Egg', 'Flour', 'Milk')
+        omelette = self._recipe('Egg', 'Salt')
+        crepes = self._recipe('Egg', 'Flour', 'Milk', 'Salt')
+        boiled = self._recipe('Egg')
+        self._recipe('Salt')
+        create_recipe(self.user, title='Water')
+
+        res = self._match('Egg', 'Flour', 'Milk')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['id'] for item in res.data],
+            [boiled.id, pancakes.id, crepes.id, omelette.id],
+        )
+        self.assertEqual(
+            [item['missing_count'] for item in res.data], [0, 0, 1, 1],
+        )
+        self.assertEqual(res.data[0]['missing_ingredients'], [])
+        self.assertEqual(
+            [item['name'] for item in res.data[2]['missing_ingredients']],
+            ['Salt'],
+        )
+
+    def test_limit(self):
+        """Test the number of recipes returned is limited."""
+        self._recipe('Egg')
+        self._recipe('Egg', 'Milk')
+
+        res = self._match('Egg', limit=1)
+
+        self.assertEqual(len(res.data), 1)
+
+    def test_index_updated_on_write(self):
+        """Test recipes written through the API are matched next."""
+        recipe = self._recipe('Egg', 'Milk')
+        self.assertEqual(len(self._match('Flour').data), 0)
+
+        self.client.patch(
+            detail_url(recipe.id),
+            {'ingredients': [{'name': 'Flour'}]},
+            format='json',
+        )
+        res = self._match('Flour')
+
+        self.assertEqual([item['id'] for item in res.data], [recipe.id])
+
+    def test_index_advanced_on_write(self):
+        """Test API writes update the cached index without a rebuild."""
+        recipe = self._recipe('Egg', 'Milk')
+        deleted = self._recipe('Egg')
+        self._match('Egg')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                detail_url(recipe.id),
+                {'ingredients': [{'name': 'Flour'}]},
+                format='json',
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            created = self.client.post(RECIPES_URL, {
+                'title': 'Bread',
+                'time_minutes': 60,
+                'price': Decimal('1.00'),
+                'ingredients': [{'name': 'Flour'}, {'name': 'Salt'}],
+            }, format='json').data['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(detail_url(deleted.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse(
+                'recipe:ingredient-detail',
+                args=[self.ingredients['Salt'].id],
+            ))
+
+        # The data version, then the recipes and their relations
+        with self.assertNumQueries(4):
+            res = self._match('Flour')
+
+        self.assertEqual(
+            [(item['id'], item['missing_count']) for item in res.data],
+            [(created, 0), (recipe.id, 0)],
+        )
+        self.assertEqual(self._match('Egg').data, [])
+
+    def test_index_rebuilt_after_other_write(self):
+        """Test a write the process did not see rebuilds the index."""
+        recipe = self._recipe('Egg')
+        self._match('Egg')
+
+        recipe.ingredients.add(self.ingredients['Milk'])
+        get_user_model().objects.bump_data_version(self.user.id)
+        res = self._match('Milk')
+
+        self.assertEqual([item['id'] for item in res.data], [recipe.id])
+
+    def test_cached_index(self):
+        """Test the index is reused while the data is unchanged."""
+        self._recipe('Egg', 'Milk')
+        self._match('Egg')
+
+        # The data version, then the recipes and their relations
+        with self.assertNumQueries(4):
+            self._match('Milk')
+
+    def test_limited_to_user(self):
+        """Test only the user's recipes are matched."""
+        other = get_user_model().objects.create_user(
+            'other@example.com',
+            'testpass123',
+        )
+        create_recipe(other).ingredients.add(self.ingredients['Egg'])
+
+        self.assertEqual(self._match('Egg').data, [])
+
+    def test_invalid_pantry(self):
+        """Test missing or malformed ingredient ids are refused."""
+        for params in (
+            {},
+            {'ingredients': 'egg'},
+            {'ingredients': '1', 'limit': '0'},
+        ):
+            res = self.client.get(PANTRY_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SimilarRecipeApiTests(TestCase):
+    """Test listing the recipes similar to a recipe."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def _recipe(self, tags, ingredients):
+        """Create a recipe through the API, return its id."""
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Sample recipe',
+            'time_minutes': 10,
+            'price': Decimal('2.50'),
+            'tags': [{'name': name} for name in tags],
+            'ingredients': [{'name': name} for name in ingredients],
+        }, format='json')
+        return res.data['id']
+
+    def _similar(self, recipe_id, **params):
+        """Return the ids and similarities of the similar recipes."""
+        res = self.client.get(similar_url(recipe_id), params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [(item['id'], item['similarity']) for item in res.data]
+
+    def test_ranked_by_similarity(self):
+        """Test the most similar recipes come first."""
+        recipe = self._recipe(['Breakfast'], ['Egg', 'Flour', 'Milk'])
+        twin = self._recipe(['Breakfast'], ['Egg', 'Flour', 'Milk'])
+        close = self._recipe(['Breakfast'], ['Egg', 'Flour', 'Salt'])
+        unrelated = self._recipe(['Dinner'], ['Beef', 'Onion', 'Stock'])
+
+        similar = self._similar(recipe)
+
+        self.assertEqual([id for id, _ in similar], [twin, close])
+        self.assertEqual(similar[0][1], 1.0)
+        # The exact similarity is 3/5
+        self.assertAlmostEqual(similar[1][1], 0.6, delta=0.2)
+        self.assertNotIn(recipe, [id for id, _ in self._similar(unrelated)])
+
+    def test_limit(self):
+        """Test the number of recipes returned is limited."""
+        recipe = self._recipe([], ['Egg'])
+        self._recipe([], ['Egg'])
+        self._recipe([], ['Egg'])
+
+        self.assertEqual(len(self._similar(recipe, limit=1)), 1)
+
+    def test_updated_on_write(self):
+        """Test changed relations are taken into account."""
+        recipe = self._recipe([], ['Egg', 'Milk'])
+        other = self._recipe([], ['Beef'])
+        self.assertEqual(self._similar(recipe), [])
+
+        self.client.patch(
+            detail_url(other),
+            {'ingredients': [{'name': 'Egg'}, {'name': 'Milk'}]},
+            format='json',
+        )
+
+        self.assertEqual(self._similar(recipe), [(other, 1.0)])
+
+    def test_bulk_written(self):
+        """Test recipes written in bulk are indexed."""
+        item = {
+            'title': 'Sample recipe',
+            'time_minutes': 10,
+            'price': '2.50',
+            'ingredients': [{'name': 'Egg'}],
+        }
+        res = self.client.post(BULK_URL, [item, item], format='json')
+        first, second = [recipe['id'] for recipe in res.data]
+
+        self.assertEqual(self._similar(first), [(second, 1.0)])
+
+        self.client.patch(
+            BULK_URL,
+            [{'id': second, 'ingredients': [{'name': 'Beef'}]}],
+            format='json',
+        )
+
+        self.assertEqual(self._similar(first), [])
+
+    def test_deleted_ingredient(self):
+        """Test deleting an ingredient updates the recipes using it."""
+        recipe = self._recipe([], ['Egg'])
+        self._recipe([], ['Egg'])
+
+        ingredient = Ingredient.objects.get(user=self.user, name='Egg')
+        self.client.delete(
+            reverse('recipe:ingredient-detail', args=[ingredient.id]),
+        )
+
+        self.assertEqual(self._similar(recipe), [])
+
+    def test_deleted_tag_in_batches(self):
+        """Test the recipes of a deleted tag are indexed in batches."""
+        recipes = [self._recipe(['Breakfast'], ['Egg']) for _ in range(3)]
+        tag = Tag.objects.get(user=self.user, name='Breakfast')
+
+        with patch(
+            'recipe.views.update_signatures_in_batches',
+            side_effect=partial(update_signatures_in_batches, batch_size=2),
+        ), patch(
+            'recipe.similarity.update_signatures',
+            wraps=update_signatures,
+        ) as mock_update:
+            self.client.delete(reverse('recipe:tag-detail', args=[tag.id]))
+
+        self.assertEqual(
+            [len(call.args[0]) for call in mock_update.call_args_list],
+            [2, 1],
+        )
+        self.assertEqual(
+            [recipe_id for recipe_id, _ in self._similar(recipes[0])],
+            [recipes[2], recipes[1]],
+        )
+
+    def test_other_user_recipe(self):
+        """Test the recipes of other users are not found."""
+        other = get_user_model().objects.create_user(
+            'other@example.com',
+            'testpass123',
+        )
+        recipe = self._recipe([], ['Egg'])
+        self.client.force_authenticate(other)
+        self._recipe([], ['Egg'])
+
+        res = self.client.get(similar_url(recipe))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
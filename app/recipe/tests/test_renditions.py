@@ -0,0 +1,214 @@
+"""
+Tests for recipe image renditions.
+"""
+from decimal import Decimal
+from io import BytesIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from PIL import Image
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.tests.utils import TempMediaRootMixin
+from recipe import renditions
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def image_upload_url(recipe_id):
+    """Create and return an image upload URL."""
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+def image_file(size=(2000, 1000), mode='RGB', image_format='JPEG'):
+    """Return an in-memory image file."""
+    f = BytesIO()
+    Image.new(mode, size).save(f, format=image_format)
+    f.name = f'image.{image_format.lower()}'
+    f.seek(0)
+    return f
+
+
+@override_settings(RECIPE_IMAGE_WORKERS=0)
+class RenditionTests(TempMediaRootMixin, TestCase):
+    """Test generating renditions of recipe images."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+
+    def _upload(self, image):
+        """Upload an image and run the callbacks of the commit."""
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                image_upload_url(self.recipe.id),
+                {'image': image},
+                format='multipart',
+            )
+
+    def test_upload_generates_renditions(self):
+        """Test uploading an image creates every rendition."""
+        res = self._upload(image_file())
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            set(self.recipe.renditions),
+            {'thumb', 'small', 'large'},
+        )
+        thumb = self.recipe.renditions['thumb']
+        self.assertEqual(set(thumb), {'jpeg', 'webp'})
+        with default_storage.open(thumb['webp']) as f:
+            image = Image.open(f)
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.size, (160, 80))
+        with default_storage.open(self.recipe.renditions['large']['jpeg']) \
+                as f:
+            self.assertEqual(Image.open(f).size, (1200, 600))
+
+    def test_small_image_not_enlarged(self):
+        """Test renditions are never larger than the original."""
+        self._upload(image_file(size=(100, 50)))
+
+        self.recipe.refresh_from_db()
+        with default_storage.open(self.recipe.renditions['large']['jpeg']) \
+                as f:
+            self.assertEqual(Image.open(f).size, (100, 50))
+
+    def test_transparent_image(self):
+        """Test transparent images are flattened for JPEG only."""
+        self._upload(image_file(mode='RGBA', image_format='PNG'))
+
+        self.recipe.refresh_from_db()
+        paths = self.recipe.renditions['thumb']
+        with default_storage.open(paths['jpeg']) as f:
+            self.assertEqual(Image.open(f).mode, 'RGB')
+        with default_storage.open(paths['webp']) as f:
+            self.assertEqual(Image.open(f).mode, 'RGBA')
+
+    def test_renditions_urls(self):
+        """Test the recipe APIs return the URLs of the renditions."""
+        self._upload(image_file())
+
+        res = self.client.get(RECIPES_URL)
+
+        thumb = res.data['results'][0]['renditions']['thumb']
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            thumb['webp'],
+            'http://testserver' + default_storage.url(
+                self.recipe.renditions['thumb']['webp'],
+            ),
+        )
+
+    def test_new_upload_clears_renditions(self):
+        """Test renditions of a replaced image are not returned."""
+        self._upload(image_file())
+
+        res = self.client.post(
+            image_upload_url(self.recipe.id),
+            {'image': image_file()},
+            format='multipart',
+        )
+
+        self.assertEqual(res.data['renditions'], {})
+
+    def test_replaced_image(self):
+        """Test renditions of an image replaced meanwhile are dropped."""
+        self.recipe.image.save('new.jpg', ContentFile(b''))
+        name = default_storage.save('old.jpg', image_file())
+
+        renditions.generate_renditions(self.recipe.id, name)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.renditions, {})
+
+    def test_same_image_shares_renditions(self):
+        """Test renditions of an image already uploaded are reused."""
+        self._upload(image_file())
+        self.recipe.refresh_from_db()
+        first = self.recipe
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Other recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+
+        with patch('recipe.renditions._encode') as mock_encode:
+            self._upload(image_file())
+
+        mock_encode.assert_not_called()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image.name, first.image.name)
+        self.assertEqual(self.recipe.renditions, first.renditions)
+
+    def test_failed_format_keeps_others(self):
+        """Test a format failing to encode leaves the others recorded."""
+        encode = renditions._encode
+
+        def fail_webp(image, pil_format, options):
+            if pil_format == 'WEBP':
+                raise OSError('encoder webp not available')
+            return encode(image, pil_format, options)
+
+        with patch('recipe.renditions._encode', side_effect=fail_webp), \
+                self.assertLogs('recipe.renditions', 'ERROR'):
+            self._upload(image_file())
+
+        self.recipe.refresh_from_db()
+        for paths in self.recipe.renditions.values():
+            self.assertEqual(set(paths), {'jpeg'})
+            self.assertTrue(default_storage.exists(paths['jpeg']))
+
+    def test_unsupported_format_skipped(self):
+        """Test formats Pillow cannot write are not listed."""
+        with patch(
+            'recipe.renditions.features.check',
+            side_effect=lambda feature: feature != 'webp',
+        ):
+            formats = renditions.rendition_formats.__wrapped__()
+
+        self.assertEqual(set(formats), {'jpeg'})
+
+    @override_settings(RECIPE_IMAGE_WORKERS=2)
+    @patch('recipe.renditions.get_executor')
+    def test_generated_in_background(self, mock_get_executor):
+        """Test renditions are generated by the workers after commit."""
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(
+                image_upload_url(self.recipe.id),
+                {'image': image_file()},
+                format='multipart',
+            )
+        mock_get_executor.assert_not_called()
+
+        for callback in callbacks:
+            callback()
+
+        self.recipe.refresh_from_db()
+        mock_get_executor.return_value.submit.assert_called_once_with(
+            renditions._generate_in_worker,
+            self.recipe.id,
+            self.recipe.image.name,
+        )
@@ -1,20 +1,22 @@
 """
 Tests for the tags API.
 """
-# from decimal import Decimal
+from decimal import Decimal
 
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import (
-    Tag
+    Recipe,
+    Tag,
 )
 
-from recipe.serializers import TagSerializer
+from recipe.serializers import TagCountSerializer, TagSerializer
+from recipe.suggestions import suggestion_cache, with_recipe_count
 
 
 TAGS_URL = reverse('recipe:tag-list')
@@ -50,6 +52,8 @@ class PrivateTagsApiTests(TestCase):
         self.user = create_user()
         self.client = APIClient()
         self.client.force_authenticate(self.user)
+        suggestion_cache.clear()
+        self.addCleanup(suggestion_cache.clear)
 
     def test_retrieve_tags(self):
         """Test retrieving a list of tags."""
@@ -59,9 +63,9 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL)
 
         # Ordering by negative name (opposite alphabetically)
-        tags = Tag.objects.all().order_by('-name')
+        tags = with_recipe_count(Tag.objects.all()).order_by('-name')
 
-        serializer = TagSerializer(tags, many=True)
+        serializer = TagCountSerializer(tags, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
 
@@ -90,6 +94,39 @@ class PrivateTagsApiTests(TestCase):
         tag.refresh_from_db()
         self.assertEqual(tag.name, payload['name'])
 
+    def test_update_tag_duplicate_name(self):
+        """Test renaming a tag to another of the user's tags fails."""
+        Tag.objects.create(user=self.user, name='Dessert')
+        tag = Tag.objects.create(user=self.user, name='After Dinner')
+
+        payload = {'name': 'Dessert'}
+        url = detail_url(tag.id)
+        res = self.client.patch(url, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'After Dinner')
+
+    def test_tags_not_modified(self):
+        """Test an unchanged tag list is answered with a 304."""
+        tag = Tag.objects.create(user=self.user, name='Breakfast')
+        etag = self.client.get(TAGS_URL)['ETag']
+
+        res = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.patch(detail_url(tag.id), {'name': 'Brunch'})
+        res = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_tag_not_allowed(self):
+        """Test tags have no detail GET."""
+        tag = Tag.objects.create(user=self.user, name='Breakfast')
+
+        res = self.client.get(detail_url(tag.id))
+
+        self.assertEqual(res.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
     def test_delete_tag(self):
         """Test deleting a tag."""
         tag = Tag.objects.create(user=self.user, name='Breakfast')
@@ -101,44 +138,220 @@ class PrivateTagsApiTests(TestCase):
         tags = Tag.objects.filter(user=self.user)
         self.assertFalse(tags.exists())
 
-    # def test_filter_tags_assigned_to_recipes(self):
-    #     """Test listing tags to those assigned to recipes."""
-    #     tag1 = Tag.objects.create(user=self.user, name='Breakfast')
-    #     tag2 = Tag.objects.create(user=self.user, name='Lunch')
-    #     recipe = Recipe.objects.create(
-    #         title='Green Eggs on Toast',
-    #         time_minutes=10,
-    #         price=Decimal('2.50'),
-    #         user=self.user,
-    #     )
-    #     recipe.tags.add(tag1)
-
-    #     res = self.client.get(TAGS_URL, {'assigned_only': 1})
-
-    #     s1 = TagSerializer(tag1)
-    #     s2 = TagSerializer(tag2)
-    #     self.assertIn(s1.data, res.data)
-    #     self.assertNotIn(s2.data, res.data)
-
-    # def test_filtered_tags_unique(self):
-    #     """Test filtered tags returns a unique list."""
-    #     tag = Tag.objects.create(user=self.user, name='Breakfast')
-    #     Tag.objects.create(user=self.user, name='Dinner')
-    #     recipe1 = Recipe.objects.create(
-    #         title='Pancakes',
-    #         time_minutes=5,
-    #         price=Decimal('5.00'),
-    #         user=self.user,
-    #     )
-    #     recipe2 = Recipe.objects.create(
-    #         title='Porridge',
-    #         time_minutes=3,
-    #         price=Decimal('2.00'),
-    #         user=self.user,
-    #     )
-    #     recipe1.tags.add(tag)
-    #     recipe2.tags.add(tag)
-
-    #     res = self.client.get(TAGS_URL, {'assigned_only': 1})
-
-    #     self.assertEqual(len(res.data), 1)
+    def test_filter_tags_assigned_to_recipes(self):
+        """Test listing tags to those assigned to recipes."""
+        tag1 = Tag.objects.create(user=self.user, name='Breakfast')
+        tag2 = Tag.objects.create(user=self.user, name='Lunch')
+        recipe = Recipe.objects.create(
+            title='Green Eggs on Toast',
+            time_minutes=10,
+            price=Decimal('2.50'),
+            user=self.user,
+        )
+        recipe.tags.add(tag1)
+
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data, [{'id': tag1.id, 'name': tag1.name, 'recipe_count': 1}],
+        )
+        self.assertNotIn(tag2.id, [tag['id'] for tag in res.data])
+
+    def test_filtered_tags_unique(self):
+        """Test filtered tags returns a unique list."""
+        tag = Tag.objects.create(user=self.user, name='Breakfast')
+        Tag.objects.create(user=self.user, name='Dinner')
+        recipe1 = Recipe.objects.create(
+            title='Pancakes',
+            time_minutes=5,
+            price=Decimal('5.00'),
+            user=self.user,
+        )
+        recipe2 = Recipe.objects.create(
+            title='Porridge',
+            time_minutes=3,
+            price=Decimal('2.00'),
+            user=self.user,
+        )
+        recipe1.tags.add(tag)
+        recipe2.tags.add(tag)
+
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        self.assertEqual(len(res.data), 1)
+        self.assertEqual(res.data[0]['recipe_count'], 2)
+
+    def _create_used_tags(self, count):
+        """Create tags used by one recipe and an unused one."""
+        recipe = Recipe.objects.create(
+            title='Pancakes',
+            time_minutes=5,
+            price=Decimal('5.00'),
+            user=self.user,
+        )
+        for i in range(count):
+            recipe.tags.add(Tag.objects.create(user=self.user, name=f'T{i}'))
+        Tag.objects.create(user=self.user, name='Unused')
+
+    def test_recipe_counts_query_count(self):
+        """Test recipe counts are aggregated once per data version."""
+        self._create_used_tags(10)
+
+        # The data version, the counts of all tags, then the tags
+        with self.assertNumQueries(3):
+            res = self.client.get(TAGS_URL)
+        # The counts are cached until the data changes
+        with self.assertNumQueries(2):
+            self.client.get(TAGS_URL)
+
+        counts = {tag['name']: tag['recipe_count'] for tag in res.data}
+        self.assertEqual(counts['T0'], 1)
+        self.assertEqual(counts['Unused'], 0)
+
+    def test_assigned_only_queried(self):
+        """Test assigned_only filters in the query, not the counts."""
+        self._create_used_tags(2)
+        unused = Tag.objects.get(user=self.user, name='Unused')
+        self.client.get(TAGS_URL)
+        # Linked without a data version bump, so the counts are cached
+        Recipe.objects.get(user=self.user).tags.add(unused)
+
+        # The data version, then the used tags
+        with self.assertNumQueries(2):
+            res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        self.assertEqual(
+            [tag['name'] for tag in res.data], ['Unused', 'T1', 'T0'],
+        )
+
+    @override_settings(NAME_SUGGESTION_CACHE_SIZE=0)
+    def test_recipe_counts_without_cache(self):
+        """Test the tags and their counts are read by one query."""
+        self._create_used_tags(10)
+
+        # The data version, then the tags with their counts
+        with self.assertNumQueries(2):
+            res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        self.assertEqual(len(res.data), 10)
+        self.assertEqual(res.data[0], {
+            'id': res.data[0]['id'], 'name': 'T9', 'recipe_count': 1,
+        })
+
+    def test_recipe_counts_updated(self):
+        """Test recipe counts follow writes to recipes."""
+        tag = Tag.objects.create(user=self.user, name='Breakfast')
+        self.client.get(TAGS_URL)
+
+        self.client.post(reverse('recipe:recipe-list'), {
+            'title': 'Toast',
+            'time_minutes': 5,
+            'price': '1.00',
+            'tags': [{'name': tag.name}],
+        }, format='json')
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        self.assertEqual(
+            res.data, [{'id': tag.id, 'name': tag.name, 'recipe_count': 1}],
+        )
+
+    def test_invalid_assigned_only(self):
+        """Test values of assigned_only other than 0 and 1 are refused."""
+        res = self.client.get(TAGS_URL, {'assigned_only': 'yes'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SuggestTagsApiTests(TestCase):
+    """Test tag name suggestions."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        suggestion_cache.clear()
+        self.addCleanup(suggestion_cache.clear)
+
+    def _create_tags(self, recipe_counts):
+        """Create tags used by the given number of recipes, by name."""
+        tags = {}
+        for name, count in recipe_counts.items():
+            tags[name] = Tag.objects.create(user=self.user, name=name)
+            for _ in range(count):
+                Recipe.objects.create(
+                    user=self.user,
+                    title='Recipe',
+                    time_minutes=5,
+                    price=Decimal('1.00'),
+                ).tags.add(tags[name])
+        return tags
+
+    def test_suggest_by_prefix(self):
+        """Test names with the prefix are listed, most used first."""
+        tags = self._create_tags(
+            {'Breakfast': 1, 'brunch': 3, 'Bread': 0, 'Dinner': 5},
+        )
+        other_user = create_user(email='other@example.com')
+        Tag.objects.create(user=other_user, name='Brunch time')
+
+        res = self.client.get(TAGS_URL, {'q': 'BR'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, TagSerializer(
+            [tags['brunch'], tags['Breakfast'], tags['Bread']], many=True,
+        ).data)
+
+    def test_limit(self):
+        """Test the number of suggestions is limited."""
+        self._create_tags({'Breakfast': 1, 'Brunch': 3, 'Bread': 0})
+
+        res = self.client.get(TAGS_URL, {'q': 'b', 'limit': 2})
+
+        self.assertEqual(
+            [tag['name'] for tag in res.data],
+            ['Brunch', 'Breakfast'],
+        )
+
+    def test_invalid_limit(self):
+        """Test limits out of range are refused."""
+        for limit in ('0', '51', 'ten'):
+            res = self.client.get(TAGS_URL, {'q': 'b', 'limit': limit})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cached_until_write(self):
+        """Test suggestions are cached until the user's data changes."""
+        self._create_tags({'Breakfast': 1})
+        self.client.get(TAGS_URL, {'q': 'b'})
+
+        # Only the data version is read
+        with self.assertNumQueries(1):
+            res = self.client.get(TAGS_URL, {'q': 'br'})
+        self.assertEqual([tag['name'] for tag in res.data], ['Breakfast'])
+
+        self.client.post(reverse('recipe:recipe-list'), {
+            'title': 'Toast',
+            'time_minutes': 5,
+            'price': '1.00',
+            'tags': [{'name': 'Brunch'}, {'name': 'Bread'}],
+        }, format='json')
+        res = self.client.get(TAGS_URL, {'q': 'br'})
+
+        self.assertEqual(
+            [tag['name'] for tag in res.data],
+            ['Bread', 'Breakfast', 'Brunch'],
+        )
+
+    @override_settings(NAME_SUGGESTION_CACHE_SIZE=0)
+    def test_without_cache(self):
+        """Test suggestions are queried when the cache is disabled."""
+        self._create_tags({'Breakfast': 1, 'brunch': 3, 'Dinner': 5})
+
+        with self.assertNumQueries(2):
+            res = self.client.get(TAGS_URL, {'q': 'BR'})
+
+        self.assertEqual(
+            [tag['name'] for tag in res.data],
+            ['brunch', 'Breakfast'],
+        )
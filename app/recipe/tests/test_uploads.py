@@ -0,0 +1,197 @@
+"""
+Tests for recipe image uploads.
+"""
+import os
+from decimal import Decimal
+from io import BytesIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from PIL import Image, PngImagePlugin
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.tests.utils import TempMediaRootMixin
+from recipe.uploads import ORIENTATION
+
+
+def image_upload_url(recipe_id):
+    """Create and return an image upload URL."""
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
+def image_file(image_format='JPEG', name=None, size=(40, 20), **options):
+    """Return an in-memory image file saved with options."""
+    f = BytesIO()
+    image = Image.new('RGB', size, 'red')
+    image.putpixel((0, 0), (0, 0, 255))
+    image.save(f, format=image_format, **options)
+    f.name = name or f'image.{image_format.lower()}'
+    f.seek(0)
+    return f
+
+
+def image_pixel(**options):
+    """Return the top left pixel of image_file decoded."""
+    return Image.open(image_file(**options)).getpixel((0, 0))
+
+
+def exif(orientation=None):
+    """Return Exif data with a camera model and orientation."""
+    data = Image.Exif()
+    # Camera model
+    data[0x0110] = 'Secret Camera'
+    if orientation:
+        data[ORIENTATION] = orientation
+    return data
+
+
+# Renditions decode the image, they are left out here
+@override_settings(RECIPE_IMAGE_WORKERS=1)
+@patch('recipe.renditions.get_executor')
+class ImageUploadTests(TempMediaRootMixin, TestCase):
+    """Test uploading recipe images."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+
+    def _upload(self, f):
+        """Upload a file as the recipe image."""
+        return self.client.post(
+            image_upload_url(self.recipe.id),
+            {'image': f},
+            format='multipart',
+        )
+
+    def _stored(self):
+        """Return the stored image file, opened."""
+        self.recipe.refresh_from_db()
+        return Image.open(default_storage.open(self.recipe.image.name))
+
+    def test_upload_jpeg_strips_metadata(self, mock_get_executor):
+        """Test Exif data and comments are removed from JPEGs."""
+        res = self._upload(image_file(exif=exif(), comment=b'secret'))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('image', res.data)
+        image = self._stored()
+        self.assertEqual(dict(image.getexif()), {})
+        self.assertNotIn('comment', image.info)
+        self.assertEqual(image.getpixel((0, 0)), image_pixel(exif=exif()))
+
+    def test_upload_jpeg_keeps_orientation(self, mock_get_executor):
+        """Test the Exif orientation is the only Exif data kept."""
+        self._upload(image_file(exif=exif(orientation=6)))
+
+        self.assertEqual(dict(self._stored().getexif()), {ORIENTATION: 6})
+
+    def test_upload_png_strips_metadata(self, mock_get_executor):
+        """Test text chunks are removed from PNGs."""
+        info = PngImagePlugin.PngInfo()
+        info.add_text('Author', 'secret')
+
+        res = self._upload(image_file('PNG', pnginfo=info))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        image = self._stored()
+        self.assertNotIn('Author', image.info)
+        self.assertEqual(image.getpixel((0, 0)), (0, 0, 255))
+
+    def test_upload_webp_strips_metadata(self, mock_get_executor):
+        """Test Exif chunks are removed from WebPs."""
+        res = self._upload(image_file('WEBP', exif=exif(), lossless=True))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        image = self._stored()
+        self.assertNotIn('exif', image.info)
+        self.assertEqual(image.getpixel((0, 0)), (0, 0, 255))
+
+    def test_extension_from_format(self, mock_get_executor):
+        """Test images are stored with the extension of their format."""
+        self._upload(image_file('PNG', name='image.jpg'))
+
+        self.recipe.refresh_from_db()
+        self.assertTrue(self.recipe.image.name.endswith('.png'))
+
+    def test_not_decoded(self, mock_get_executor):
+        """Test uploads are checked without decoding the pixels."""
+        with patch(
+            'PIL.ImageFile.ImageFile.load',
+            side_effect=AssertionError('Image decoded'),
+        ):
+            res = self._upload(image_file(exif=exif()))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=799)
+    def test_too_many_pixels(self, mock_get_executor):
+        """Test images with too many pixels are refused."""
+        res = self._upload(image_file())
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('799 pixels', res.data['image'][0])
+
+    @override_settings(RECIPE_IMAGE_MAX_BYTES=1000)
+    def test_too_large(self, mock_get_executor):
+        """Test files over the size limit are refused while uploading."""
+        f = image_file(size=(400, 400), quality=100)
+
+        with patch.object(
+            TemporaryUploadedFile, 'close', autospec=True,
+            side_effect=TemporaryUploadedFile.close,
+        ) as mock_close:
+            res = self._upload(f)
+
+        self.assertEqual(
+            res.status_code,
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+        # The partial upload was written to disk and deleted
+        temp_file = mock_close.call_args[0][0]
+        self.assertFalse(os.path.exists(temp_file.temporary_file_path()))
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    def test_invalid_image(self, mock_get_executor):
+        """Test files which are not images are refused."""
+        f = BytesIO(b'not an image')
+        f.name = 'image.jpg'
+
+        res = self._upload(f)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unsupported_format(self, mock_get_executor):
+        """Test images in other formats are refused."""
+        res = self._upload(image_file('GIF'))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_truncated_image(self, mock_get_executor):
+        """Test images cut off before the pixels are refused."""
+        data = image_file().getvalue()
+        f = BytesIO(data[:data.index(b'\xff\xda')])
+        f.name = 'image.jpg'
+
+        res = self._upload(f)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
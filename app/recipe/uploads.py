@@ -0,0 +1,258 @@
+"""
+Memory-bounded handling of recipe image uploads.
+
+Uploads are streamed to a temporary file and refused once they exceed
+RECIPE_IMAGE_MAX_BYTES. Only the image header is read to check the
+format and the number of pixels, then the file is copied once,
+chunk by chunk, without its metadata. Pixels are never decoded.
+"""
+import os
+import struct
+import warnings
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.temp import NamedTemporaryFile
+from django.core.files.uploadhandler import (
+    StopUpload,
+    TemporaryFileUploadHandler,
+)
+from django.template.defaultfilters import filesizeformat
+from django.utils.translation import gettext_lazy as _
+
+from PIL import Image
+
+from rest_framework import serializers
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Exif tag holding the orientation of the image
+ORIENTATION = 0x0112
+
+
+class BoundedUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploaded files to disk, stopping past max_bytes."""
+
+    def __init__(self, request=None, max_bytes=None):
+        super().__init__(request)
+        self.max_bytes = max_bytes
+        self.exceeded = False
+
+    def receive_data_chunk(self, raw_data, start):
+        """Write a chunk of the file unless it makes it too large."""
+        if start + len(raw_data) > self.max_bytes:
+            self.exceeded = True
+            # Reads and discards the rest of the request
+            raise StopUpload()
+        return super().receive_data_chunk(raw_data, start)
+
+
+def _read(src, size):
+    """Read exactly size bytes from src."""
+    data = src.read(size)
+    if len(data) != size:
+        raise ValueError('Unexpected end of file.')
+    return data
+
+
+def _copy(src, dst, size):
+    """Copy size bytes from src to dst in chunks."""
+    while size:
+        data = _read(src, min(size, CHUNK_SIZE))
+        dst.write(data)
+        size -= len(data)
+
+
+def _copy_rest(src, dst):
+    """Copy the rest of src to dst in chunks."""
+    for data in iter(lambda: src.read(CHUNK_SIZE), b''):
+        dst.write(data)
+
+
+def _orientation_segment(orientation):
+    """Return a JPEG APP1 segment holding only an Exif orientation."""
+    tiff = (
+        b'MM\x00\x2a' + struct.pack('>I', 8)
+        + struct.pack('>HHHIHHI', 1, ORIENTATION, 3, 1, orientation, 0, 0)
+    )
+    payload = b'Exif\x00\x00' + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+def strip_jpeg(src, dst, orientation=None):
+    """Copy a JPEG without comments and APPn segments.
+
+    JFIF (APP0), ICC profiles (APP2) and Adobe (APP14) segments are
+    kept, they affect how the image is displayed. So does the Exif
+    orientation, which is written back on its own.
+    """
+    if _read(src, 2) != b'\xff\xd8':
+        raise ValueError('Not a JPEG file.')
+    dst.write(b'\xff\xd8')
+    if orientation and orientation != 1:
+        dst.write(_orientation_segment(orientation))
+
+    while True:
+        if _read(src, 1) != b'\xff':
+            raise ValueError('Invalid JPEG marker.')
+        marker = _read(src, 1)[0]
+        while marker == 0xFF:
+            marker = _read(src, 1)[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            dst.write(bytes([0xFF, marker]))
+            continue
+
+        length = _read(src, 2)
+        size = struct.unpack('>H', length)[0] - 2
+        if marker == 0xDA:
+            # Start of scan, the compressed data and everything after
+            # it are copied as they are.
+            dst.write(bytes([0xFF, marker]) + length)
+            _copy_rest(src, dst)
+            return
+
+        payload = _read(src, size)
+        keep = True
+        if 0xE1 <= marker <= 0xEF or marker == 0xFE:
+            keep = marker == 0xEE or (
+                marker == 0xE2 and payload.startswith(b'ICC_PROFILE\x00')
+            )
+        if keep:
+            dst.write(bytes([0xFF, marker]) + length + payload)
+
+
+# Textual metadata, Exif and timestamps
+PNG_METADATA_CHUNKS = {b'tEXt', b'zTXt', b'iTXt', b'eXIf', b'tIME'}
+
+
+def strip_png(src, dst, orientation=None):
+    """Copy a PNG without its metadata chunks."""
+    signature = _read(src, 8)
+    if signature != b'\x89PNG\r\n\x1a\n':
+        raise ValueError('Not a PNG file.')
+    dst.write(signature)
+
+    chunk_type = None
+    while chunk_type != b'IEND':
+        header = _read(src, 8)
+        size, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type in PNG_METADATA_CHUNKS:
+            src.seek(size + 4, os.SEEK_CUR)
+        else:
+            dst.write(header)
+            # Data and CRC
+            _copy(src, dst, size + 4)
+
+
+# Flags of the VP8X chunk announcing Exif and XMP chunks
+WEBP_METADATA_FLAGS = 0x08 | 0x04
+
+
+def strip_webp(src, dst, orientation=None):
+    """Copy a WebP without its Exif and XMP chunks."""
+    riff, riff_size, webp = struct.unpack('<4sI4s', _read(src, 12))
+    if riff != b'RIFF' or webp != b'WEBP':
+        raise ValueError('Not a WebP file.')
+    start = dst.tell()
+    dst.write(struct.pack('<4sI4s', riff, 0, webp))
+
+    remaining = riff_size - 4
+    while remaining > 0:
+        chunk_type, size = struct.unpack('<4sI', _read(src, 8))
+        padded = size + size % 2
+        remaining -= 8 + padded
+        if chunk_type in (b'EXIF', b'XMP '):
+            src.seek(padded, os.SEEK_CUR)
+            continue
+
+        dst.write(struct.pack('<4sI', chunk_type, size))
+        if chunk_type == b'VP8X':
+            data = bytearray(_read(src, padded))
+            data[0] &= ~WEBP_METADATA_FLAGS & 0xFF
+            dst.write(data)
+        else:
+            _copy(src, dst, padded)
+
+    end = dst.tell()
+    dst.seek(start + 4)
+    dst.write(struct.pack('<I', end - start - 8))
+    dst.seek(end)
+
+
+# Accepted formats, their extension and how to strip their metadata
+IMAGE_FORMATS = {
+    'JPEG': ('.jpg', strip_jpeg),
+    'PNG': ('.png', strip_png),
+    'WEBP': ('.webp', strip_webp),
+}
+
+
+def inspect_image(f):
+    """Return the format, size and orientation from the image header."""
+    f.seek(0)
+    with warnings.catch_warnings():
+        # Refused below against the lower RECIPE_IMAGE_MAX_PIXELS
+        warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+        with Image.open(f) as image:
+            orientation = None
+            if image.format == 'JPEG':
+                orientation = image.getexif().get(ORIENTATION)
+            return image.format, image.size, orientation
+
+
+class UploadedImageField(serializers.ImageField):
+    """Image field checking uploads without decoding them.
+
+    The format and dimensions are read from the header and the file
+    is replaced by a copy without metadata.
+    """
+    default_error_messages = {
+        'invalid_image': _(
+            'Upload a valid JPEG, PNG or WebP image.'
+        ),
+        'too_large': _(
+            'Images must be smaller than {max_bytes}.'
+        ),
+        'too_many_pixels': _(
+            'Images must have at most {max_pixels} pixels.'
+        ),
+    }
+
+    def to_internal_value(self, data):
+        """Validate an uploaded image and strip its metadata."""
+        # FileField checks the name and size; ImageField would verify
+        # the whole image with Pillow, which the header check replaces.
+        data = serializers.FileField.to_internal_value(self, data)
+        if data.size > settings.RECIPE_IMAGE_MAX_BYTES:
+            self.fail('too_large', max_bytes=filesizeformat(
+                settings.RECIPE_IMAGE_MAX_BYTES,
+            ))
+
+        max_pixels = settings.RECIPE_IMAGE_MAX_PIXELS
+        try:
+            image_format, (width, height), orientation = inspect_image(data)
+        except Image.DecompressionBombError:
+            # Far beyond any sensible limit, Pillow refuses to open it
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+        except (OSError, ValueError, SyntaxError):
+            self.fail('invalid_image')
+        if width * height > max_pixels:
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+        if image_format not in IMAGE_FORMATS:
+            self.fail('invalid_image')
+
+        ext, strip = IMAGE_FORMATS[image_format]
+        stripped = NamedTemporaryFile(
+            suffix=ext, dir=settings.FILE_UPLOAD_TEMP_DIR,
+        )
+        data.seek(0)
+        try:
+            strip(data, stripped, orientation)
+        except (ValueError, struct.error):
+            stripped.close()
+            self.fail('invalid_image')
+        stripped.seek(0)
+
+        name = os.path.splitext(os.path.basename(data.name))[0]
+        return File(stripped, name=f'{name}{ext}')
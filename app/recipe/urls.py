@@ -24,4 +24,9 @@ app_name = 'recipe'
 
 urlpatterns = [
     path('', include(router.urls)),
+    path(
+        'media/<path:name>',
+        views.RecipeMediaView.as_view(),
+        name='media',
+    ),
 ]
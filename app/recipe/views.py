@@ -1,28 +1,79 @@
 """
 Views for the recipe APIs
 """
+import mimetypes
+import posixpath
+from urllib.parse import quote
 
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import (
     viewsets,
     mixins,
     status,
+    views,
 )
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema
+
+from django.conf import settings
+from django.db import transaction
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    StreamingHttpResponse,
+)
+from django.template.defaultfilters import filesizeformat
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils.cache import patch_cache_control
+from django.utils.translation import gettext as _
+
 from core.models import (
     Recipe,
     Tag,
     Ingredient
 )
 from recipe import serializers
+from recipe.export import iter_csv, iter_ndjson
+from recipe.filters import RecipeRelationFilter, parse_ids, parse_limit
+from recipe.listing import RECIPE_LIST_FIELDS, serialize_recipe_rows
+from recipe.media import (
+    get_storage,
+    release_images_on_commit,
+    user_has_image,
+)
+from recipe.mixins import (
+    CachedResponseMixin,
+    ConditionalGetMixin,
+    ConditionalRetrieveMixin,
+    RowListMixin,
+)
+from recipe.pagination import RecipeCursorPagination
+from recipe.pantry import get_pantry_index
+from recipe.search import (
+    RANK_FIELD,
+    RecipeSearchFilter,
+    get_search_terms,
+)
+from recipe.similarity import (
+    similar_recipes,
+    update_signatures_in_batches,
+)
+from recipe.suggestions import list_with_counts, suggest
+from recipe.uploads import BoundedUploadHandler
+from user.authentication import CachedTokenAuthentication
 
 
 # ModelViewSet has a lot of pre-defined logic to work with
 # models for CRUD ops
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(CachedResponseMixin,
+                    ConditionalRetrieveMixin,
+                    RowListMixin,
+                    viewsets.ModelViewSet):
     """View for manage recipe APIs."""
     serializer_class = serializers.RecipeDetailSerializer
 
@@ -30,18 +81,69 @@ class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
 
     # Defines auth method for the API
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
 
     # Checks for authenticated users to be able to use
     # the API
     permission_classes = [IsAuthenticated]
 
+    # Pages through the list by id instead of returning every recipe
+    pagination_class = RecipeCursorPagination
+
+    # ?tags= and ?ingredients= filters, ?search= full-text search
+    filter_backends = [RecipeRelationFilter, RecipeSearchFilter]
+
+    # Most recipes a single bulk request can write
+    bulk_max_items = 1000
+
+    # Columns loaded for the list, see serialize_rows
+    list_fields = RECIPE_LIST_FIELDS
+
+    # Recipes loaded per query while streaming an export
+    export_chunk_size = 500
+
+    # Most ingredients of a pantry and recipes matched against it
+    pantry_max_ingredients = 500
+    pantry_limit = 25
+    pantry_max_limit = 100
+
+    # Most similar recipes returned and candidates compared per lookup
+    similar_limit = 10
+    similar_max_limit = 50
+    similar_max_candidates = 200
+
+    # Export formats and their content type and generator
+    export_formats = {
+        'ndjson': ('application/x-ndjson', iter_ndjson),
+        'csv': ('text/csv; charset=utf-8', iter_csv),
+    }
+
     # Overiding the get_queryset method so that only available
     # recipes to manage throught the APIs are the
     # ones created by the current user
     def get_queryset(self):
         """Retrieve recipes for authenticated user."""
-        return self.queryset.filter(user=self.request.user).order_by('-id')
+        queryset = self.queryset.filter(user=self.request.user)
+
+        # The nested tag and ingredient serializers would otherwise
+        # run two extra queries per recipe. The list loads its rows
+        # and relations itself (see serialize_rows) and writes replace
+        # the relations, so only retrieve needs them prefetched.
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'tags',
+                    queryset=Tag.objects.only('id', 'name').order_by('id'),
+                ),
+                Prefetch(
+                    'ingredients',
+                    queryset=Ingredient.objects.only(
+                        'id', 'name',
+                    ).order_by('id'),
+                ),
+            )
+
+        return queryset.order_by('-id')
 
     # Override the get_serializer_class function to use the RecipeSerializer
     # class is the action is list but in all other cases use the
@@ -52,9 +154,22 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return serializers.RecipeSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'bulk' and self.request.method == 'DELETE':
+            return serializers.RecipeBulkDeleteSerializer
 
         return self.serializer_class
 
+    def get_list_fields(self):
+        """Return the list columns, with the rank while searching."""
+        if get_search_terms(self.request):
+            # Read by the pagination to build the cursors
+            return self.list_fields + [RANK_FIELD]
+        return self.list_fields
+
+    def serialize_rows(self, rows):
+        """Return the RecipeSerializer representation of list rows."""
+        return serialize_recipe_rows(rows, self.request)
+
     # Override the perform_create function
     # Everytime you create a new recipe through this ViewSet
     # Call this method after the validated data
@@ -62,11 +177,32 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Create a new recipe."""
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        """Delete a recipe."""
+        recipe_id = instance.id
+        instance.delete()
+        serializers.bump_data_version(self.request.user.id, {recipe_id: None})
+        release_images_on_commit([instance.image.name])
+
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         """Upload an image to recipe."""
+        # Set before the body is parsed, so the file goes straight to
+        # disk and large files are dropped while they arrive.
+        upload_handler = BoundedUploadHandler(
+            request._request, settings.RECIPE_IMAGE_MAX_BYTES,
+        )
+        request._request.upload_handlers = [upload_handler]
+
         recipe = self.get_object()
         serializer = self.get_serializer(recipe, data=request.data)
+        if upload_handler.exceeded:
+            return Response(
+                {'image': [_('Images must be smaller than %s.') % (
+                    filesizeformat(settings.RECIPE_IMAGE_MAX_BYTES)
+                )]},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
 
         if serializer.is_valid():
             serializer.save()
@@ -74,34 +210,341 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['GET'], detail=False)
+    def pantry(self, request):
+        """List the recipes best covered by ?ingredients=, a pantry.
+
+        Fully makeable recipes come first, then those missing the
+        fewest ingredients, each with the number and list of ingredients
+        it is missing.
+        """
+        return self._conditional(self._pantry, request)
+
+    def _pantry(self, request):
+        ingredient_ids = parse_ids(
+            'ingredients',
+            request.query_params.get('ingredients', ''),
+            max_ids=self.pantry_max_ingredients,
+        )
+        limit = parse_limit(
+            request, 'limit', self.pantry_limit, self.pantry_max_limit,
+        )
+        matches = get_pantry_index(
+            request.user.id, self.data_version,
+        ).match(ingredient_ids, limit)
+
+        recipes = self.get_queryset().filter(
+            id__in=[recipe_id for recipe_id, _ in matches],
+        ).values(*self.list_fields)
+        rows = {row['id']: row for row in recipes}
+        # Recipes deleted since the index was built are skipped
+        data = self.serialize_rows([
+            rows[recipe_id] for recipe_id, _ in matches if recipe_id in rows
+        ])
+        missing_counts = dict(matches)
+        held = set(ingredient_ids)
+        for item in data:
+            item['missing_count'] = missing_counts[item['id']]
+            item['missing_ingredients'] = [
+                ingredient for ingredient in item['ingredients']
+                if ingredient['id'] not in held
+            ]
+        return Response(data)
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """List the recipes sharing the most tags and ingredients.
+
+        Each comes with its estimated Jaccard similarity to the recipe,
+        the most similar first.
+        """
+        return self._conditional(self._similar, request, pk=pk)
+
+    def _similar(self, request, pk=None):
+        limit = parse_limit(
+            request, 'limit', self.similar_limit, self.similar_max_limit,
+        )
+        matches = similar_recipes(
+            self.get_object(), limit, self.similar_max_candidates,
+        )
+
+        recipes = self.get_queryset().filter(
+            id__in=[recipe_id for recipe_id, _ in matches],
+        ).values(*self.list_fields)
+        rows = {row['id']: row for row in recipes}
+        found = [
+            (rows[recipe_id], similarity)
+            for recipe_id, similarity in matches if recipe_id in rows
+        ]
+        data = self.serialize_rows([row for row, _ in found])
+        for item, (row, similarity) in zip(data, found):
+            item['similarity'] = round(similarity, 3)
+        return Response(data)
+
+    # The format is not read from ?format= because DRF uses that one to
+    # pick the renderer, and exports bypass the renderers.
+    @action(methods=['GET'], detail=False)
+    def export(self, request):
+        """Stream the user's recipes, or search results, as NDJSON or CSV."""
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in self.export_formats:
+            raise ValidationError({'export_format': [
+                _('Expected one of: %s.') % ', '.join(self.export_formats)
+            ]})
+
+        content_type, iter_export = self.export_formats[export_format]
+        response = StreamingHttpResponse(
+            iter_export(
+                self.filter_queryset(self.get_queryset()),
+                self.export_chunk_size,
+                request,
+            ),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="recipes.{export_format}"'
+        )
+        return response
+
+    def _get_bulk_instances(self, items):
+        """Return the user's recipes for the ids in items, in order."""
+        ids = [item.get('id') if isinstance(item, dict) else None
+               for item in items]
+        # JSON true and false are bools, which are ints in Python
+        ids = [
+            id if isinstance(id, int) and not isinstance(id, bool) else None
+            for id in ids
+        ]
+        recipes = self.get_queryset().in_bulk(
+            [id for id in ids if id is not None]
+        )
+        errors = [
+            {} if recipes.get(id) else {'id': [_('Recipe not found.')]}
+            for id in ids
+        ]
+        if any(errors):
+            raise ValidationError(errors)
+        if len(set(ids)) != len(ids):
+            raise ValidationError(
+                {'non_field_errors': [_('Recipe ids must be unique.')]}
+            )
+
+        return [recipes[id] for id in ids]
+
+    # Bulk create, update and delete share one URL and are told apart
+    # by the HTTP method. Writes run in a single transaction so that
+    # either every item is applied or none is.
+    @action(methods=['POST', 'PATCH', 'DELETE'], detail=False)
+    def bulk(self, request):
+        """Create, update or delete many recipes at once."""
+        if request.method == 'DELETE':
+            return self._bulk_destroy(request)
+
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError(
+                {'non_field_errors': [_('Expected a list of recipes.')]}
+            )
+        if len(items) > self.bulk_max_items:
+            raise ValidationError({'non_field_errors': [
+                _('At most %d recipes can be sent at once.')
+                % self.bulk_max_items
+            ]})
+
+        with transaction.atomic():
+            if request.method == 'POST':
+                serializer = self.get_serializer(data=items, many=True)
+                serializer.is_valid(raise_exception=True)
+                serializer.save(user=self.request.user)
+                status_code = status.HTTP_201_CREATED
+            else:
+                serializer = self.get_serializer(
+                    self._get_bulk_instances(items),
+                    data=items,
+                    many=True,
+                    partial=True,
+                )
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+                status_code = status.HTTP_200_OK
+
+        # Load the relations of every recipe with one query each
+        prefetch_related_objects(serializer.instance, 'tags', 'ingredients')
+        return Response(serializer.data, status=status_code)
+
+    def _bulk_destroy(self, request):
+        """Delete the recipes listed in the request."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+
+        with transaction.atomic():
+            recipes = self.get_queryset().filter(id__in=ids)
+            images = dict(recipes.values_list('id', 'image'))
+            deleted = set(images)
+            recipes.delete()
+            if deleted:
+                serializers.bump_data_version(
+                    self.request.user.id, dict.fromkeys(deleted),
+                )
+                release_images_on_commit(images.values())
+
+        return Response([{'id': id, 'deleted': id in deleted} for id in ids])
+
+
+class RecipeMediaView(views.APIView):
+    """Serve recipe images to the owners of the recipes using them.
+
+    Behind the proxy the view only checks access and the proxy sends
+    the file (see MEDIA_ACCEL_REDIRECT_PREFIX), so workers never
+    stream images.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    # Stored files are named after their content and never change
+    cache_max_age = 365 * 24 * 60 * 60
+
+    @extend_schema(
+        responses={(200, 'image/*'): OpenApiTypes.BINARY, 404: None},
+    )
+    def get(self, request, name):
+        """Return the image file name if the user may read it."""
+        if posixpath.normpath(name) != name or \
+                not user_has_image(request.user, name):
+            raise Http404()
+
+        prefix = settings.MEDIA_ACCEL_REDIRECT_PREFIX
+        if prefix:
+            # The proxy sets the cache headers of the file
+            response = HttpResponse(
+                content_type=mimetypes.guess_type(name)[0],
+            )
+            response['X-Accel-Redirect'] = prefix + quote(name)
+            return response
+
+        try:
+            response = FileResponse(get_storage().open(name))
+        except FileNotFoundError:
+            raise Http404()
+        patch_cache_control(
+            response, private=True, max_age=self.cache_max_age,
+            immutable=True,
+        )
+        return response
+
 
 # Mixin is a reusable code that adds extra functionality to a class
 # Here the mixin adds the listing capability to the class
-class TagViewSet(mixins.DestroyModelMixin,
-                 mixins.UpdateModelMixin,
-                 mixins.ListModelMixin,
-                 viewsets.GenericViewSet):
-    """Manage tags in the database."""
-    serializer_class = serializers.TagSerializer
-    queryset = Tag.objects.all()
-    authentication_classes = [TokenAuthentication]
+class BaseRecipeAttrViewSet(ConditionalGetMixin,
+                            mixins.DestroyModelMixin,
+                            mixins.UpdateModelMixin,
+                            mixins.ListModelMixin,
+                            viewsets.GenericViewSet):
+    """Base viewset for recipe attributes."""
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
+    # ?q= lists the names starting with it, most used first, at most
+    # ?limit= of them.
+    suggest_param = 'q'
+    suggest_limit_param = 'limit'
+    suggest_limit = 10
+    suggest_max_limit = 50
+
+    # The list counts the recipes of each entry, ?assigned_only=1
+    # leaves out the unused ones.
+    count_serializer_class = None
+    assigned_only_param = 'assigned_only'
+
     def get_queryset(self):
         """Filter queryset to authenticated user."""
         return self.queryset.filter(user=self.request.user).order_by('-name')
 
+    def get_serializer_class(self):
+        """Return the serializer class for request."""
+        if self.action == 'list':
+            return self.count_serializer_class
+        return self.serializer_class
+
+    def get_versioned_response(self, handler, version, request, *args,
+                               **kwargs):
+        """Answer lists and suggestions from the user's name index."""
+        if self.action != 'list':
+            return super().get_versioned_response(
+                handler, version, request, *args, **kwargs,
+            )
+
+        prefix = request.query_params.get(self.suggest_param)
+        if prefix is None:
+            return self._list_with_counts(request, version)
 
-class IngredientViewSet(mixins.DestroyModelMixin,
-                        mixins.UpdateModelMixin,
-                        mixins.ListModelMixin,
-                        viewsets.GenericViewSet):
+        rows = suggest(
+            self.get_queryset(), request.user.id, version, prefix,
+            parse_limit(
+                request, self.suggest_limit_param, self.suggest_limit,
+                self.suggest_max_limit,
+            ),
+        )
+        # Suggestions are names only
+        return Response(self.serializer_class(rows, many=True).data)
+
+    def _list_with_counts(self, request, version):
+        assigned_only = request.query_params.get(
+            self.assigned_only_param, '0',
+        )
+        if assigned_only not in ('0', '1'):
+            raise ValidationError({self.assigned_only_param: [
+                _('Expected 0 or 1.')
+            ]})
+
+        rows = list_with_counts(
+            self.get_queryset(), request.user.id, version,
+            assigned_only=assigned_only == '1',
+        )
+        return Response(self.get_serializer(rows, many=True).data)
+
+    def perform_update(self, serializer):
+        """Update an attribute, keeping names unique per user."""
+        name = serializer.validated_data.get('name')
+        others = self.get_queryset().exclude(id=serializer.instance.id)
+        if name is not None and others.filter(name=name).exists():
+            raise ValidationError(
+                {'name': [_('An entry with this name already exists.')]}
+            )
+
+        serializer.save()
+
+    def perform_destroy(self, instance):
+        """Delete an attribute.
+
+        The recipes that used it are indexed for similarity again
+        after the delete commits, in batches.
+        """
+        removed = [instance.id] if isinstance(instance, Ingredient) else []
+        with transaction.atomic():
+            recipes = list(instance.recipe_set.values_list('id', 'user_id'))
+            instance.delete()
+            serializers.bump_data_version(
+                self.request.user.id, removed_ingredients=removed,
+            )
+
+        if recipes:
+            # The recipes lost one of their tags or ingredients. Similar
+            # recipes cached meanwhile are dropped by the second bump.
+            update_signatures_in_batches(recipes)
+            serializers.bump_data_version(self.request.user.id)
+
+
+class TagViewSet(BaseRecipeAttrViewSet):
+    """Manage tags in the database."""
+    serializer_class = serializers.TagSerializer
+    count_serializer_class = serializers.TagCountSerializer
+    queryset = Tag.objects.all()
+
+
+class IngredientViewSet(BaseRecipeAttrViewSet):
     """Manage ingredients in the database."""
     serializer_class = serializers.IngredientSerializer
+    count_serializer_class = serializers.IngredientCountSerializer
     queryset = Ingredient.objects.all()
-    authentication_classes = [TokenAuthentication]
-    permission_classes = [IsAuthenticated]
-
-    def get_queryset(self):
-        """Filter queryset to authenticated user."""
-        return self.queryset.filter(user=self.request.user).order_by('-name')
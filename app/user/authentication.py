@@ -0,0 +1,98 @@
+"""
+Authentication for the APIs.
+"""
+import copy
+
+from django.conf import settings
+from django.core.cache import caches
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from core.cache import LRUCache
+
+
+# Resolved tokens of this process
+token_cache = LRUCache(
+    settings.TOKEN_AUTH_CACHE_SIZE,
+    settings.TOKEN_AUTH_CACHE_TTL,
+)
+
+
+def _shared_cache():
+    """Return the cache shared between processes, if one is configured."""
+    alias = settings.TOKEN_AUTH_SHARED_CACHE
+    return caches[alias] if alias else None
+
+
+def _shared_key(key):
+    """Return the shared cache key for a token key."""
+    return f'auth-token:{key}'
+
+
+def invalidate_token(key):
+    """Forget the resolution of a token key.
+
+    With TOKEN_AUTH_SHARED_CACHE every process stops using the token
+    at once. Without it only this process does, and the others keep
+    their copy until it expires after TOKEN_AUTH_CACHE_TTL seconds.
+    """
+    token_cache.delete(key)
+    shared_cache = _shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete(_shared_key(key))
+
+
+def invalidate_user_tokens(user_ids):
+    """Forget the resolution of every token of the users.
+
+    Saving a user does this through a signal. Writes which bypass
+    signals, such as QuerySet.update(is_active=False), must call it.
+    """
+    keys = Token.objects.filter(user_id__in=user_ids).values_list(
+        'key', flat=True,
+    )
+    for key in keys:
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication which caches the token to user lookup.
+
+    Resolved tokens are kept in the cache named by
+    TOKEN_AUTH_SHARED_CACHE when it is set, so that all processes see
+    an invalidation at once, and in a per process LRU cache otherwise.
+    Deleting a token or saving its user invalidates the cached entry.
+    """
+
+    def authenticate_credentials(self, key):
+        """Return the user and token for key, from cache if possible."""
+        shared_cache = _shared_cache()
+        # A local copy could outlive an invalidation made by another
+        # process, so the shared cache is the only layer when set.
+        cache = token_cache if shared_cache is None else None
+        if cache is not None:
+            cached = cache.get(key)
+        else:
+            cached = shared_cache.get(_shared_key(key))
+
+        if cached is None:
+            # Raises for unknown tokens and inactive users, neither of
+            # which is cached.
+            cached = super().authenticate_credentials(key)
+            if cache is not None:
+                cache.set(key, cached)
+            else:
+                shared_cache.set(
+                    _shared_key(key),
+                    cached,
+                    settings.TOKEN_AUTH_CACHE_TTL,
+                )
+
+        # Views may modify request.user, so every request gets its own
+        # copy of the cached objects.
+        user, token = cached
+        user = copy.copy(user)
+        token = copy.copy(token)
+        token.user = user
+        return (user, token)
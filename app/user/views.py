@@ -4,10 +4,11 @@ Views for the user API.
 
 # Generics has support for basic rest operations like
 # create, read, update and delete which can be implemented
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 
+from user.authentication import CachedTokenAuthentication
 from user.serializers import (
     UserSerializer,
     AuthTokenSerializer,
@@ -45,8 +46,8 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     # This generic class RetrieveUpdateAPIView handles update
     serializer_class = UserSerializer
 
-    # THe auth class set previously
-    authentication_classes = [authentication.TokenAuthentication]
+    # THe auth class set previously, caching the token lookup
+    authentication_classes = [CachedTokenAuthentication]
 
     # The only permission required for a user to access the
     # API is that they must be authenticated.
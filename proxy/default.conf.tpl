@@ -1,13 +1,36 @@
 server {
     listen ${LISTEN_PORT};
 
+    # Hands files to the socket without copying them through nginx
+    sendfile            on;
+    sendfile_max_chunk  1m;
+    tcp_nopush          on;
+
+    # Media is only sent through /protected-media once the app has
+    # checked access
+    location /static/media {
+        return 404;
+    }
+
     location /static {
         alias /vol/static;
     }
 
+    # Target of the X-Accel-Redirect answers of the app, unreachable
+    # from outside. Media files are named after their content and
+    # never change.
+    location /protected-media/ {
+        internal;
+        alias /vol/static/media/;
+        open_file_cache         max=10000 inactive=60s;
+        open_file_cache_errors  on;
+        add_header              Cache-Control "private, max-age=31536000, immutable";
+        add_header              X-Content-Type-Options nosniff;
+    }
+
     location / {
         uwsgi_pass              ${APP_HOST}:${APP_PORT};
         include                 /etc/nginx/uwsgi_params;
         client_max_body_size    10M;
     }
-}
\ No newline at end of file
+}
@@ -5,6 +5,10 @@ set -e
 python manage.py wait_for_db
 python manage.py collectstatic --noinput
 python manage.py migrate
+# Renditions whose task was lost when the previous workers exited
+python manage.py rebuild_renditions &
+# Search vectors of recipes created before full-text search existed
+python manage.py backfill_search_vectors &
 
 # 4 different workers are 4 instances ,
 # --module defines the app name